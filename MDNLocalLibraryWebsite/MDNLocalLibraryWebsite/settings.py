@@ -55,6 +55,8 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
 	'django.middleware.security.SecurityMiddleware',
 	'whitenoise.middleware.WhiteNoiseMiddleware',
+	'catalog.timing.RequestTimingMiddleware',
+	'catalog.routers.ReplicaRoutingMiddleware',
 	'django.contrib.sessions.middleware.SessionMiddleware',
 	'django.middleware.common.CommonMiddleware',
 	'django.middleware.csrf.CsrfViewMiddleware',
@@ -62,6 +64,7 @@ MIDDLEWARE = [
 	#'django.contrib.auth.middleware.SessionAuthenticationMiddleware',
 	'django.contrib.messages.middleware.MessageMiddleware',
 	'django.middleware.clickjacking.XFrameOptionsMiddleware',
+	'catalog.profiling.ProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'MDNLocalLibraryWebsite.urls'
@@ -89,6 +92,58 @@ WSGI_APPLICATION = 'MDNLocalLibraryWebsite.wsgi.application'
 # Redirect to home URL after login (Default redirects to /accounts/profile/)
 LOGIN_REDIRECT_URL = '/'
 
+# Cache shared by all the worker processes on the server. It holds the version
+# counters that invalidate cached page fragments, so it mustn't be per process
+# (like the default local-memory cache). Memcached or Redis are better choices
+# when there is more than one server.
+CACHES = {
+	'default': {
+		'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+		'LOCATION': os.path.join(BASE_DIR, 'cache'),
+	},
+	# The sessions (see catalog/sessions.py) have a cache of their own, so other
+	# data never culls them. It must hold every active session: raise
+	# MAX_ENTRIES if there are more.
+	'sessions': {
+		'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+		'LOCATION': os.path.join(BASE_DIR, 'cache', 'sessions'),
+		'OPTIONS': {'MAX_ENTRIES': 20000},
+	},
+}
+
+# Seconds the catalog detail page fragments are cached for (see catalog/fragments.py)
+CATALOG_FRAGMENT_CACHE_TIMEOUT = 3600
+
+# Home page visits are counted in the cache, and written to the database once this
+# many have been buffered, or when this many seconds have passed (see catalog/visits.py)
+VISIT_COUNTER_FLUSH_THRESHOLD = 100
+VISIT_COUNTER_FLUSH_INTERVAL = 30
+
+# Seconds between full rebuilds of each process's autocomplete index (see catalog/autocomplete.py)
+AUTOCOMPLETE_MAX_AGE = 600
+
+# Request timing (see catalog/timing.py): the fraction of requests measured,
+# and the limits above which a request is logged as a warning
+REQUEST_TIMING_SAMPLE_RATE = 0.1
+REQUEST_TIMING_THRESHOLDS = {'queries': 20, 'db_ms': 500, 'total_ms': 1000}
+
+# Request profiling (see catalog/profiling.py): staff users can add ?profile=1 to
+# a URL, and this fraction of all requests is profiled too. The reports are
+# written to REQUEST_PROFILING_DIRECTORY (BASE_DIR/profiles by default).
+REQUEST_PROFILING_SAMPLE_RATE = 0
+
+# Log the request timings (see catalog/timing.py) to the console
+LOGGING = {
+	'version': 1,
+	'disable_existing_loggers': False,
+	'handlers': {
+		'console': {'class': 'logging.StreamHandler'},
+	},
+	'loggers': {
+		'catalog.timing': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+	},
+}
+
 # Log any emails sent to the console (email must first be setup)
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 
@@ -152,5 +207,30 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 import dj_database_url
 db_from_env = dj_database_url.config(conn_max_age=500)
 DATABASES['default'].update(db_from_env)
+# The test database is a file rather than in-memory SQLite, so that tests can
+# use it from several threads at once (see LoanConcurrencyTest)
+if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+	DATABASES['default']['TEST'] = {'NAME': os.path.join(BASE_DIR, 'test_db.sqlite3')}
+
+# Read replicas, from a space separated list of database URLs in $DATABASE_REPLICA_URLS.
+# Reads go to a replica and writes to the default (primary) database (see catalog/routers.py).
+# In tests the replicas are the test database.
+DATABASE_REPLICAS = []
+for replica_number, replica_url in enumerate(os.environ.get('DATABASE_REPLICA_URLS', '').split(), 1):
+	DATABASES['replica%d' % replica_number] = dict(dj_database_url.parse(replica_url, conn_max_age=500), TEST={'MIRROR': 'default'})
+	DATABASE_REPLICAS.append('replica%d' % replica_number)
+DATABASE_ROUTERS = ['catalog.routers.PrimaryReplicaRouter']
+# Seconds a browser reads from the primary after a request that wrote, while the replicas catch up
+DATABASE_REPLICA_PIN_SECONDS = 5
+
+# Sessions are kept in the cache and written to the database in batches (see catalog/sessions.py)
+SESSION_ENGINE = 'catalog.sessions'
+SESSION_CACHE_ALIAS = 'sessions'
+SESSION_WRITE_BEHIND_THRESHOLD = 100
+SESSION_WRITE_BEHIND_INTERVAL = 30
+
+# Users' permissions are cached across requests (see catalog/permissions.py)
+AUTHENTICATION_BACKENDS = ['catalog.permissions.CachedPermissionBackend']
+PERMISSION_CACHE_TIMEOUT = 3600
 
 STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
\ No newline at end of file
@@ -55,6 +55,8 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
 	'django.middleware.security.SecurityMiddleware',
 	'whitenoise.middleware.WhiteNoiseMiddleware',
+	'catalog.timing.RequestTimingMiddleware',
+	'catalog.routers.ReplicaRoutingMiddleware',
 	'django.contrib.sessions.middleware.SessionMiddleware',
 	'django.middleware.common.CommonMiddleware',
 	'django.middleware.csrf.CsrfViewMiddleware',
@@ -62,6 +64,7 @@ MIDDLEWARE = [
 	#'django.contrib.auth.middleware.SessionAuthenticationMiddleware',
 	'django.contrib.messages.middleware.MessageMiddleware',
 	'django.middleware.clickjacking.XFrameOptionsMiddleware',
+	'catalog.profiling.ProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'MDNLocalLibraryWebsite.urls'
@@ -89,6 +92,19 @@ WSGI_APPLICATION = 'MDNLocalLibraryWebsite.wsgi.application'
 # Redirect to home URL after login (Default redirects to /accounts/profile/)
 LOGIN_REDIRECT_URL = '/'
 
+# The request timings (see catalog/timing.py) aren't logged during the tests,
+# which check them with assertLogs
+LOGGING = {
+	'version': 1,
+	'disable_existing_loggers': False,
+	'handlers': {
+		'null': {'class': 'logging.NullHandler'},
+	},
+	'loggers': {
+		'catalog.timing': {'handlers': ['null'], 'level': 'INFO', 'propagate': False},
+	},
+}
+
 # Log any emails sent to the console (email must first be setup)
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 
@@ -152,5 +168,24 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 import dj_database_url
 db_from_env = dj_database_url.config(conn_max_age=500)
 DATABASES['default'].update(db_from_env)
+# The test database is a file rather than in-memory SQLite, so that tests can
+# use it from several threads at once (see LoanConcurrencyTest)
+if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+	DATABASES['default']['TEST'] = {'NAME': os.path.join(BASE_DIR, 'test_db.sqlite3')}
+
+# Read replicas, from a space separated list of database URLs in $DATABASE_REPLICA_URLS.
+# Reads go to a replica and writes to the default (primary) database (see catalog/routers.py).
+# In tests the replicas are the test database.
+DATABASE_REPLICAS = []
+for replica_number, replica_url in enumerate(os.environ.get('DATABASE_REPLICA_URLS', '').split(), 1):
+	DATABASES['replica%d' % replica_number] = dict(dj_database_url.parse(replica_url, conn_max_age=500), TEST={'MIRROR': 'default'})
+	DATABASE_REPLICAS.append('replica%d' % replica_number)
+DATABASE_ROUTERS = ['catalog.routers.PrimaryReplicaRouter']
+
+# Sessions are kept in the cache and written to the database in batches (see catalog/sessions.py)
+SESSION_ENGINE = 'catalog.sessions'
+
+# Users' permissions are cached across requests (see catalog/permissions.py)
+AUTHENTICATION_BACKENDS = ['catalog.permissions.CachedPermissionBackend']
 
 STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
\ No newline at end of file
@@ -0,0 +1,108 @@
+"""
+Autocomplete benchmark: the in-memory prefix index (catalog/autocomplete.py)
+against a LIKE 'prefix%' query per keystroke.
+
+Seeds a database of the given size (or reuses one that is already seeded),
+builds the index (reporting the time and memory it takes), then looks up
+prefixes of 1 to 5 characters taken from random titles and author names,
+both ways, and reports the p50/p95 latency of each. Run it from the project
+directory:
+
+	python -m benchmarks.autocomplete_benchmark --books 100000 --copies 100000
+
+By default it uses a new SQLite file. Pass --database-url to use a
+PostgreSQL database (which is seeded if it has no books yet).
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.index_benchmark import setup_django
+from benchmarks.view_benchmark import percentile
+
+
+def parse_args():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('--books', type=int, default=20000)
+	parser.add_argument('--copies', type=int, default=20000)
+	parser.add_argument('--users', type=int, default=100)
+	parser.add_argument('--lookups', type=int, default=2000, help='Prefixes looked up.')
+	parser.add_argument('--database-url', help='Database to use instead of a temporary SQLite file.')
+	return parser.parse_args()
+
+
+def prefixes(count, seed=0):
+	"""
+	Returns count prefixes (1 to 5 characters) of random titles and author
+	last names.
+	"""
+	from catalog.models import Author, Book
+
+	rng = random.Random(seed)
+	names = list(Book.objects.values_list('title', flat=True)) + list(Author.objects.values_list('last_name', flat=True))
+	return [name[:rng.randint(1, 5)] for name in rng.sample(names, min(count, len(names)))]
+
+
+def like_lookup(prefix, limit=10):
+	"""
+	The query-per-keystroke alternative: the first titles and names starting
+	with the prefix.
+	"""
+	from catalog.models import Author, Book
+
+	books = list(Book.objects.filter(title__istartswith=prefix).order_by('title').values_list('id', 'title')[:limit])
+	authors = list(Author.objects.filter(last_name__istartswith=prefix).order_by('last_name')
+		.values_list('id', 'last_name', 'first_name')[:limit])
+	return books, authors
+
+
+def time_lookups(lookup, words):
+	timings = []
+	for word in words:
+		started = time.perf_counter()
+		lookup(word)
+		timings.append((time.perf_counter() - started) * 1000)
+	return percentile(timings, 0.5), percentile(timings, 0.95)
+
+
+def main():
+	args = parse_args()
+	database_url = args.database_url
+	if database_url is None:
+		database_url = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'benchmark.sqlite3')
+	setup_django(database_url)
+
+	from django.core.management import call_command
+	from benchmarks import dataset
+	from catalog import autocomplete
+	from catalog.models import Author, Book
+
+	print('Database: %s' % database_url)
+	call_command('migrate', verbosity=0)
+	if not Book.objects.exists():
+		dataset.seed(books=args.books, copies=args.copies, users=args.users)
+
+	index = autocomplete.PrefixIndex()
+	tracemalloc.start()
+	started = time.perf_counter()
+	index.rebuild()
+	elapsed = time.perf_counter() - started
+	size = tracemalloc.get_traced_memory()[0]
+	tracemalloc.stop()
+	print('%d books, %d authors: index built in %.0f ms, %d entries, %.1f MiB' % (Book.objects.count(),
+		Author.objects.count(), elapsed * 1000, sum(len(entries) for entries in index.entries.values()),
+		size / 1024.0 / 1024.0))
+
+	words = prefixes(args.lookups)
+	index.sync()
+	for label, lookup in (('index', index.lookup), ('LIKE query', like_lookup)):
+		p50, p95 = time_lookups(lookup, words)
+		print('%-12s p50 %8.3f ms   p95 %8.3f ms' % (label, p50, p95))
+
+
+if __name__ == '__main__':
+	main()
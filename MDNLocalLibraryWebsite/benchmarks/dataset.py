@@ -0,0 +1,84 @@
+"""
+Synthetic catalog data for the benchmarks. Rows are written with bulk_create,
+which skips the signal handlers, so the denormalized data (statistics, copy
+counts and search index) is rebuilt at the end.
+"""
+
+import datetime
+import random
+
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from catalog.models import Author, Book, BookInstance, CatalogStats, Genre
+from catalog import search
+
+WORDS = ('war', 'peace', 'night', 'river', 'garden', 'empire', 'shadow', 'winter', 'glass', 'silent',
+	'storm', 'crown', 'iron', 'letter', 'island', 'memory', 'stone', 'fire', 'house', 'road')
+GENRES = ('Fantasy', 'Science Fiction', 'Mystery', 'Romance', 'History', 'Poetry', 'Biography', 'Horror')
+BATCH_SIZE = 5000
+
+
+def _batches(rows, size=BATCH_SIZE):
+	batch = []
+	for row in rows:
+		batch.append(row)
+		if len(batch) == size:
+			yield batch
+			batch = []
+	if batch:
+		yield batch
+
+
+def seed(books=10000, copies=100000, users=1000, seed=0, stdout=None):
+	"""
+	Adds books (with one author per ten books), copies and borrowers to the
+	database. About a third of the copies are on loan, spread over the users,
+	with due dates a few weeks either side of today.
+	"""
+	rng = random.Random(seed)
+	today = datetime.date.today()
+
+	def log(message):
+		if stdout is not None:
+			stdout.write(message + '\n')
+
+	with transaction.atomic():
+		genres = [Genre.objects.get_or_create(name=name)[0] for name in GENRES]
+
+		log('Seeding %d users...' % users)
+		User.objects.bulk_create([User(username='reader%d' % n) for n in range(users)])
+		user_ids = list(User.objects.values_list('id', flat=True))
+
+		num_authors = max(1, books // 10)
+		log('Seeding %d authors...' % num_authors)
+		for batch in _batches(Author(first_name=rng.choice(WORDS).title(), last_name='%s%d' % (rng.choice(WORDS).title(), n))
+				for n in range(num_authors)):
+			Author.objects.bulk_create(batch)
+		author_ids = list(Author.objects.values_list('id', flat=True))
+
+		log('Seeding %d books...' % books)
+		for batch in _batches(Book(title='%s %s %d' % (rng.choice(WORDS).title(), rng.choice(WORDS), n),
+				summary=' '.join(rng.choice(WORDS) for i in range(30)), isbn='%013d' % n, author_id=rng.choice(author_ids))
+				for n in range(books)):
+			Book.objects.bulk_create(batch)
+		book_ids = list(Book.objects.values_list('id', flat=True))
+
+		Through = Book.genre.through
+		for batch in _batches(Through(book_id=book_id, genre_id=rng.choice(genres).id) for book_id in book_ids):
+			Through.objects.bulk_create(batch)
+
+		log('Seeding %d copies...' % copies)
+		def make_copy():
+			status = rng.choice('oooaaaaard')
+			on_loan = status in 'or'
+			return BookInstance(book_id=rng.choice(book_ids), imprint='Imprint %d' % rng.randint(1, 500), lang='English',
+				status=status, due_back=today + datetime.timedelta(days=rng.randint(-30, 30)) if on_loan else None,
+				borrower_id=rng.choice(user_ids) if status == 'o' else None)
+		for batch in _batches(make_copy() for n in range(copies)):
+			BookInstance.objects.bulk_create(batch)
+
+	log('Rebuilding the statistics, copy counts and search index...')
+	CatalogStats.rebuild()
+	Book.repair_copy_counts()
+	search.rebuild_index()
@@ -0,0 +1,104 @@
+"""
+Before/after benchmark for the loan and listing indexes (migration 0011).
+
+Seeds a throwaway database, then times the queries behind the paginated list
+views and prints their query plans, first without and then with the indexes.
+Run it from the project directory:
+
+	python -m benchmarks.index_benchmark --books 100000 --copies 1000000
+
+By default it uses a new SQLite file. Pass --database-url to benchmark an
+(empty!) PostgreSQL database instead.
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+INDEX_MIGRATION = '0011_loan_and_listing_indexes'
+BEFORE_MIGRATION = '0010_book_search_index'
+
+
+def parse_args():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('--books', type=int, default=20000)
+	parser.add_argument('--copies', type=int, default=200000)
+	parser.add_argument('--users', type=int, default=1000)
+	parser.add_argument('--repeat', type=int, default=50, help='Times each query is run.')
+	parser.add_argument('--database-url', help='Database to use instead of a temporary SQLite file.')
+	return parser.parse_args()
+
+
+def setup_django(database_url):
+	# The settings read the database from $DATABASE_URL (see dj_database_url)
+	os.environ['DATABASE_URL'] = database_url
+	os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'MDNLocalLibraryWebsite.settings')
+	import django
+	django.setup()
+
+
+def cases():
+	"""
+	Returns (name, queryset) pairs for the first and a deep page of each list.
+	The deep page cursor points 90% of the way through the list.
+	"""
+	from django.contrib.auth.models import User
+	from catalog.models import Author, Book, BookInstance
+	from catalog.pagination import CursorPaginator
+
+	borrower = User.objects.filter(bookinstance__status='o').first()
+	lists = [
+		('all-borrowed', BookInstance.objects.filter(status__exact='o')),
+		('my-borrowed', BookInstance.objects.filter(borrower=borrower).filter(status__exact='o')),
+		('books', Book.objects.all()),
+		('authors', Author.objects.all()),
+	]
+	result = []
+	for name, queryset in lists:
+		paginator = CursorPaginator(queryset, 10)
+		result.append(('%s first page' % name, paginator.page_queryset()[0]))
+		ordered = queryset.order_by(*paginator._ordering(True))
+		deep = ordered[int(ordered.count() * 0.9)]
+		result.append(('%s deep page' % name, paginator.page_queryset(paginator.encode_cursor(deep, True))[0]))
+	return result
+
+
+def measure(label, repeat):
+	print('\n=== %s ===' % label)
+	for name, queryset in cases():
+		timings = []
+		for i in range(repeat):
+			start = time.perf_counter()
+			list(queryset.all())
+			timings.append((time.perf_counter() - start) * 1000)
+		timings.sort()
+		print('\n%-26s median %8.3f ms   p95 %8.3f ms' % (name, statistics.median(timings), timings[int(len(timings) * 0.95) - 1]))
+		for line in queryset.explain().splitlines():
+			print('    ' + line)
+
+
+def main():
+	args = parse_args()
+	database_url = args.database_url
+	if database_url is None:
+		database_url = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'benchmark.sqlite3')
+	setup_django(database_url)
+
+	from django.core.management import call_command
+	from benchmarks import dataset
+
+	print('Database: %s' % database_url)
+	call_command('migrate', verbosity=0)
+	call_command('migrate', 'catalog', BEFORE_MIGRATION, verbosity=0)
+	dataset.seed(books=args.books, copies=args.copies, users=args.users, stdout=sys.stdout)
+
+	measure('Without indexes', args.repeat)
+	call_command('migrate', 'catalog', INDEX_MIGRATION, verbosity=0)
+	measure('With indexes', args.repeat)
+
+
+if __name__ == '__main__':
+	main()
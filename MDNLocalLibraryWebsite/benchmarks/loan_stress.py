@@ -0,0 +1,75 @@
+"""
+Concurrency stress test for the loan service (catalog/loans.py).
+
+Seeds a throwaway database, then has a number of threads (each a different
+borrower) try to check out the same copies at the same time. Every copy must
+end up lent exactly once; the rest of the attempts must be reported as
+conflicts. Prints the throughput achieved. Run it from the project directory:
+
+	python -m benchmarks.loan_stress --threads 16 --copies 2000
+
+By default it uses a new SQLite file (which only lets one connection write at
+a time). Pass --database-url to use an (empty!) PostgreSQL database instead.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+
+from benchmarks.index_benchmark import setup_django
+
+
+def parse_args():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('--threads', type=int, default=8)
+	parser.add_argument('--copies', type=int, default=1000, help='Available copies competed for.')
+	parser.add_argument('--database-url', help='Database to use instead of a temporary SQLite file.')
+	return parser.parse_args()
+
+
+def main():
+	args = parse_args()
+	database_url = args.database_url
+	if database_url is None:
+		database_url = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'loan_stress.sqlite3')
+	setup_django(database_url)
+
+	from collections import Counter
+	from django.contrib.auth.models import User
+	from django.core.management import call_command
+	from catalog.models import Book, BookInstance, CatalogStats
+	from catalog.stress import stress_checkouts
+
+	print('Database: %s' % database_url)
+	call_command('migrate', verbosity=0)
+	book = Book.objects.create(title='Stress test', summary='', isbn='0000000000000')
+	BookInstance.objects.bulk_create([BookInstance(book=book, imprint='Stress test', status='a')
+		for i in range(args.copies)])
+	CatalogStats.rebuild()
+	Book.repair_copy_counts()
+	users = [User.objects.create(username='stress%d' % i) for i in range(args.threads)]
+	copy_ids = list(BookInstance.objects.filter(book=book).values_list('id', flat=True))
+
+	results = stress_checkouts(copy_ids, users)
+
+	lent = Counter(pk for pk, user in results.loans)
+	double_loans = [pk for pk, count in lent.items() if count > 1]
+	on_loan = BookInstance.objects.filter(book=book, status='o').count()
+	book.refresh_from_db()
+	print('%d threads, %d copies: %d attempts in %.2f s (%.0f/s)' % (args.threads, args.copies,
+		results.attempts, results.seconds, results.attempts / results.seconds))
+	print('Loans: %d   Conflicts: %d   Errors: %d   Double loans: %d' % (len(results.loans),
+		results.conflicts, len(results.errors), len(double_loans)))
+	for error in results.errors[:5]:
+		print('    %r' % error)
+	print('Copy counts: %d available, %d on loan' % (book.num_available, book.num_on_loan))
+	if double_loans or on_loan != args.copies or len(lent) != args.copies or results.errors \
+			or (book.num_available, book.num_on_loan) != (0, args.copies):
+		print('FAILED: every copy should have been lent exactly once (and counted once).')
+		sys.exit(1)
+	print('OK: every copy was lent exactly once.')
+
+
+if __name__ == '__main__':
+	main()
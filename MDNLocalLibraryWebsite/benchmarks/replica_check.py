@@ -0,0 +1,114 @@
+"""
+End-to-end check of the read replica routing (catalog/routers.py), with two
+local SQLite files: a primary, and a replica that is a copy of it. Rows
+added to the primary after the copy play the part of replication lag.
+It makes a few requests through the test client and checks which database
+each one read from, and what it saw. Run it from the project directory:
+
+	python -m benchmarks.replica_check
+
+It exits with status 1 if any check fails.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+
+from benchmarks.index_benchmark import setup_django
+
+
+def main():
+	directory = tempfile.mkdtemp()
+	primary_path = os.path.join(directory, 'primary.sqlite3')
+	replica_path = os.path.join(directory, 'replica.sqlite3')
+	os.environ['DATABASE_REPLICA_URLS'] = 'sqlite:///' + replica_path
+	setup_django('sqlite:///' + primary_path)
+
+	from django.contrib.auth.models import User
+	from django.core.cache import cache
+	from django.core.management import call_command
+	from django.db import connections
+	from django.test import Client
+	from django.test.utils import CaptureQueriesContext, override_settings
+	from django.urls import reverse
+	from benchmarks.view_benchmark import BENCHMARK_SETTINGS
+	from catalog import routers
+	from catalog.models import Author, Book, Genre
+
+	print('Primary: %s\nReplica: %s' % (primary_path, replica_path))
+	call_command('migrate', verbosity=0)
+	author = Author.objects.create(first_name='Jane', last_name='Austen')
+	genre = Genre.objects.create(name='Fiction')
+	book = Book.objects.create(title='Emma', summary='Matchmaking', isbn='9780141439587', author=author)
+	book.genre.add(genre)
+	librarian_client = Client()
+	librarian_client.force_login(User.objects.create_superuser('librarian', '', None))
+
+	# "Replicate" everything so far, then add a book the replica hasn't got yet
+	connections.close_all()
+	shutil.copyfile(primary_path, replica_path)
+	Book.objects.create(title='Persuasion', summary='Second chances', isbn='9780141439686', author=author)
+	routers.reset()
+
+	failures = []
+
+	def check(label, client, method, url, expect_database, expect_text=None, unexpected_text=None,
+			clear_cache=True, **kwargs):
+		if clear_cache:
+			cache.clear()
+		with CaptureQueriesContext(connections['default']) as primary, \
+				CaptureQueriesContext(connections['replica1']) as replica:
+			response = getattr(client, method)(url, **kwargs)
+		print('%-46s %3d  primary %2d queries  replica %2d queries' % (label, response.status_code,
+			len(primary), len(replica)))
+		used = [name for name, queries in (('primary', primary), ('replica', replica)) if len(queries)]
+		if used != ([expect_database] if expect_database else []):
+			failures.append('%s: read from %s, expected %s' % (label, ' and '.join(used) or 'neither',
+				'only the %s' % expect_database if expect_database else 'neither'))
+		content = response.content.decode('utf-8')
+		if expect_text and expect_text not in content:
+			failures.append('%s: %r is missing' % (label, expect_text))
+		if unexpected_text and unexpected_text in content:
+			failures.append('%s: %r should not be there yet' % (label, unexpected_text))
+		return response
+
+	with override_settings(**BENCHMARK_SETTINGS):
+		anonymous_client = Client()
+		check('Book list reads the replica', anonymous_client, 'get', reverse('books'), 'replica',
+			expect_text='Emma', unexpected_text='Persuasion')
+		check('Uncached book page renders from the primary', anonymous_client, 'get',
+			reverse('book-detail', args=[book.pk]), 'primary', expect_text='Emma')
+		check('Cached book page reads neither', anonymous_client, 'get', reverse('book-detail', args=[book.pk]), None,
+			expect_text='Emma', clear_cache=False)
+		check('Update form reads the replica', librarian_client, 'get', reverse('book_update', args=[book.pk]), 'replica',
+			expect_text='Emma')
+		response = check('Update POST uses only the primary', librarian_client, 'post',
+			reverse('book_update', args=[book.pk]), 'primary',
+			data={'title': 'Emma (revised)', 'author': author.pk, 'summary': 'Matchmaking', 'isbn': '9780141439587',
+				'genre': [genre.pk]})
+		if routers.PIN_COOKIE not in response.cookies:
+			failures.append('The update POST did not set the %s cookie' % routers.PIN_COOKIE)
+		# The book's page was cached before the POST, which moved its fragments
+		# on to a new version. Another browser (reading the lagging replica)
+		# misses the cache, and must render the new version from the primary,
+		# or the old details would be cached under it.
+		check('New fragment version renders from the primary', anonymous_client, 'get', response.url, 'primary',
+			expect_text='Emma (revised)', clear_cache=False)
+		check('Redirect after the POST reads the primary', librarian_client, 'get', response.url, 'primary',
+			expect_text='Emma (revised)')
+		check('Other browsers read the (lagging) replica', anonymous_client, 'get', reverse('books'), 'replica',
+			unexpected_text='Emma (revised)')
+
+	connections.close_all()
+	shutil.rmtree(directory)
+	if failures:
+		print('FAILED:')
+		for failure in failures:
+			print('    ' + failure)
+		sys.exit(1)
+	print('OK: reads went to the replica, and to the primary after writes.')
+
+
+if __name__ == '__main__':
+	main()
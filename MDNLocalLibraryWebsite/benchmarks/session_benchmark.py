@@ -0,0 +1,182 @@
+"""
+Session engine benchmark: Django's database engine, its cached_db engine and
+the write-behind engine in catalog/sessions.py.
+
+Seeds a database of the given size (or reuses one that is already seeded),
+then for each engine logs in as a borrower and requests the index and
+my-borrowed pages, reporting the p50/p95 latency and the queries made on the
+django_session table per request. Then it changes a session on every one of
+a series of "requests" (load, change, save), and reports the time per save
+and the number of writes to the table. Run it from the project directory:
+
+	python -m benchmarks.session_benchmark --books 20000 --copies 200000
+	python -m benchmarks.session_benchmark --cache file
+
+By default it uses a new SQLite file. Pass --database-url to use a
+PostgreSQL database (which is seeded if it has no books yet).
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+from benchmarks.index_benchmark import setup_django
+from benchmarks.view_benchmark import BENCHMARK_SETTINGS, percentile
+
+ENGINES = [
+	('db', 'django.contrib.sessions.backends.db'),
+	('cached_db', 'django.contrib.sessions.backends.cached_db'),
+	('catalog', 'catalog.sessions'),
+]
+ROUTES = ['index', 'my-borrowed']
+
+
+def parse_args():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('--books', type=int, default=20000)
+	parser.add_argument('--copies', type=int, default=200000)
+	parser.add_argument('--users', type=int, default=1000)
+	parser.add_argument('--repeat', type=int, default=200, help='Measured requests (and session saves) per engine.')
+	parser.add_argument('--warmup', type=int, default=5, help='Unmeasured requests per route first.')
+	parser.add_argument('--cache', choices=['locmem', 'file'], default='locmem',
+		help='The cache the cached engines keep the sessions in (default locmem).')
+	parser.add_argument('--database-url', help='Database to use instead of a temporary SQLite file.')
+	parser.add_argument('--output', '-o', help='Also write the results to this file, as JSON.')
+	return parser.parse_args()
+
+
+class SessionQueryCounter(object):
+	"""
+	Database execute wrapper that counts the queries on the session table,
+	and the writes among them.
+	"""
+	def __init__(self):
+		self.queries = 0
+		self.writes = 0
+
+	def __call__(self, execute, sql, params, many, context):
+		if 'django_session' in sql:
+			self.queries += 1
+			if not sql.lstrip().upper().startswith('SELECT'):
+				self.writes += 1
+		return execute(sql, params, many, context)
+
+
+def request_routes(client, urls, repeat, warmup):
+	"""
+	Requests each URL warmup + repeat times. Returns the p50/p95 latency and
+	session queries per request for each URL.
+	"""
+	from django.db import connection
+
+	results = {}
+	for name, url in urls:
+		timings = []
+		counter = SessionQueryCounter()
+		for i in range(warmup + repeat):
+			if i == warmup:
+				counter = SessionQueryCounter()
+			with connection.execute_wrapper(counter):
+				started = time.perf_counter()
+				response = client.get(url)
+				elapsed = (time.perf_counter() - started) * 1000
+			if response.status_code != 200:
+				sys.exit('%s returned %d' % (url, response.status_code))
+			if i >= warmup:
+				timings.append(elapsed)
+		results[name] = {
+			'p50_ms': round(percentile(timings, 0.5), 3),
+			'p95_ms': round(percentile(timings, 0.95), 3),
+			'session_queries': round(counter.queries / float(repeat), 3),
+		}
+	return results
+
+
+def change_session(engine, session_key, repeat):
+	"""
+	Loads, changes and saves the session repeat times, then writes anything
+	still buffered. Returns the time per save and the writes to the table.
+	"""
+	from importlib import import_module
+	from django.db import connection
+	from catalog import sessions
+
+	SessionStore = import_module(engine).SessionStore
+	counter = SessionQueryCounter()
+	with connection.execute_wrapper(counter):
+		started = time.perf_counter()
+		for i in range(repeat):
+			session = SessionStore(session_key)
+			session['last_page'] = i
+			session.save()
+		elapsed = time.perf_counter() - started
+		sessions.write_behind.flush()
+	return {
+		'save_ms': round(elapsed * 1000 / repeat, 3),
+		'session_queries': counter.queries,
+		'session_writes': counter.writes,
+	}
+
+
+def main():
+	args = parse_args()
+	database_url = args.database_url
+	if database_url is None:
+		database_url = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'benchmark.sqlite3')
+	setup_django(database_url)
+
+	from django.contrib.auth.models import User
+	from django.core.management import call_command
+	from django.test import Client
+	from django.test.utils import override_settings
+	from django.urls import reverse
+	from benchmarks import dataset
+	from catalog.models import Book
+
+	print('Database: %s' % database_url)
+	call_command('migrate', verbosity=0)
+	if not Book.objects.exists():
+		dataset.seed(books=args.books, copies=args.copies, users=args.users)
+	borrower = User.objects.filter(bookinstance__status='o').order_by('pk').first()
+	urls = [(name, reverse(name)) for name in ROUTES]
+
+	if args.cache == 'file':
+		caches = {alias: {
+			'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+			'LOCATION': tempfile.mkdtemp(),
+		} for alias in ('default', 'sessions')}
+	else:
+		caches = BENCHMARK_SETTINGS['CACHES']
+
+	results = {}
+	print('%-10s %-12s %10s %10s %16s' % ('engine', 'route', 'p50 ms', 'p95 ms', 'session queries'))
+	for label, engine in ENGINES:
+		# Without the request timing middleware's log lines
+		with override_settings(**dict(BENCHMARK_SETTINGS, CACHES=caches, SESSION_ENGINE=engine, REQUEST_TIMING_SAMPLE_RATE=0)):
+			client = Client()
+			client.force_login(borrower)
+			results[label] = request_routes(client, urls, args.repeat, args.warmup)
+			results[label]['change_session'] = change_session(engine, client.session.session_key, args.repeat)
+		for name, url in urls:
+			route = results[label][name]
+			print('%-10s %-12s %10.3f %10.3f %16.2f' % (label, name, route['p50_ms'], route['p95_ms'],
+				route['session_queries']))
+
+	print('\nChanging the session on each of %d requests:' % args.repeat)
+	print('%-10s %10s %16s %15s' % ('engine', 'ms/save', 'session queries', 'session writes'))
+	for label, engine in ENGINES:
+		changes = results[label]['change_session']
+		print('%-10s %10.3f %16d %15d' % (label, changes['save_ms'], changes['session_queries'],
+			changes['session_writes']))
+
+	if args.output:
+		with open(args.output, 'w', encoding='utf-8') as f:
+			json.dump({'cache': args.cache, 'repeat': args.repeat, 'engines': results}, f, indent=2, sort_keys=True)
+			f.write('\n')
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,334 @@
+"""
+Per-view benchmark for the catalog pages.
+
+Seeds a database of the given size (or reuses one that is already seeded),
+then requests every named route in catalog/urls.py through the Django test
+client, logged in as a librarian. For each route it reports the p50/p95
+latency, the number of queries and the time spent in the database, as JSON.
+Run it from the project directory:
+
+	python -m benchmarks.view_benchmark --books 100000 --copies 1000000 --output results.json
+
+Compare a run against a stored baseline (exits with status 1 if any route
+got slower or makes more queries):
+
+	python -m benchmarks.view_benchmark --baseline baseline.json
+	python -m benchmarks.view_benchmark --compare results.json --baseline baseline.json
+
+By default it uses a new SQLite file. Pass --database-url to use a
+PostgreSQL database (which is seeded if it has no books yet), and a seeded
+database can be reused between runs to skip the seeding.
+"""
+
+import argparse
+import json
+import os
+import platform
+import re
+import sys
+import tempfile
+import time
+
+from benchmarks.index_benchmark import setup_django
+
+# The URL arguments of the routes that take any, from the sample objects
+# picked by sample_objects(). A route with arguments that isn't listed here
+# stops the benchmark, so new routes can't be silently left out.
+ROUTE_KWARGS = {
+	'book-detail': lambda s: {'pk': s['book']},
+	'book_update': lambda s: {'pk': s['book']},
+	'book_delete': lambda s: {'pk': s['book']},
+	'author-detail': lambda s: {'pk': s['author']},
+	'author_update': lambda s: {'pk': s['author']},
+	'author_delete': lambda s: {'pk': s['author']},
+	'renew-book-librarian': lambda s: {'pk': s['loan']},
+	'return-book-librarian': lambda s: {'pk': s['loan']},
+	'checkout-book-librarian': lambda s: {'pk': s['available_copy']},
+	'reserve-book': lambda s: {'pk': s['available_copy']},
+	'catalog-export': lambda s: {'kind': 'books', 'format': 'csv'},
+	'picker-choices': lambda s: {'kind': 'authors'},
+	'api:books-detail': lambda s: {'pk': s['book']},
+	'api:authors-detail': lambda s: {'pk': s['author']},
+	'api:genres-detail': lambda s: {'pk': s['genre']},
+	'api:copies-detail': lambda s: {'pk': s['loan']},
+}
+# Query strings for the routes that need one
+ROUTE_QUERIES = {
+	'search': 'q=war',
+	'autocomplete': 'q=the',
+}
+# Settings for the runs: no HTTPS redirect (the test client speaks plain
+# HTTP), a per-process cache (rather than the shared file cache) and plain
+# static files (the manifest needs collectstatic).
+BENCHMARK_SETTINGS = {
+	'DEBUG': False,
+	'ALLOWED_HOSTS': ['*'],
+	'SECURE_SSL_REDIRECT': False,
+	'STATICFILES_STORAGE': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+	'CACHES': {
+		'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+		'sessions': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'sessions'},
+	},
+}
+USERNAME = 'benchmark-librarian'
+
+
+def parse_args():
+	parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+	parser.add_argument('--books', type=int, default=20000)
+	parser.add_argument('--copies', type=int, default=200000)
+	parser.add_argument('--users', type=int, default=1000)
+	parser.add_argument('--repeat', type=int, default=20, help='Measured requests per route.')
+	parser.add_argument('--warmup', type=int, default=2, help='Unmeasured requests per route first.')
+	parser.add_argument('--cold', action='store_true', help='Clear the cache before every request.')
+	parser.add_argument('--routes', help='Only run the routes whose names match this regular expression.')
+	parser.add_argument('--database-url', help='Database to use instead of a temporary SQLite file.')
+	parser.add_argument('--output', '-o', help='Write the results to this file (standard output by default).')
+	parser.add_argument('--baseline', help='Results to compare against, from an earlier --output.')
+	parser.add_argument('--compare', help='Compare these stored results with --baseline, without running.')
+	parser.add_argument('--threshold', type=float, default=0.2,
+		help='Flag a route whose p50 or p95 grew by more than this fraction (default 0.2).')
+	parser.add_argument('--min-ms', type=float, default=1.0,
+		help='Ignore latency changes smaller than this many milliseconds (default 1).')
+	return parser.parse_args()
+
+
+def percentile(values, fraction):
+	"""
+	Returns the nearest-rank percentile of the values, e.g. percentile(values, 0.95).
+	"""
+	ordered = sorted(values)
+	return ordered[max(0, int(round(fraction * len(ordered))) - 1)]
+
+
+def named_routes(patterns, namespace=None):
+	"""
+	Yields the (name, pattern) of every named URL pattern, with included
+	patterns named 'namespace:name'.
+	"""
+	for pattern in patterns:
+		if hasattr(pattern, 'url_patterns'):
+			for route in named_routes(pattern.url_patterns, pattern.namespace):
+				yield route
+		elif pattern.name:
+			yield ('%s:%s' % (namespace, pattern.name) if namespace else pattern.name), pattern
+
+
+def sample_objects():
+	"""
+	Picks the objects the detail routes are requested for: a book and author
+	from the middle of their tables, a copy on loan and an available copy.
+	"""
+	from catalog.models import Author, Book, BookInstance, Genre
+
+	def middle(queryset):
+		count = queryset.count()
+		return queryset.order_by('pk').values_list('pk', flat=True)[count // 2]
+
+	return {
+		'book': middle(Book.objects.filter(num_copies__gt=0)),
+		'author': middle(Author.objects.all()),
+		'genre': middle(Genre.objects.all()),
+		'loan': middle(BookInstance.objects.filter(status='o')),
+		'available_copy': middle(BookInstance.objects.filter(status='a')),
+	}
+
+
+def route_urls(routes_filter=None):
+	"""
+	Returns the (name, URL) of each named catalog route to request.
+	"""
+	from django.urls import reverse
+	from catalog import urls
+
+	samples = sample_objects()
+	result = []
+	missing = []
+	for name, pattern in named_routes(urls.urlpatterns):
+		if routes_filter and not re.search(routes_filter, name):
+			continue
+		if name in ROUTE_KWARGS:
+			kwargs = ROUTE_KWARGS[name](samples)
+		elif pattern.pattern.regex.groups:
+			missing.append(name)
+			continue
+		else:
+			kwargs = {}
+		url = reverse(name, kwargs=kwargs)
+		if name in ROUTE_QUERIES:
+			url += '?' + ROUTE_QUERIES[name]
+		result.append((name, url))
+	if missing:
+		sys.exit('No URL arguments for the routes %s: add them to ROUTE_KWARGS.' % ', '.join(missing))
+	return result
+
+
+class QueryTimer(object):
+	"""
+	Database execute wrapper that counts the queries and times them (more
+	finely than the query log, which rounds to milliseconds).
+	"""
+	def __init__(self):
+		self.count = 0
+		self.seconds = 0.0
+
+	def __call__(self, execute, sql, params, many, context):
+		started = time.perf_counter()
+		try:
+			return execute(sql, params, many, context)
+		finally:
+			self.seconds += time.perf_counter() - started
+			self.count += 1
+
+
+def request(client, url):
+	"""
+	Requests the URL and reads the whole response. Returns the (status,
+	milliseconds, number of queries, milliseconds in the database).
+	"""
+	from django.db import connection
+
+	timer = QueryTimer()
+	with connection.execute_wrapper(timer):
+		started = time.perf_counter()
+		response = client.get(url)
+		if response.streaming:
+			for chunk in response.streaming_content:
+				pass
+		elapsed = (time.perf_counter() - started) * 1000
+	return response.status_code, elapsed, timer.count, timer.seconds * 1000
+
+
+def run(routes, repeat, warmup, cold=False):
+	"""
+	Requests each route warmup + repeat times, and returns the results for
+	each route name.
+	"""
+	from django.contrib.auth.models import User
+	from django.core.cache import cache
+	from django.test import Client
+
+	librarian = User.objects.filter(username=USERNAME).first()
+	if librarian is None:
+		librarian = User.objects.create_superuser(USERNAME, '', None)
+	client = Client()
+	client.force_login(librarian)
+
+	results = {}
+	for name, url in routes:
+		timings, queries, db_times = [], [], []
+		for i in range(warmup + repeat):
+			if cold:
+				cache.clear()
+			status, elapsed, num_queries, db_time = request(client, url)
+			if i >= warmup:
+				timings.append(elapsed)
+				queries.append(num_queries)
+				db_times.append(db_time)
+		results[name] = {
+			'url': url,
+			'status': status,
+			'p50_ms': round(percentile(timings, 0.5), 3),
+			'p95_ms': round(percentile(timings, 0.95), 3),
+			'queries': percentile(queries, 0.5),
+			'db_ms': round(percentile(db_times, 0.5), 3),
+		}
+		print('%-28s %3d  p50 %9.3f ms  p95 %9.3f ms  %4d queries  db %9.3f ms' % (name, status,
+			results[name]['p50_ms'], results[name]['p95_ms'], results[name]['queries'], results[name]['db_ms']),
+			file=sys.stderr)
+	return results
+
+
+def compare(baseline, current, threshold=0.2, min_ms=1.0):
+	"""
+	Returns a list of the regressions from the baseline results to the
+	current ones, as readable strings: a p50 or p95 latency that grew by more
+	than the threshold fraction (and min_ms), more queries, or a different
+	status code. Routes missing from either side are ignored.
+	"""
+	regressions = []
+	for name, now in sorted(current['routes'].items()):
+		before = baseline['routes'].get(name)
+		if before is None:
+			continue
+		if now['status'] != before['status']:
+			regressions.append('%s: status %s -> %s' % (name, before['status'], now['status']))
+		for key in ('p50_ms', 'p95_ms'):
+			growth = now[key] - before[key]
+			if growth > min_ms and growth > before[key] * threshold:
+				regressions.append('%s: %s %.3f -> %.3f ms (+%.0f%%)' % (name, key, before[key], now[key],
+					100.0 * growth / before[key] if before[key] else float('inf')))
+		if now['queries'] > before['queries']:
+			regressions.append('%s: queries %d -> %d' % (name, before['queries'], now['queries']))
+	return regressions
+
+
+def report_comparison(baseline_path, current, threshold, min_ms):
+	with open(baseline_path, encoding='utf-8') as f:
+		baseline = json.load(f)
+	for key in ('books', 'database', 'cold'):
+		if baseline.get('meta', {}).get(key) != current.get('meta', {}).get(key):
+			print('Warning: the baseline was run with %s=%s, not %s.' % (key, baseline.get('meta', {}).get(key),
+				current.get('meta', {}).get(key)), file=sys.stderr)
+	regressions = compare(baseline, current, threshold, min_ms)
+	if regressions:
+		print('Regressions against %s:' % baseline_path, file=sys.stderr)
+		for regression in regressions:
+			print('    ' + regression, file=sys.stderr)
+		sys.exit(1)
+	print('No regressions against %s.' % baseline_path, file=sys.stderr)
+
+
+def main():
+	args = parse_args()
+	if args.compare:
+		if not args.baseline:
+			sys.exit('--compare needs a --baseline to compare with.')
+		with open(args.compare, encoding='utf-8') as f:
+			report_comparison(args.baseline, json.load(f), args.threshold, args.min_ms)
+		return
+
+	database_url = args.database_url
+	if database_url is None:
+		database_url = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'benchmark.sqlite3')
+	setup_django(database_url)
+
+	import django
+	from django.core.management import call_command
+	from django.db import connection
+	from django.test.utils import override_settings
+	from benchmarks import dataset
+	from catalog.models import Book
+
+	print('Database: %s' % database_url, file=sys.stderr)
+	call_command('migrate', verbosity=0)
+	if not Book.objects.exists():
+		dataset.seed(books=args.books, copies=args.copies, users=args.users, stdout=sys.stderr)
+
+	with override_settings(**BENCHMARK_SETTINGS):
+		routes = route_urls(args.routes)
+		results = {
+			'meta': {
+				'books': Book.objects.count(),
+				'database': connection.vendor,
+				'repeat': args.repeat,
+				'warmup': args.warmup,
+				'cold': args.cold,
+				'python': platform.python_version(),
+				'django': django.get_version(),
+			},
+			'routes': run(routes, args.repeat, args.warmup, args.cold),
+		}
+
+	output = json.dumps(results, indent=2, sort_keys=True)
+	if args.output:
+		with open(args.output, 'w', encoding='utf-8') as f:
+			f.write(output + '\n')
+	else:
+		print(output)
+	if args.baseline:
+		report_comparison(args.baseline, results, args.threshold, args.min_ms)
+
+
+if __name__ == '__main__':
+	main()
@@ -1,38 +1,163 @@
 from django.contrib import admin
-from .models import Author, Genre, Book, BookInstance
+import datetime
+from collections import Counter
+from django.core.exceptions import PermissionDenied
+from django.forms.models import BaseInlineFormSet
+from .models import Author, Genre, Book, BookInstance, CatalogStats
+from .pagination import CursorPaginator, EstimatedCountPaginator, InvalidCursor
+from . import loans
 
-# Register your models here (in the order they will appear in the admin view).
-admin.site.register(Genre)
+# The admin is set up for tables of millions of rows: the changelists take
+# their totals from CatalogStats rather than a COUNT(*) (see
+# EstimatedCountPaginator), select (or prefetch) the related objects they
+# display, foreign keys are edited as raw ids rather than a <select> of the
+# whole table, and inlines are read-only and show one page of rows at a time.
 
-class BooksInline(admin.TabularInline):
+
+class CatalogModelAdmin(admin.ModelAdmin):
+	"""
+	ModelAdmin whose changelist doesn't count the whole table. Set stats_count
+	to the CatalogStats field that holds the number of rows.
+	"""
+	stats_count = None
+	# Filtered changelists don't also count the unfiltered table
+	show_full_result_count = False
+
+	def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+		total = None
+		if self.stats_count:
+			total = lambda: getattr(CatalogStats.load(), self.stats_count)
+		return EstimatedCountPaginator(queryset, per_page, orphans, allow_empty_first_page, total=total)
+
+
+class PaginatedInlineFormSet(BaseInlineFormSet):
+	"""
+	Inline formset over one (cursor paginated) page of the related objects.
+	The cursor is read from the query string, as <prefix>-cursor.
+	"""
+	per_page = 20
+	query = None # The request.GET, set by PaginatedInline.get_formset()
+
+	def get_queryset(self):
+		if not hasattr(self, '_queryset'):
+			paginator = CursorPaginator(self.queryset, self.per_page)
+			cursor_kwarg = '%s-cursor' % self.prefix
+			try:
+				self.page = paginator.page(self.query.get(cursor_kwarg) if self.query else None)
+			except InvalidCursor:
+				self.page = paginator.page()
+			self.page.query = self.query
+			self.page.cursor_kwarg = cursor_kwarg
+			self._queryset = self.page.object_list
+		return self._queryset
+
+	def save(self, commit=True):
+		# Read-only
+		self.new_objects, self.changed_objects, self.deleted_objects = [], [], []
+		return []
+
+
+class PaginatedInline(admin.TabularInline):
+	"""
+	Read-only tabular inline that shows a page of per_page related objects,
+	with links to the previous and next pages. The objects are edited on
+	their own change page (show_change_link).
+	"""
+	formset = PaginatedInlineFormSet
+	template = 'admin/catalog/paginated_tabular.html'
+	extra = 0
+	per_page = 20
+	show_change_link = True
+
+	def get_formset(self, request, obj=None, **kwargs):
+		formset = super().get_formset(request, obj, **kwargs)
+		formset.per_page = self.per_page
+		formset.query = request.GET
+		return formset
+
+	def has_add_permission(self, request, obj=None):
+		return False
+
+	def has_change_permission(self, request, obj=None):
+		return False
+
+	def has_delete_permission(self, request, obj=None):
+		return False
+
+
+@admin.register(Genre)
+class GenreAdmin(CatalogModelAdmin):
+	stats_count = 'num_genres'
+
+
+class BooksInline(PaginatedInline):
 	# Display book items in the author detail view
 	model = Book
-	extra = 0
+	fields = ['title', 'isbn']
 
-class AuthorAdmin(admin.ModelAdmin):
+class AuthorAdmin(CatalogModelAdmin):
 		list_display = ('last_name', 'first_name', 'date_of_birth', 'date_of_death')
 		fields = ['first_name', 'last_name', ('date_of_birth', 'date_of_death')]
 		inlines = [BooksInline]
+		stats_count = 'num_authors'
 admin.site.register(Author, AuthorAdmin)
 
 
-class BooksInstanceInline(admin.TabularInline):
+class BooksInstanceInline(PaginatedInline):
 	# Display book instance items in the books detail view
 	model = BookInstance
-	extra = 0
+	fields = ['id', 'status', 'due_back', 'borrower', 'imprint']
+
+	def get_queryset(self, request):
+		# The book is used by the copy's __str__
+		return super().get_queryset(request).select_related('book', 'borrower')
 
 @admin.register(Book)
-class BookAdmin(admin.ModelAdmin):
+class BookAdmin(CatalogModelAdmin):
 	list_display = ('title', 'author', 'display_genre')
+	list_select_related = ('author',)
+	raw_id_fields = ('author', 'genre')
+	stats_count = 'num_books'
 
 	# View all the book instances associated with this book in the detail view
 	inlines = [BooksInstanceInline]
+
+	def get_queryset(self, request):
+		# For display_genre
+		return super().get_queryset(request).prefetch_related('genre')
 #admin.site.register(Book, BookAdmin)
 
+def _report_loan_results(modeladmin, request, results):
+	counts = Counter(result for pk, result in results)
+	modeladmin.message_user(request, ', '.join('%d %s' % (count, result) for result, count in sorted(counts.items())))
+
+def renew_loans(modeladmin, request, queryset):
+	"""
+	Renew the selected loans for three weeks (as proposed by the renewal form).
+	"""
+	if not request.user.has_perm('catalog.can_renew'):
+		raise PermissionDenied
+	due_back = datetime.date.today() + datetime.timedelta(weeks=3)
+	_report_loan_results(modeladmin, request, loans.bulk_renew(queryset.values_list('id', flat=True), due_back))
+renew_loans.short_description = 'Renew selected loans for three weeks'
+
+def return_loans(modeladmin, request, queryset):
+	"""
+	Mark the selected loans as returned.
+	"""
+	if not request.user.has_perm('catalog.can_mark_returned'):
+		raise PermissionDenied
+	_report_loan_results(modeladmin, request, loans.bulk_return(queryset.values_list('id', flat=True)))
+return_loans.short_description = 'Mark selected loans as returned'
+
 @admin.register(BookInstance)
-class BookInstanceAdmin(admin.ModelAdmin):
+class BookInstanceAdmin(CatalogModelAdmin):
 	list_display = ('book', 'id', 'status', 'due_back', 'borrower', 'lang')
+	list_select_related = ('book', 'borrower')
+	raw_id_fields = ('book', 'borrower')
+	stats_count = 'num_instances'
 	list_filter = ('status', 'due_back', 'lang')
+	actions = [renew_loans, return_loans]
 	
 	# Sort the admin view into (two) sections
 	fieldsets = (
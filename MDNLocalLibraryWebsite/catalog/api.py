@@ -0,0 +1,209 @@
+from django.conf.urls import url
+from django.core.exceptions import ValidationError
+from django.http import JsonResponse
+from django.views.decorators.http import require_GET
+from .models import Book, Author, Genre, BookInstance
+from .pagination import CursorPaginator, InvalidCursor
+
+# Read-only JSON API for the catalog, under /catalog/api/.
+# Rows are read with values() (only the columns of the requested fields, and
+# no model instances), and lists are paged with cursors. The fields returned
+# can be chosen with ?fields=a,b,c (the id is always included).
+#
+#  GET api/books/[<id>/]    ?author=<id>&genre=<id>
+#  GET api/authors/[<id>/]
+#  GET api/genres/[<id>/]
+#  GET api/copies/[<id>/]   ?book=<id>&status=<LOAN_STATUS code>
+
+
+class ApiError(Exception):
+	"""
+	Raised for a bad request, and returned to the client as a JSON error.
+	"""
+	def __init__(self, message, status=400):
+		super(ApiError, self).__init__(message)
+		self.status = status
+
+
+class Resource(object):
+	"""
+	A model exposed through the API. fields maps each field name to the
+	values() lookup it is read from, and page_fields maps the names of fields
+	from other tables (lists of related ids, counts) to the method that loads
+	them for a whole page of rows at once, as {id: value}.
+	"""
+	model = None
+	fields = {}
+	page_fields = {}
+	default_fields = None # All the fields unless set
+	filters = {} # Query parameter -> lookup
+	ordering = None # Cursor ordering field, the model ordering by default
+	paginate_by = 20
+
+	def get_queryset(self, request):
+		queryset = self.model._default_manager.all()
+		for param, lookup in self.filters.items():
+			value = request.GET.get(param)
+			if value:
+				try:
+					queryset = queryset.filter(**{lookup: value})
+				except (ValueError, ValidationError):
+					raise ApiError('Invalid %s: %s' % (param, value))
+		return queryset
+
+	def get_fields(self, request):
+		"""
+		Returns the names of the fields asked for with ?fields=.
+		"""
+		if 'fields' not in request.GET:
+			names = self.default_fields or list(self.fields) + list(self.page_fields)
+		else:
+			names = [name for name in request.GET['fields'].split(',') if name]
+			unknown = [name for name in names if name not in self.fields and name not in self.page_fields and name != 'id']
+			if unknown:
+				raise ApiError('Unknown fields: %s' % ', '.join(unknown))
+		return ['id'] + [name for name in names if name != 'id']
+
+	def values(self, queryset, names, extra=()):
+		"""
+		Returns the values() queryset for the fields, plus the extra columns
+		(e.g. for the cursor ordering).
+		"""
+		columns = set(self.fields[name] for name in names if name in self.fields) | set(extra) | {'id'}
+		return queryset.values(*columns)
+
+	def serialize(self, rows, names):
+		"""
+		Returns the rows as dicts of the fields, loading the page fields for
+		all of them at once.
+		"""
+		ids = [row['id'] for row in rows]
+		loaded = {name: getattr(self, self.page_fields[name])(ids) for name in names if name in self.page_fields}
+		results = []
+		for row in rows:
+			result = {}
+			for name in names:
+				if name in loaded:
+					result[name] = loaded[name][row['id']]
+				else:
+					result[name] = row[self.fields.get(name, name)]
+			results.append(result)
+		return results
+
+	def list(self, request):
+		names = self.get_fields(request)
+		queryset = self.get_queryset(request)
+		paginator = CursorPaginator(queryset, self.paginate_by, ordering=self.ordering)
+		# The paginator needs the ordering column in each row
+		queryset = self.values(queryset, names, extra=[paginator.field.attname])
+		paginator.object_list = queryset
+		try:
+			page = paginator.page(request.GET.get('cursor'))
+		except InvalidCursor as e:
+			raise ApiError(str(e))
+		page.query = request.GET
+		return {
+			'results': self.serialize(page.object_list, names),
+			'next': '%s?%s' % (request.path, page.next_query_string) if page.has_next() else None,
+			'previous': '%s?%s' % (request.path, page.previous_query_string) if page.has_previous() else None,
+		}
+
+	def detail(self, request, pk):
+		names = self.get_fields(request)
+		try:
+			rows = list(self.values(self.model._default_manager.filter(pk=pk), names))
+		except (ValueError, ValidationError):
+			rows = []
+		if not rows:
+			raise ApiError('Not found', status=404)
+		return self.serialize(rows, names)[0]
+
+	def views(self, prefix):
+		"""
+		Returns the URL patterns for the list and detail endpoints.
+		"""
+		@require_GET
+		def list_view(request):
+			return _respond(self.list, request)
+
+		@require_GET
+		def detail_view(request, pk):
+			return _respond(self.detail, request, pk)
+
+		return [
+			url(r'^%s/$' % prefix, list_view, name='%s-list' % prefix),
+			url(r'^%s/(?P<pk>[-\w]+)/$' % prefix, detail_view, name='%s-detail' % prefix),
+		]
+
+
+def _respond(method, request, *args):
+	try:
+		return JsonResponse(method(request, *args))
+	except ApiError as e:
+		return JsonResponse({'error': str(e)}, status=e.status)
+
+
+class BookResource(Resource):
+	model = Book
+	fields = {
+		'title': 'title',
+		'isbn': 'isbn',
+		'summary': 'summary',
+		'author': 'author',
+		'author_first_name': 'author__first_name',
+		'author_last_name': 'author__last_name',
+		'copies_available': 'num_available',
+	}
+	page_fields = {'genres': 'get_genres'}
+	default_fields = ['title', 'isbn', 'author', 'author_first_name', 'author_last_name', 'genres']
+	filters = {'author': 'author', 'genre': 'genre'}
+
+	def get_genres(self, book_ids):
+		genres = {book_id: [] for book_id in book_ids}
+		links = Book.genre.through.objects.filter(book_id__in=book_ids).order_by('genre_id')
+		for book_id, genre_id in links.values_list('book_id', 'genre_id'):
+			genres[book_id].append(genre_id)
+		return genres
+
+
+class AuthorResource(Resource):
+	model = Author
+	fields = {
+		'first_name': 'first_name',
+		'last_name': 'last_name',
+		'date_of_birth': 'date_of_birth',
+		'date_of_death': 'date_of_death',
+	}
+	page_fields = {'books': 'get_books'}
+
+	def get_books(self, author_ids):
+		books = {author_id: [] for author_id in author_ids}
+		for author_id, book_id in Book.objects.filter(author_id__in=author_ids).order_by('id').values_list('author_id', 'id'):
+			books[author_id].append(book_id)
+		return books
+
+
+class GenreResource(Resource):
+	model = Genre
+	fields = {'name': 'name'}
+	ordering = 'name'
+
+
+class CopyResource(Resource):
+	"""
+	The copies of the books and whether they are available (but not who has
+	borrowed them).
+	"""
+	model = BookInstance
+	fields = {
+		'book': 'book',
+		'imprint': 'imprint',
+		'lang': 'lang',
+		'status': 'status',
+		'due_back': 'due_back',
+	}
+	filters = {'book': 'book', 'status': 'status'}
+
+
+urlpatterns = (BookResource().views('books') + AuthorResource().views('authors')
+	+ GenreResource().views('genres') + CopyResource().views('copies'))
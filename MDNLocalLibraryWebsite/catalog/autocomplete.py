@@ -0,0 +1,235 @@
+import bisect
+import threading
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from .models import Author, Book
+from . import routers
+from .text import normalize
+
+# Type-ahead for book titles and author names (/catalog/autocomplete/?q=...),
+# answered from an index held in each process's memory: for books and for
+# authors, a sorted list of (normalized key, id) entries, searched by
+# bisecting to the first key at or after the prefix. Books are indexed by
+# their title (and their title without a leading "The", "A" or "An"); authors
+# by "last name, first name" and "first name last name".
+# The index is kept up to date incrementally. The signal handlers in
+# catalog/signals.py call changed(), which records the changed ids in the
+# cache under a new version number once the change commits. Before each
+# lookup, every process reads the current version and reloads just the objects
+# changed since the version it has (from the primary database, which has the
+# change already). If it is too far behind, or a change record has been
+# evicted, it rebuilds the whole index instead, as it also does every
+# AUTOCOMPLETE_MAX_AGE seconds, to catch changes made without signals.
+# Only one thread of a process brings the index up to date at a time, with the
+# data loaded outside the index's lock, so the other threads' lookups carry on
+# with the index as it was (rather than wait for a rebuild) meanwhile.
+
+VERSION_KEY = 'catalog:autocomplete-version'
+# Changes a process catches up on one by one before rebuilding instead
+MAX_CHANGES = 100
+# Ids in one change before it is recorded as "everything changed" instead
+MAX_CHANGE_IDS = 1000
+ARTICLES = ('the ', 'a ', 'an ')
+KINDS = ('book', 'author')
+
+
+def _change_key(version):
+	return 'catalog:autocomplete-change:%d' % version
+
+
+def _new_version():
+	# Starts above any value an evicted counter had, which forces a rebuild
+	return int(time.time() * 1000)
+
+
+def book_keys(title):
+	key = normalize(title)
+	keys = [key]
+	for article in ARTICLES:
+		if key.startswith(article) and len(key) > len(article):
+			keys.append(key[len(article):])
+	return keys
+
+
+def author_keys(first_name, last_name):
+	return [normalize('%s, %s' % (last_name, first_name)), normalize('%s %s' % (first_name, last_name))]
+
+
+def changed(kind, pks):
+	"""
+	Records that the books or authors (kind is 'book' or 'author') with
+	these ids were added, changed or deleted, once the current transaction
+	commits (see _changed()).
+	"""
+	pks = list(pks)
+	if pks:
+		transaction.on_commit(lambda: _changed(kind, pks))
+
+
+def _changed(kind, pks):
+	# Not before the commit: a process reloading the objects in between would
+	# load their old state and take it as the new version
+	if len(pks) > MAX_CHANGE_IDS:
+		# Makes every process rebuild its index
+		cache.set(VERSION_KEY, _new_version(), None)
+		return
+	try:
+		version = cache.incr(VERSION_KEY)
+	except ValueError:
+		cache.set(VERSION_KEY, _new_version(), None)
+		return
+	cache.set(_change_key(version), (kind, pks), getattr(settings, 'AUTOCOMPLETE_MAX_AGE', 600) * 2)
+
+
+def _rows(kind, pks=None):
+	"""
+	Yields the (id, label, keys) of every book or author (kind is 'book' or
+	'author'), or of those with the given ids.
+	"""
+	if kind == 'book':
+		books = Book.objects.all() if pks is None else Book.objects.filter(pk__in=pks)
+		for pk, title in books.values_list('id', 'title').iterator():
+			yield pk, title, book_keys(title)
+	else:
+		authors = Author.objects.all() if pks is None else Author.objects.filter(pk__in=pks)
+		for pk, first_name, last_name in authors.values_list('id', 'first_name', 'last_name').iterator():
+			yield pk, '%s, %s' % (last_name, first_name), author_keys(first_name, last_name)
+
+
+class PrefixIndex(object):
+	"""
+	The sorted index of one process (see the top of this module). lock
+	guards the entries and labels, and sync_lock lets one thread at a time
+	bring them up to date.
+	"""
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.sync_lock = threading.Lock()
+		self.entries = {kind: [] for kind in KINDS} # Sorted (key, id) per kind
+		self.labels = {} # (kind, id) -> (label, keys)
+		self.version = None
+		self.built_at = 0
+
+	def add(self, kind, pk, label, keys):
+		for key in set(keys):
+			bisect.insort(self.entries[kind], (key, pk))
+		self.labels[(kind, pk)] = (label, keys)
+
+	def remove(self, kind, pk):
+		label, keys = self.labels.pop((kind, pk), (None, ()))
+		entries = self.entries[kind]
+		for key in set(keys):
+			i = bisect.bisect_left(entries, (key, pk))
+			if i < len(entries) and entries[i] == (key, pk):
+				del entries[i]
+
+	def rebuild(self):
+		"""
+		Loads every book and author, and builds a new index from scratch, which
+		then replaces the current one.
+		"""
+		entries = {kind: [] for kind in KINDS}
+		labels = {}
+		with routers.use_primary():
+			for kind in KINDS:
+				for pk, label, keys in _rows(kind):
+					labels[(kind, pk)] = (label, keys)
+					entries[kind].extend((key, pk) for key in set(keys))
+		for kind_entries in entries.values():
+			kind_entries.sort()
+		with self.lock:
+			self.entries, self.labels = entries, labels
+			self.built_at = time.time()
+
+	def reload(self, kind, pks):
+		"""
+		Replaces the entries of the given books or authors with their current
+		state in the database (removing the ones that no longer exist).
+		"""
+		with routers.use_primary():
+			rows = list(_rows(kind, pks))
+		with self.lock:
+			for pk in pks:
+				self.remove(kind, pk)
+			for pk, label, keys in rows:
+				self.add(kind, pk, label, keys)
+
+	def is_current(self, version):
+		return version == self.version and time.time() - self.built_at < getattr(settings, 'AUTOCOMPLETE_MAX_AGE', 600)
+
+	def sync(self):
+		"""
+		Brings the index up to the current version (see the top of this
+		module). If another thread is already doing so, returns straight away,
+		unless there is no index yet.
+		"""
+		version = cache.get(VERSION_KEY)
+		if version is None:
+			cache.add(VERSION_KEY, _new_version(), None)
+			version = cache.get(VERSION_KEY)
+		if self.is_current(version):
+			return
+		if not self.sync_lock.acquire(blocking=self.version is None):
+			return
+		try:
+			if self.is_current(version):
+				# Brought up to date by the thread that held the lock
+				return
+			# The version is read before the data, so changes made meanwhile are
+			# applied (again) by the next sync
+			if self.version is not None and self.version < version <= self.version + MAX_CHANGES:
+				keys = [_change_key(v) for v in range(self.version + 1, version + 1)]
+				changes = cache.get_many(keys)
+				if len(changes) == len(keys):
+					ids = {'book': set(), 'author': set()}
+					for kind, pks in changes.values():
+						ids[kind].update(pks)
+					for kind, pks in ids.items():
+						if pks:
+							self.reload(kind, list(pks))
+					self.version = version
+					return
+			self.rebuild()
+			self.version = version
+		finally:
+			self.sync_lock.release()
+
+	def _matches(self, kind, prefix, limit):
+		# The first limit (key, kind, id) of a kind starting with the prefix,
+		# one per object
+		entries = self.entries[kind]
+		matches = []
+		seen = set()
+		i = bisect.bisect_left(entries, (prefix,))
+		while i < len(entries) and len(matches) < limit:
+			key, pk = entries[i]
+			if not key.startswith(prefix):
+				break
+			if pk not in seen:
+				seen.add(pk)
+				matches.append((key, kind, pk))
+			i += 1
+		return matches
+
+	def lookup(self, prefix, limit=10, kind=None):
+		"""
+		Returns up to limit (kind, id, label) for the books and authors with a
+		key starting with the prefix, in key order. kind can be 'book' or
+		'author' to only return those.
+		"""
+		prefix = normalize(prefix)
+		if not prefix:
+			return []
+		self.sync()
+		with self.lock:
+			matches = []
+			for entry_kind in ([kind] if kind else KINDS):
+				matches.extend(self._matches(entry_kind, prefix, limit))
+			matches.sort()
+			return [(entry_kind, pk, self.labels[(entry_kind, pk)][0]) for key, entry_kind, pk in matches[:limit]]
+
+
+# The index of this process
+index = PrefixIndex()
@@ -0,0 +1,92 @@
+import datetime
+import hashlib
+from django.db.models import Max
+from django.utils import timezone
+from django.views.decorators.http import condition
+from .models import Book, Author, BookInstance, CatalogStats
+from . import fragments
+
+# Conditional GET support for the catalog pages. Each page has a cheap
+# "last modified" lookup (a cache lookup, or an indexed MAX(updated_at)),
+# so a browser or proxy revalidating an unchanged page gets a 304 response
+# without the page being queried or rendered.
+# The pages also show who is logged in (and their permissions), so the ETag
+# combines the last modified time with the user.
+
+
+def latest(*times):
+	"""
+	Returns the latest of the times, ignoring any that are None.
+	"""
+	times = [t for t in times if t is not None]
+	return max(times) if times else None
+
+
+def stats_last_modified():
+	"""
+	When any record count last changed, so any object was created or deleted.
+	"""
+	return CatalogStats.objects.filter(pk=CatalogStats.SINGLETON_PK).values_list('updated_at', flat=True).first()
+
+
+def index_last_modified(request, *args):
+	# The home page shows the counts themselves, so load the whole row once
+	# (index_page renders from request.catalog_stats)
+	request.catalog_stats = CatalogStats.load()
+	return request.catalog_stats.updated_at
+
+
+def book_last_modified(request, pk):
+	# Usually answered from the cache (see catalog/fragments.py)
+	return fragments.get_last_modified('book', pk,
+		lambda: Book.objects.filter(pk=pk).values_list('updated_at', flat=True).first())
+
+
+def author_last_modified(request, pk):
+	return fragments.get_last_modified('author', pk,
+		lambda: Author.objects.filter(pk=pk).values_list('updated_at', flat=True).first())
+
+
+def book_list_last_modified(request):
+	return latest(Book.objects.aggregate(latest=Max('updated_at'))['latest'], stats_last_modified())
+
+
+def author_list_last_modified(request):
+	return latest(Author.objects.aggregate(latest=Max('updated_at'))['latest'], stats_last_modified())
+
+
+def loan_list_last_modified(request):
+	# The loan lists show each copy's book title too, and which loans are
+	# overdue, which changes at midnight
+	midnight = timezone.make_aware(datetime.datetime.combine(datetime.date.today(), datetime.time.min))
+	return latest(BookInstance.objects.aggregate(latest=Max('updated_at'))['latest'],
+		Book.objects.aggregate(latest=Max('updated_at'))['latest'], stats_last_modified(), midnight)
+
+
+def user_etag(request, last_modified):
+	"""
+	Returns the ETag for a page last modified at the given time, as seen by
+	the request's user.
+	"""
+	if last_modified is None:
+		return None
+	user = request.user.pk if request.user.is_authenticated else ''
+	return hashlib.md5(('%s:%s' % (last_modified.isoformat(), user)).encode('utf-8')).hexdigest()
+
+
+def catalog_condition(last_modified_func):
+	"""
+	View decorator like django.views.decorators.http.condition, which sets the
+	Last-Modified header from last_modified_func and a per-user ETag. The
+	lookup is only run once per request.
+	"""
+	def cached_last_modified(request, *args, **kwargs):
+		if not hasattr(request, '_catalog_last_modified'):
+			request._catalog_last_modified = last_modified_func(request, *args, **kwargs)
+		return request._catalog_last_modified
+
+	def etag_func(request, *args, **kwargs):
+		return user_etag(request, cached_last_modified(request, *args, **kwargs))
+
+	return condition(etag_func=etag_func, last_modified_func=cached_last_modified)
+
@@ -0,0 +1,90 @@
+import csv
+import json
+from .models import Author, Book, BookInstance
+
+# Export of the whole catalog as CSV or JSON lines, for the librarians' export
+# view and the 'export_catalog' management command. The rows are read with
+# values_list().iterator(), a chunk at a time, and written out one line at a
+# time, so memory use doesn't grow with the size of the tables.
+
+KINDS = ('books', 'authors', 'copies')
+FORMATS = ('csv', 'jsonl')
+CONTENT_TYPES = {
+	'csv': 'text/csv',
+	'jsonl': 'application/x-ndjson',
+}
+# Rows fetched from the database at a time
+CHUNK_SIZE = 2000
+GENRE_SEPARATOR = '|' # As read by catalog/importer.py
+
+
+def _book_rows():
+	"""
+	Yields the books in id order, with their genres merged in from a second
+	query over the genre links (in the same order), rather than one query
+	per book.
+	"""
+	books = Book.objects.order_by('id').values_list('id', 'title', 'summary', 'isbn',
+		'author__first_name', 'author__last_name')
+	links = Book.genre.through.objects.order_by('book_id', 'genre__name').values_list('book_id', 'genre__name')
+	links = iter(links.iterator(chunk_size=CHUNK_SIZE))
+	link = next(links, None)
+	for book in books.iterator(chunk_size=CHUNK_SIZE):
+		genres = []
+		while link is not None and link[0] <= book[0]:
+			if link[0] == book[0]:
+				genres.append(link[1])
+			link = next(links, None)
+		yield book + (GENRE_SEPARATOR.join(genres),)
+
+
+def _author_rows():
+	return Author.objects.order_by('id').values_list('id', 'first_name', 'last_name', 'date_of_birth',
+		'date_of_death').iterator(chunk_size=CHUNK_SIZE)
+
+
+def _copy_rows():
+	return BookInstance.objects.order_by('id').values_list('id', 'book_id', 'book__title', 'imprint', 'lang',
+		'status', 'due_back', 'borrower__username').iterator(chunk_size=CHUNK_SIZE)
+
+
+# The columns (matching the import columns where there are any) and rows of each kind
+EXPORTS = {
+	'books': (('id', 'title', 'summary', 'isbn', 'author_first_name', 'author_last_name', 'genres'), _book_rows),
+	'authors': (('id', 'first_name', 'last_name', 'date_of_birth', 'date_of_death'), _author_rows),
+	'copies': (('id', 'book_id', 'title', 'imprint', 'lang', 'status', 'due_back', 'borrower'), _copy_rows),
+}
+
+
+class _LineBuffer(object):
+	"""
+	A file-like object for csv.writer that returns each line rather than
+	storing it.
+	"""
+	def write(self, value):
+		return value
+
+
+def _csv_value(value):
+	return '' if value is None else value
+
+
+def _json_value(value):
+	# Dates and UUIDs
+	return str(value)
+
+
+def export_lines(kind, format='csv'):
+	"""
+	Yields the lines (each ending with a newline) of the export of one kind
+	of record ('books', 'authors' or 'copies') in the format ('csv' or 'jsonl').
+	"""
+	columns, rows = EXPORTS[kind]
+	if format == 'csv':
+		writer = csv.writer(_LineBuffer())
+		yield writer.writerow(columns)
+		for row in rows():
+			yield writer.writerow([_csv_value(value) for value in row])
+	else:
+		for row in rows():
+			yield json.dumps(dict(zip(columns, row)), default=_json_value) + '\n'
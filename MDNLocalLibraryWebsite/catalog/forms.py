@@ -1,9 +1,26 @@
 from django import forms
+from django.contrib.auth.models import User
 
 from django.core.exceptions import ValidationError
+from django.urls import reverse_lazy
 from django.utils.translation import ugettext_lazy as _ # Django translation function
 import datetime # for checking valid date range.
+from .models import Book
+from .widgets import LazySelect, LazySelectMultiple
 	
+def validate_renewal_date(data):
+	"""
+	The rules for a renewal date set by a librarian.
+	"""
+	#Check date is not in past. 
+	if data < datetime.date.today():
+		raise ValidationError(_('Invalid date - renewal in past'))
+	
+	#Check date is in range librarian allowed to change (+4 weeks).
+	if data > datetime.date.today() + datetime.timedelta(weeks=4):
+		raise ValidationError(_('Invalid date - renewal more than 4 weeks ahead'))
+
+
 class RenewBookForm(forms.Form):
 	renewal_date = forms.DateField(help_text="Enter a date between now and 4 weeks (default 3).")
 
@@ -14,14 +31,107 @@ class RenewBookForm(forms.Form):
 		"""
 		# Get the sanitised data from the form
 		data = self.cleaned_data['renewal_date']
-			  
-		#Check date is not in past. 
-		if data < datetime.date.today():
-			raise ValidationError(_('Invalid date - renewal in past'))
-		
-		#Check date is in range librarian allowed to change (+4 weeks).
-		if data > datetime.date.today() + datetime.timedelta(weeks=4):
-			raise ValidationError(_('Invalid date - renewal more than 4 weeks ahead'))
+		validate_renewal_date(data)
 		
 		# Remember to always return the cleaned data.
 		return data
+
+
+class BulkLoanForm(forms.Form):
+	"""
+	Renew or return many copies at once, e.g. a returns trolley scanned in.
+	The copies' ids are entered one per line (or separated by spaces or commas).
+	"""
+	MAX_INSTANCES = 500
+	RENEW = 'renew'
+	RETURN = 'return'
+
+	action = forms.ChoiceField(choices=((RENEW, _('Renew')), (RETURN, _('Return'))))
+	instances = forms.CharField(widget=forms.Textarea, help_text="The ids of the copies, one per line.")
+	renewal_date = forms.DateField(required=False, help_text="For renewals: a date between now and 4 weeks (default 3).")
+
+	def clean_instances(self):
+		"""
+		Returns the list of ids (without duplicates). Ids that aren't valid are
+		kept, to be reported with the results.
+		"""
+		ids = list(dict.fromkeys(self.cleaned_data['instances'].replace(',', ' ').split()))
+		if not ids:
+			raise ValidationError(_('Enter at least one copy id'))
+		if len(ids) > self.MAX_INSTANCES:
+			raise ValidationError(_('At most %(max)d copies can be changed at once'), params={'max': self.MAX_INSTANCES})
+		return ids
+
+	def clean(self):
+		cleaned_data = super(BulkLoanForm, self).clean()
+		if cleaned_data.get('action') == self.RENEW:
+			renewal_date = cleaned_data.get('renewal_date')
+			if renewal_date is None:
+				if 'renewal_date' not in self.errors:
+					self.add_error('renewal_date', _('Enter the renewal date'))
+			else:
+				try:
+					validate_renewal_date(renewal_date)
+				except ValidationError as e:
+					self.add_error('renewal_date', e)
+		return cleaned_data
+
+
+class CheckoutForm(forms.Form):
+	"""
+	Lend a copy to a borrower, identified by their username.
+	"""
+	borrower = forms.CharField(max_length=150, help_text="The borrower's username.")
+	due_back = forms.DateField(help_text="Enter a date between now and 4 weeks (default 3).")
+
+	def clean_borrower(self):
+		"""
+		Returns the borrower's User.
+		"""
+		try:
+			return User.objects.get(username=self.cleaned_data['borrower'])
+		except User.DoesNotExist:
+			raise ValidationError(_('There is no borrower with that username'))
+
+	def clean_due_back(self):
+		data = self.cleaned_data['due_back']
+		validate_renewal_date(data)
+		return data
+
+
+class SearchForm(forms.Form):
+	"""
+	Full-text book search. Results are ranked, so they are paged with an
+	OFFSET, which is capped to keep deep pages cheap.
+	"""
+	MAX_PAGE = 50
+
+	q = forms.CharField(max_length=200, label=_('Search'), help_text="Words in the book title, summary or author's name.")
+	page = forms.IntegerField(min_value=1, max_value=MAX_PAGE, required=False)
+
+
+class AutocompleteForm(forms.Form):
+	"""
+	Type-ahead lookup of book titles and author names by prefix (see
+	catalog/autocomplete.py).
+	"""
+	MAX_LIMIT = 50
+
+	q = forms.CharField(max_length=200, strip=False)
+	kind = forms.ChoiceField(choices=[('book', 'Books'), ('author', 'Authors')], required=False)
+	limit = forms.IntegerField(min_value=1, max_value=MAX_LIMIT, required=False)
+
+
+class BookForm(forms.ModelForm):
+	"""
+	Book create and update form. The author and genres are picked with lazy
+	widgets (see catalog/widgets.py), so the form doesn't render a whole table
+	of options.
+	"""
+	class Meta:
+		model = Book
+		fields = ['title', 'author', 'summary', 'isbn', 'genre']
+		widgets = {
+			'author': LazySelect(reverse_lazy('picker-choices', args=['authors'])),
+			'genre': LazySelectMultiple(reverse_lazy('picker-choices', args=['genres'])),
+		}
@@ -0,0 +1,129 @@
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+from django.db import transaction
+from django.utils import timezone
+from django.utils.safestring import mark_safe
+from . import routers
+
+# Versioned template fragment caching for the detail pages.
+# A fragment is cached under (fragment name, object id, version), where the
+# version combines a counter for the object and a counter for the whole
+# catalog. The signal handlers in catalog/signals.py bump the counters when
+# the data shown in a fragment changes, so stale fragments are never read
+# again (and simply expire). Counters start from the current time in
+# milliseconds, so one that is evicted from the cache restarts above any
+# value it had before.
+# The time of each bump is cached as well, so the conditional GET checks (see
+# catalog/conditional.py) for a detail page don't need to query the database.
+
+# Counter for changes that affect every fragment (e.g. a genre is renamed)
+CATALOG = 'catalog'
+
+
+def _version_key(kind, pk=None):
+	return 'catalog:fragment-version:%s:%s' % (kind, pk)
+
+
+def _modified_key(kind, pk=None):
+	return 'catalog:modified:%s:%s' % (kind, pk)
+
+
+def _new_version():
+	return int(time.time() * 1000)
+
+
+def get_version(kind, pk):
+	"""
+	Returns the current version string for the fragments of an object,
+	e.g. get_version('book', 5).
+	"""
+	keys = [_version_key(CATALOG), _version_key(kind, pk)]
+	versions = cache.get_many(keys)
+	missing = [key for key in keys if key not in versions]
+	if missing:
+		for key in missing:
+			cache.add(key, _new_version(), None)
+		versions.update(cache.get_many(missing))
+	return '%s.%s' % tuple(versions.get(key, 0) for key in keys)
+
+
+def bump(kind, pk=None):
+	"""
+	Invalidates the fragments of an object (or, with kind=CATALOG, of every
+	object) by moving them to a new version, once the current transaction
+	commits (see _bump()).
+	"""
+	transaction.on_commit(lambda: _bump(kind, pk))
+
+
+def _bump(kind, pk):
+	# Not before the commit: a request in between would cache the old data
+	# (still the committed data) under the new version
+	key = _version_key(kind, pk)
+	try:
+		cache.incr(key)
+	except ValueError:
+		cache.set(key, _new_version(), None)
+	cache.set(_modified_key(kind, pk), timezone.now(), None)
+
+
+def get_last_modified(kind, pk, load):
+	"""
+	Returns when the page of an object last changed: the latest of the cached
+	times it (or the whole catalog) was bumped. If the object's time isn't
+	cached, load() is called (reading from the primary) to get its stored
+	updated_at (None if the object doesn't exist). If the catalog's time isn't cached it is taken as now,
+	which may cause extra full responses but never a stale 304.
+	"""
+	catalog_key, object_key = _modified_key(CATALOG), _modified_key(kind, pk)
+	times = cache.get_many([catalog_key, object_key])
+	modified = times.get(object_key)
+	if modified is None:
+		# Cached for everyone, so read from the primary (see CachedFragmentMixin.get())
+		with routers.use_primary():
+			modified = load()
+		if modified is None:
+			return None
+		cache.add(object_key, modified, None)
+	catalog_modified = times.get(catalog_key)
+	if catalog_modified is None:
+		catalog_modified = timezone.now()
+		cache.add(catalog_key, catalog_modified, None)
+	return max(modified, catalog_modified)
+
+
+class CachedFragmentMixin(object):
+	"""
+	DetailView mixin for templates that wrap the object's details in
+	{% cache fragment_timeout <fragment_name> object_id fragment_version %}.
+	If that fragment is already cached the object is not loaded at all, and
+	the cached HTML is passed to the template as 'cached_fragment'.
+	Anything outside the fragment (e.g. per-user perms blocks) must only use
+	object_id, not the object.
+	"""
+	fragment_name = None
+	fragment_kind = None
+
+	def get_fragment_timeout(self):
+		return getattr(settings, 'CATALOG_FRAGMENT_CACHE_TIMEOUT', 3600)
+
+	def get(self, request, *args, **kwargs):
+		object_id = str(self.kwargs[self.pk_url_kwarg])
+		version = get_version(self.fragment_kind, object_id)
+		cached = cache.get(make_template_fragment_key(self.fragment_name, [object_id, version]))
+		if cached is None:
+			# The fragment is cached under the current version, so it is rendered
+			# from the primary: a lagging replica may not have the change that
+			# moved the version on yet
+			with routers.use_primary():
+				self.object = self.get_object()
+				context = self.get_context_data(object=self.object, object_id=object_id, fragment_version=version,
+					fragment_timeout=self.get_fragment_timeout())
+				return self.render_to_response(context).render()
+		self.object = None
+		context = self.get_context_data(object=self.object, object_id=object_id, fragment_version=version,
+			fragment_timeout=self.get_fragment_timeout())
+		context['cached_fragment'] = mark_safe(cached)
+		return self.render_to_response(context)
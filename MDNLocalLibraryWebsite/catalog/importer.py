@@ -0,0 +1,282 @@
+import csv
+import json
+import os
+import time
+from django.db import connections, router, transaction
+from django.db.models import Max
+from django.utils import timezone
+from .models import Author, Book, BookInstance, Genre, CatalogStats
+from . import search, fragments, autocomplete
+from .text import normalize
+
+# Bulk import of catalogs too big for the forms or the admin (see the
+# 'import_catalog' management command). The input is streamed a chunk of rows
+# at a time. Authors and genres are matched by name through in-memory maps
+# (loaded once), and each chunk is written with bulk_create in one transaction.
+# bulk_create doesn't send the model signals, so each chunk also updates the
+# statistics and search index itself.
+# After each chunk the number of rows done is saved in a checkpoint file, so an
+# import that fails can be run again and carries on after the last chunk.
+# The checkpoint is written once the chunk's transaction has committed, and a
+# file can't be part of that transaction: if the import is killed between the
+# two, the chunk is imported again on resume. Resuming is at-least-once, so
+# after a crash (rather than a bad row, which rolls its chunk back) check the
+# last chunk for duplicate books and copies, or --restart on a clean database.
+#
+# Each row is one book, with the columns (or JSON keys):
+#  title (required), summary, isbn, author_first_name, author_last_name,
+#  genres (names separated by '|', or a JSON list), and
+#  copies (the number of copies to add, default 0), imprint, lang and status
+#  (a BookInstance.LOAN_STATUS code, default 'a') for those copies.
+
+CHUNK_SIZE = 2000
+GENRE_SEPARATOR = '|'
+FORMATS = ('csv', 'jsonl')
+
+
+class CatalogImportError(Exception):
+	"""
+	Raised when the input can't be imported.
+	"""
+	pass
+
+
+def read_rows(path, format=None):
+	"""
+	Yields the rows of a CSV file (with a header line) or a JSON lines file
+	as dicts, one at a time. The format defaults to the file's extension.
+	"""
+	if format is None:
+		format = 'jsonl' if path.endswith(('.jsonl', '.json')) else 'csv'
+	with open(path, newline='', encoding='utf-8') as f:
+		if format == 'csv':
+			for row in csv.DictReader(f):
+				yield row
+		else:
+			for line_number, line in enumerate(f, 1):
+				if not line.strip():
+					continue
+				try:
+					yield json.loads(line)
+				except ValueError as e:
+					raise CatalogImportError('Line %d: %s' % (line_number, e))
+
+
+class Checkpoint(object):
+	"""
+	The number of rows of an input file that have been imported, stored in a
+	small JSON file. Rows can still be corrected (e.g. the one that stopped the
+	import) before resuming, as long as none are added or removed before them.
+	It is saved after each chunk commits, so it can be one chunk behind the
+	database (see the top of this module).
+	"""
+	def __init__(self, path):
+		self.path = path
+
+	def load(self):
+		"""
+		Returns the number of rows already imported (0 if there is no checkpoint).
+		"""
+		try:
+			with open(self.path, encoding='utf-8') as f:
+				data = json.load(f)
+		except FileNotFoundError:
+			return 0
+		return data['rows']
+
+	def save(self, rows):
+		# Write a new file and move it into place, so a crash never leaves half a checkpoint
+		temp_path = self.path + '.tmp'
+		with open(temp_path, 'w', encoding='utf-8') as f:
+			json.dump({'rows': rows}, f)
+		os.replace(temp_path, self.path)
+
+	def clear(self):
+		if os.path.exists(self.path):
+			os.remove(self.path)
+
+
+def _chunks(rows, size):
+	chunk = []
+	for row in rows:
+		chunk.append(row)
+		if len(chunk) == size:
+			yield chunk
+			chunk = []
+	if chunk:
+		yield chunk
+
+
+def _text(row, name):
+	value = row.get(name)
+	return '' if value is None else str(value).strip()
+
+
+class CatalogImporter(object):
+	"""
+	Imports rows (see the top of this module) in chunks of chunk_size. Use
+	import_rows() for an iterable of dicts, or import_file() for a file.
+	"""
+	def __init__(self, chunk_size=CHUNK_SIZE, stdout=None):
+		self.chunk_size = chunk_size
+		self.stdout = stdout
+		self.db = router.db_for_write(Book)
+		self.authors = None # (first name, last name) -> id
+		self.genres = None # name -> id
+		self.counts = {'rows': 0, 'books': 0, 'copies': 0, 'authors': 0, 'genres': 0}
+
+	def log(self, message):
+		if self.stdout is not None:
+			self.stdout.write(message)
+
+	def load_lookups(self):
+		"""
+		Loads the names of the existing authors and genres.
+		"""
+		self.authors = {(first, last): pk for pk, first, last in
+			Author.objects.using(self.db).values_list('id', 'first_name', 'last_name').iterator()}
+		self.genres = {name: pk for pk, name in Genre.objects.using(self.db).values_list('id', 'name').iterator()}
+
+	def parse_row(self, row, row_number):
+		"""
+		Returns the cleaned up fields of an input row.
+		"""
+		title = _text(row, 'title')
+		if not title:
+			raise CatalogImportError('Row %d: the title is missing.' % row_number)
+		genres = row.get('genres') or []
+		if isinstance(genres, str):
+			genres = genres.split(GENRE_SEPARATOR)
+		try:
+			copies = int(row.get('copies') or 0)
+		except (TypeError, ValueError):
+			raise CatalogImportError('Row %d: copies must be a number.' % row_number)
+		status = _text(row, 'status') or 'a'
+		if status not in dict(BookInstance.LOAN_STATUS):
+			raise CatalogImportError('Row %d: unknown status %r.' % (row_number, status))
+		first_name, last_name = _text(row, 'author_first_name'), _text(row, 'author_last_name')
+		return {
+			'title': title,
+			'summary': _text(row, 'summary'),
+			'isbn': _text(row, 'isbn'),
+			'author': (first_name, last_name) if first_name or last_name else None,
+			'genres': [name for name in (str(genre).strip() for genre in genres) if name],
+			'copies': copies,
+			'imprint': _text(row, 'imprint'),
+			'lang': _text(row, 'lang'),
+			'status': status,
+		}
+
+	def insert(self, model, objs):
+		"""
+		Inserts the objects with bulk_create and returns their new ids, in order.
+		Must be called inside a transaction.
+		"""
+		if not objs:
+			return []
+		if connections[self.db].features.can_return_ids_from_bulk_insert:
+			model.objects.using(self.db).bulk_create(objs)
+			return [obj.pk for obj in objs]
+		# The database doesn't return the new ids (e.g. SQLite), so read back
+		# the rows above the previous largest id.
+		last_id = model.objects.using(self.db).aggregate(last_id=Max('id'))['last_id'] or 0
+		model.objects.using(self.db).bulk_create(objs)
+		ids = list(model.objects.using(self.db).filter(id__gt=last_id).order_by('id').values_list('id', flat=True))
+		if len(ids) != len(objs):
+			raise CatalogImportError('Another process added %s rows during the import.' % model._meta.verbose_name)
+		return ids
+
+	def import_chunk(self, rows):
+		"""
+		Writes one chunk of parsed rows in a single transaction.
+		"""
+		new_authors = list(dict.fromkeys(row['author'] for row in rows
+			if row['author'] is not None and row['author'] not in self.authors))
+		new_genres = list(dict.fromkeys(name for row in rows for name in row['genres'] if name not in self.genres))
+
+		with transaction.atomic(using=self.db):
+			# The lookup maps are only updated once the transaction has committed
+			added_authors = dict(zip(new_authors, self.insert(Author,
+				[Author(first_name=first, last_name=last) for first, last in new_authors])))
+			added_genres = dict(zip(new_genres, self.insert(Genre, [Genre(name=name, name_key=normalize(name)) for name in new_genres])))
+
+			def author_id(author):
+				return added_authors.get(author) or self.authors.get(author)
+
+			def genre_id(name):
+				return added_genres.get(name) or self.genres[name]
+
+			# The books are new, so their copy counts are just the copies imported
+			book_ids = self.insert(Book, [Book(title=row['title'], summary=row['summary'], isbn=row['isbn'],
+				author_id=author_id(row['author']), **Book.copy_count_changes(None, row['status'], row['copies']))
+				for row in rows])
+			Through = Book.genre.through
+			Through.objects.using(self.db).bulk_create([Through(book_id=book_id, genre_id=genre_id(name))
+				for book_id, row in zip(book_ids, rows) for name in dict.fromkeys(row['genres'])])
+			copies = [BookInstance(book_id=book_id, imprint=row['imprint'], lang=row['lang'], status=row['status'])
+				for book_id, row in zip(book_ids, rows) for i in range(row['copies'])]
+			BookInstance.objects.using(self.db).bulk_create(copies)
+
+			search.index_books(book_ids)
+			CatalogStats.adjust(num_books=len(book_ids), num_instances=len(copies),
+				num_instances_available=sum(1 for copy in copies if copy.status == 'a'),
+				num_authors=len(new_authors), num_genres=len(new_genres),
+				num_books_word=sum(1 for row in rows if CatalogStats.title_matches(row['title'])))
+
+		# The pages of existing authors now list more books. Bumping each one's
+		# fragments would cost a cache write per author, so move every page to a
+		# new version once instead.
+		changed_authors = set(self.authors[row['author']] for row in rows
+			if row['author'] is not None and row['author'] not in added_authors)
+		if changed_authors:
+			Author.objects.using(self.db).filter(pk__in=changed_authors).update(updated_at=timezone.now())
+			fragments.bump(fragments.CATALOG)
+		# Bulk inserts don't send the signals that keep the autocomplete indexes up to date
+		autocomplete.changed('book', book_ids)
+		autocomplete.changed('author', added_authors.values())
+		self.authors.update(added_authors)
+		self.genres.update(added_genres)
+		self.counts['books'] += len(book_ids)
+		self.counts['copies'] += len(copies)
+		self.counts['authors'] += len(new_authors)
+		self.counts['genres'] += len(new_genres)
+
+	def import_rows(self, rows, skip=0, checkpoint=None):
+		"""
+		Imports the rows after the first skip (already imported) ones, saving
+		the progress to the checkpoint after each chunk. Returns the counts of
+		rows read and objects created.
+		"""
+		if self.authors is None:
+			self.load_lookups()
+		done = 0
+		started = time.time()
+		for chunk in _chunks(rows, self.chunk_size):
+			if done + len(chunk) <= skip:
+				done += len(chunk)
+				continue
+			first = max(skip - done, 0)
+			self.import_chunk([self.parse_row(row, done + i + 1) for i, row in enumerate(chunk) if i >= first])
+			self.counts['rows'] += len(chunk) - first
+			done += len(chunk)
+			if checkpoint is not None:
+				checkpoint.save(done)
+			elapsed = time.time() - started
+			self.log('%d rows imported (%.0f rows/s)' % (done, self.counts['rows'] / elapsed if elapsed else 0))
+		return self.counts
+
+	def import_file(self, path, format=None, checkpoint_path=None, restart=False):
+		"""
+		Imports a CSV or JSON lines file, carrying on from its checkpoint (by
+		default <path>.checkpoint) unless restart is True. The checkpoint is
+		removed once the whole file has been imported.
+		"""
+		checkpoint = Checkpoint(checkpoint_path or path + '.checkpoint')
+		if restart:
+			checkpoint.clear()
+		skip = checkpoint.load()
+		if skip:
+			self.log('Resuming after row %d' % skip)
+		counts = self.import_rows(read_rows(path, format), skip=skip, checkpoint=checkpoint)
+		checkpoint.clear()
+		return counts
@@ -0,0 +1,159 @@
+import datetime
+import uuid
+from collections import Counter
+from django.db import transaction
+from django.utils import timezone
+from .models import Book, BookInstance, CatalogStats
+from .signals import books_changed
+
+# Lending, returning and reserving copies, one at a time (checkout(),
+# return_copy() and reserve()) or many at once (bulk_renew(), bulk_return()).
+# Every change is a conditional UPDATE (e.g. ... WHERE status = 'a'), so two
+# librarians can't lend the same copy: the database lets only one of the
+# updates match, and the other gets a LoanConflict.
+# queryset.update() doesn't send the model signals, so the statistics, the
+# books' copy counts and their pages are updated here instead.
+
+# The loan period when no due date is given
+LOAN_PERIOD = datetime.timedelta(weeks=3)
+
+
+class LoanConflict(Exception):
+	"""
+	Raised when a copy isn't in a state that allows the change (e.g. lending a
+	copy that is already on loan). The message says why.
+	"""
+	pass
+
+
+def _count_status_change(book_id, old_status, new_status, count=1):
+	"""
+	Updates the book's copy counts and the catalog statistics for count of
+	its copies changing from old_status to new_status.
+	"""
+	Book.adjust_copy_counts(book_id, **Book.copy_count_changes(old_status, new_status, count))
+	CatalogStats.adjust(num_instances_available=count * (int(new_status == 'a') - int(old_status == 'a')))
+
+
+def _transition(pk, transitions, messages, **changes):
+	"""
+	Applies the changes to a copy with the first of the transitions that
+	matches its current state in the database. Each transition is a
+	(status, other filters) pair. Raises BookInstance.DoesNotExist, or
+	LoanConflict with the message for the copy's status if no transition
+	matches.
+	"""
+	copies = BookInstance.objects.filter(pk=pk)
+	with transaction.atomic():
+		for status, conditions in transitions:
+			if copies.filter(status=status, **conditions).update(updated_at=timezone.now(), **changes):
+				book_id = copies.values_list('book_id', flat=True).get()
+				_count_status_change(book_id, status, changes['status'])
+				break
+		else:
+			status = copies.values_list('status', flat=True).get()
+			raise LoanConflict(messages.get(status, 'This copy is not available.'))
+	books_changed([book_id])
+
+
+def checkout(pk, borrower, due_back=None):
+	"""
+	Lends a copy that is available (or reserved for the borrower).
+	"""
+	_transition(pk, [('a', {}), ('r', {'borrower': borrower})], {
+			'o': 'This copy is already on loan.',
+			'r': 'This copy is reserved for someone else.',
+			'd': 'This copy is being maintained.',
+		}, status='o', borrower=borrower, due_back=due_back or datetime.date.today() + LOAN_PERIOD)
+
+
+def return_copy(pk):
+	"""
+	Marks a copy that is on loan as returned.
+	"""
+	_transition(pk, [('o', {})], {
+			'a': 'This copy has already been returned.',
+			'r': 'This copy is reserved, not on loan.',
+			'd': 'This copy is being maintained.',
+		}, status='a', borrower=None, due_back=None)
+
+
+def reserve(pk, borrower):
+	"""
+	Reserves an available copy for the borrower to collect.
+	"""
+	_transition(pk, [('a', {})], {
+			'o': 'This copy is on loan.',
+			'r': 'This copy is already reserved.',
+			'd': 'This copy is being maintained.',
+		}, status='r', borrower=borrower, due_back=None)
+
+
+# Results for each copy of a bulk change
+RENEWED = 'renewed'
+RETURNED = 'returned'
+NOT_ON_LOAN = 'not on loan'
+NOT_FOUND = 'not found'
+INVALID_ID = 'invalid id'
+
+
+def _parse_ids(ids):
+	"""
+	Returns {id as given: UUID, or None if it isn't one}.
+	"""
+	parsed = {}
+	for pk in ids:
+		try:
+			parsed[pk] = pk if isinstance(pk, uuid.UUID) else uuid.UUID(str(pk))
+		except ValueError:
+			parsed[pk] = None
+	return parsed
+
+
+def _bulk_update(ids, done, **changes):
+	"""
+	Applies the changes to the copies that are on loan, and returns the
+	(id, result) for each id, in the order given.
+	"""
+	parsed = _parse_ids(ids)
+	with transaction.atomic():
+		# Lock the rows (where the database can), so the statuses read here
+		# are still the same when the update runs
+		loans = BookInstance.objects.select_for_update().filter(id__in=[pk for pk in parsed.values() if pk is not None])
+		found = {pk: (status, book_id) for pk, status, book_id in loans.values_list('id', 'status', 'book_id')}
+		changed = [pk for pk, (status, book_id) in found.items() if status == 'o']
+		if changed:
+			BookInstance.objects.filter(id__in=changed).update(updated_at=timezone.now(), **changes)
+			if 'status' in changes:
+				for book_id, count in Counter(found[pk][1] for pk in changed).items():
+					_count_status_change(book_id, 'o', changes['status'], count)
+	books_changed(found[pk][1] for pk in changed)
+
+	results = []
+	for given, pk in parsed.items():
+		if pk is None:
+			result = INVALID_ID
+		elif pk not in found:
+			result = NOT_FOUND
+		elif found[pk][0] != 'o':
+			result = NOT_ON_LOAN
+		else:
+			result = done
+		results.append((given, result))
+	return results
+
+
+def bulk_renew(ids, due_back):
+	"""
+	Sets a new due date for the copies that are on loan. Returns a list of
+	(id, result) pairs, e.g. [('<uuid>', RENEWED), ('xyz', INVALID_ID)].
+	"""
+	return _bulk_update(ids, RENEWED, due_back=due_back)
+
+
+def bulk_return(ids):
+	"""
+	Marks the copies that are on loan as returned (available, with no
+	borrower or due date). Returns a list of (id, result) pairs.
+	"""
+	return _bulk_update(ids, RETURNED, status='a', due_back=None, borrower=None)
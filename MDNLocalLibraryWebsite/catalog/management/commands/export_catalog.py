@@ -0,0 +1,55 @@
+import bz2
+import gzip
+import lzma
+from django.core.management.base import BaseCommand
+from catalog import export
+
+# Compressed file openers, by name and file extension
+COMPRESSORS = {
+	'gzip': gzip.open,
+	'bz2': bz2.open,
+	'xz': lzma.open,
+}
+EXTENSIONS = {
+	'.gz': 'gzip',
+	'.bz2': 'bz2',
+	'.xz': 'xz',
+}
+
+
+class Command(BaseCommand):
+	"""
+	Export the books, authors or copies of the catalog, as the librarians'
+	export view does, to a (optionally compressed) file or standard output.
+	Book exports can be loaded again with 'import_catalog'.
+	"""
+	help = 'Exports the books, authors or copies in the catalog as CSV or JSON lines.'
+
+	def add_arguments(self, parser):
+		parser.add_argument('kind', choices=export.KINDS, help='The records to export.')
+		parser.add_argument('--format', choices=export.FORMATS, default='csv', help='The output format.')
+		parser.add_argument('--output', '-o',
+			help='The file to write (standard output by default).')
+		parser.add_argument('--compress', choices=sorted(COMPRESSORS),
+			help='Compress the output file (by default, chosen by its extension: .gz, .bz2 or .xz).')
+
+	def handle(self, *args, **options):
+		lines = export.export_lines(options['kind'], options['format'])
+		path = options['output']
+		if path is None:
+			for line in lines:
+				self.stdout.write(line, ending='')
+			return
+
+		compress = options['compress']
+		if compress is None:
+			compress = next((name for extension, name in EXTENSIONS.items() if path.endswith(extension)), None)
+		opener = COMPRESSORS[compress] if compress else open
+		count = 0
+		with opener(path, 'wt', encoding='utf-8', newline='') as f:
+			for line in lines:
+				f.write(line)
+				count += 1
+		if options['format'] == 'csv':
+			count -= 1 # The header line
+		self.stdout.write(self.style.SUCCESS('Exported %d %s to %s.' % (count, options['kind'], path)))
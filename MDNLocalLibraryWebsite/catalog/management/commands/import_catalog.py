@@ -0,0 +1,43 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from catalog import importer
+
+
+class Command(BaseCommand):
+	"""
+	Bulk import books (with their authors, genres and copies) from a CSV or
+	JSON lines file. See catalog/importer.py for the columns. If the import
+	fails, fix the problem and run the same command again to carry on from
+	the last chunk that was written. The checkpoint is saved just after each
+	chunk commits, so if the command is killed in between, that chunk is
+	imported twice when resuming.
+	"""
+	help = ('Imports books, authors, genres and copies from a CSV or JSON lines file. '
+		'Running it again resumes after the last checkpoint; this is at-least-once, so '
+		'if the command was killed (rather than stopped by a bad row) the last chunk '
+		'may be imported twice.')
+
+	def add_arguments(self, parser):
+		parser.add_argument('path', help='The CSV (with a header line) or JSON lines file to import.')
+		parser.add_argument('--format', choices=importer.FORMATS,
+			help='The input format (by default, .jsonl and .json files are JSON lines, anything else CSV).')
+		parser.add_argument('--chunk-size', type=int, default=importer.CHUNK_SIZE,
+			help='Number of rows written per transaction.')
+		parser.add_argument('--checkpoint',
+			help='The checkpoint file recording the progress (default <path>.checkpoint).')
+		parser.add_argument('--restart', action='store_true',
+			help='Ignore any checkpoint and import the whole file.')
+
+	def handle(self, *args, **options):
+		started = time.time()
+		catalog_importer = importer.CatalogImporter(chunk_size=options['chunk_size'], stdout=self.stdout)
+		try:
+			counts = catalog_importer.import_file(options['path'], format=options['format'],
+				checkpoint_path=options['checkpoint'], restart=options['restart'])
+		except (importer.CatalogImportError, OSError) as e:
+			raise CommandError('%s (%d rows imported)' % (e, catalog_importer.counts['rows']))
+		elapsed = time.time() - started
+		self.stdout.write(self.style.SUCCESS(
+			'Imported %d rows in %.1fs (%.0f rows/s): %d books, %d copies, %d new authors, %d new genres.' % (
+				counts['rows'], elapsed, counts['rows'] / elapsed if elapsed else 0,
+				counts['books'], counts['copies'], counts['authors'], counts['genres'])))
@@ -0,0 +1,67 @@
+import pstats
+import tracemalloc
+from io import StringIO
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.test.utils import override_settings
+from catalog import profiling
+
+
+class Command(BaseCommand):
+	"""
+	Profile one catalog URL offline, e.g. against a database seeded by the
+	benchmarks (DATABASE_URL=sqlite:////tmp/benchmark.sqlite3). The request
+	goes through the whole middleware stack with the test client, and the
+	same reports as a ?profile=1 request are written (see catalog/profiling.py).
+	"""
+	help = 'Profiles a request for a URL, writing collapsed-stack and allocation reports.'
+
+	def add_arguments(self, parser):
+		parser.add_argument('url', help='The path to request, e.g. /catalog/books/?sort=available')
+		parser.add_argument('--user', help='Username to request the page as (anonymous by default).')
+		parser.add_argument('--repeat', type=int, default=1, help='Profiled requests (the reports cover them all).')
+		parser.add_argument('--warmup', type=int, default=1, help='Unprofiled requests first, to fill the caches.')
+		parser.add_argument('--output-dir', help='Where to write the reports (REQUEST_PROFILING_DIRECTORY by default).')
+		parser.add_argument('--top', type=int, default=15, help='Functions to list, by cumulative time.')
+
+	def handle(self, *args, **options):
+		client = Client()
+		if options['user']:
+			try:
+				client.force_login(User.objects.get(username=options['user']))
+			except User.DoesNotExist:
+				raise CommandError('There is no user %r.' % options['user'])
+
+		def request():
+			response = client.get(options['url'], secure=True)
+			if response.streaming:
+				for chunk in response.streaming_content:
+					pass
+			return response
+
+		# The test client isn't one of the hosts the site is served on
+		with override_settings(ALLOWED_HOSTS=['*']):
+			for i in range(options['warmup']):
+				request()
+			profile = profiling.Profile('%s x%d' % (options['url'], options['repeat']))
+			# Trace the memory over the whole loop, so the allocation report
+			# covers all the requests rather than only the last one
+			started_tracing = not tracemalloc.is_tracing()
+			if started_tracing:
+				tracemalloc.start()
+			try:
+				for i in range(options['repeat']):
+					response = profile.run(request)
+			finally:
+				if started_tracing:
+					tracemalloc.stop()
+		paths = profile.write(options['output_dir'])
+
+		self.stdout.write('%s: %d' % (options['url'], response.status_code))
+		# self.stdout ends every write with a newline, so print the stats in one go
+		out = StringIO()
+		pstats.Stats(profile.profiler, stream=out).sort_stats('cumulative').print_stats(options['top'])
+		self.stdout.write(out.getvalue())
+		for path in paths:
+			self.stdout.write(self.style.SUCCESS('Wrote %s' % path))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from catalog.models import CatalogStats
+
+
+class Command(BaseCommand):
+	"""
+	Recount the home page statistics from the catalog tables. Run this after
+	bulk loads (which bypass the signal handlers) or if the counts drift.
+	"""
+	help = 'Rebuilds the denormalized catalog statistics from scratch.'
+
+	def handle(self, *args, **options):
+		stats = CatalogStats.rebuild()
+		self.stdout.write(self.style.SUCCESS(
+			'Rebuilt catalog stats: %d books, %d copies (%d available), %d authors, %d genres.' % (
+				stats.num_books, stats.num_instances, stats.num_instances_available,
+				stats.num_authors, stats.num_genres)))
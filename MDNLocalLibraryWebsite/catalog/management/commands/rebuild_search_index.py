@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from catalog import search
+
+
+class Command(BaseCommand):
+	"""
+	Rebuild the full-text search index from the book and author tables. Run
+	this after bulk loads (which bypass the signal handlers).
+	"""
+	help = 'Rebuilds the full-text book search index from scratch.'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--chunk-size', type=int, default=search.REBUILD_CHUNK_SIZE,
+			help='Number of books indexed per statement.')
+
+	def handle(self, *args, **options):
+		count = search.rebuild_index(chunk_size=options['chunk_size'])
+		self.stdout.write(self.style.SUCCESS('Rebuilt search index: %d books.' % count))
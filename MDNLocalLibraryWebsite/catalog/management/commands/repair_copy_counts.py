@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from catalog.models import Book
+
+
+class Command(BaseCommand):
+	"""
+	Recount the copies of every book and correct the stored copy counts that
+	are wrong. Run this after bulk changes to copies (which bypass the signal
+	handlers), or with --dry-run to check the counts.
+	"""
+	help = 'Checks the copy counts of every book against its copies, and repairs them.'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--dry-run', action='store_true', help='Only report the books with wrong counts.')
+		parser.add_argument('--chunk-size', type=int, default=1000, help='Books checked (and locked) at a time.')
+
+	def handle(self, *args, **options):
+		wrong = Book.repair_copy_counts(chunk_size=options['chunk_size'], dry_run=options['dry_run'])
+		if not wrong:
+			self.stdout.write(self.style.SUCCESS('The copy counts of every book are correct.'))
+			return
+		for book_id in wrong[:20]:
+			self.stdout.write('Wrong copy counts for book %d' % book_id)
+		if len(wrong) > 20:
+			self.stdout.write('... and %d more' % (len(wrong) - 20))
+		if options['dry_run']:
+			self.stdout.write(self.style.WARNING('%d books have wrong copy counts.' % len(wrong)))
+		else:
+			self.stdout.write(self.style.SUCCESS('Repaired the copy counts of %d books.' % len(wrong)))
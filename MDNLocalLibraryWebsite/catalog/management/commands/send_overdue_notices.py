@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from catalog import notices
+
+
+class Command(BaseCommand):
+	"""
+	Email every borrower with overdue books a single notice listing them.
+	Run it daily (e.g. from cron).
+	"""
+	help = 'Emails one overdue notice to each borrower with overdue books.'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--dry-run', action='store_true',
+			help='Build the notices and report the counts, without sending anything.')
+		parser.add_argument('--batch-size', type=int, default=notices.BATCH_SIZE,
+			help='Number of messages handed to the mail connection at a time.')
+
+	def handle(self, *args, **options):
+		stats = notices.OverdueNotices(batch_size=options['batch_size'], dry_run=options['dry_run']).send()
+		self.stdout.write(self.style.SUCCESS(
+			'%s %d notices for %d overdue loans in %.1fs (%.0f messages/s). %d borrowers have no email address.' % (
+				'Would send' if options['dry_run'] else 'Sent', stats['sent'], stats['loans'], stats['seconds'],
+				stats['sent'] / stats['seconds'] if stats['seconds'] else 0, stats['no_email'])))
@@ -0,0 +1,46 @@
+# Generated by Django 2.2.28 on 2026-10-17 15:59
+
+from django.db import migrations, models
+
+
+def populate_catalog_stats(apps, schema_editor):
+    # Seed the singleton statistics row from the existing catalog data
+    Book = apps.get_model('catalog', 'Book')
+    BookInstance = apps.get_model('catalog', 'BookInstance')
+    Author = apps.get_model('catalog', 'Author')
+    Genre = apps.get_model('catalog', 'Genre')
+    CatalogStats = apps.get_model('catalog', 'CatalogStats')
+    CatalogStats.objects.update_or_create(pk=1, defaults={
+        'num_books': Book.objects.count(),
+        'num_instances': BookInstance.objects.count(),
+        'num_instances_available': BookInstance.objects.filter(status='a').count(),
+        'num_authors': Author.objects.count(),
+        'num_genres': Genre.objects.count(),
+        'num_books_word': Book.objects.filter(title__icontains='Nac').count(),
+    })
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0008_auto_20171119_1633'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogStats',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('num_books', models.IntegerField(default=0)),
+                ('num_instances', models.IntegerField(default=0)),
+                ('num_instances_available', models.IntegerField(default=0)),
+                ('num_authors', models.IntegerField(default=0)),
+                ('num_genres', models.IntegerField(default=0)),
+                ('num_books_word', models.IntegerField(default=0)),
+            ],
+            options={
+                'verbose_name_plural': 'catalog stats',
+            },
+        ),
+        migrations.RunPython(populate_catalog_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,47 @@
+from django.db import migrations
+
+
+# The full-text search index used by catalog/search.py. It depends on the
+# database vendor, so it is created with raw SQL rather than model fields.
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE catalog_book_fts USING fts5("
+            "title, summary, author, tokenize='porter unicode61')")
+        schema_editor.execute(
+            "INSERT INTO catalog_book_fts (rowid, title, summary, author) "
+            "SELECT b.id, b.title, b.summary, COALESCE(a.first_name || ' ' || a.last_name, '') "
+            "FROM catalog_book b LEFT JOIN catalog_author a ON a.id = b.author_id")
+    elif vendor == 'postgresql':
+        schema_editor.execute("ALTER TABLE catalog_book ADD COLUMN search_vector tsvector")
+        schema_editor.execute(
+            "UPDATE catalog_book AS t SET search_vector = "
+            "setweight(to_tsvector('english', b.title), 'A') || "
+            "setweight(to_tsvector('english', COALESCE(a.first_name || ' ' || a.last_name, '')), 'B') || "
+            "setweight(to_tsvector('english', b.summary), 'C') "
+            "FROM catalog_book b LEFT JOIN catalog_author a ON a.id = b.author_id "
+            "WHERE t.id = b.id")
+        schema_editor.execute(
+            "CREATE INDEX catalog_book_search_vector_gin ON catalog_book USING gin (search_vector)")
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE IF EXISTS catalog_book_fts")
+    elif vendor == 'postgresql':
+        schema_editor.execute("DROP INDEX IF EXISTS catalog_book_search_vector_gin")
+        schema_editor.execute("ALTER TABLE catalog_book DROP COLUMN IF EXISTS search_vector")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0009_catalogstats'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 2.2.28 on 2026-10-17 17:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0011_loan_and_listing_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VisitCount',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('visitor', models.CharField(max_length=40, unique=True)),
+                ('count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+    ]
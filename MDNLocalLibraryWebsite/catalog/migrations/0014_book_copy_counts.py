@@ -0,0 +1,59 @@
+# Generated by Django 2.2.28 on 2026-10-17 17:37
+
+from django.db import migrations, models
+
+
+def count_copies(apps, schema_editor):
+    # Fill in the copy counts of the existing books
+    Book = apps.get_model('catalog', 'Book')
+    BookInstance = apps.get_model('catalog', 'BookInstance')
+    statuses = {'a': 'num_available', 'o': 'num_on_loan', 'r': 'num_reserved', 'd': 'num_maintenance'}
+    counts = BookInstance.objects.filter(book__isnull=False).order_by().values('book_id').annotate(
+        num_copies=models.Count('id'),
+        **{name: models.Count('id', filter=models.Q(status=status)) for status, name in statuses.items()})
+    for row in counts.iterator():
+        Book.objects.filter(pk=row.pop('book_id')).update(**row)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0013_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='num_available',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='num_copies',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='num_maintenance',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='num_on_loan',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='num_reserved',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_copies, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(condition=models.Q(num_available__gt=0), fields=['title', 'id'], name='book_available_title_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['num_available', 'id'], name='book_num_available_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 2.2.28 on 2026-10-17 18:42
+
+from django.db import migrations, models
+
+from catalog.text import normalize
+
+
+def fill_name_keys(apps, schema_editor):
+    # Normalize the names of the existing genres
+    Genre = apps.get_model('catalog', 'Genre')
+    for pk, name in Genre.objects.values_list('id', 'name').iterator():
+        Genre.objects.filter(pk=pk).update(name_key=normalize(name))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0015_genre_name_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='genre',
+            name='name_key',
+            field=models.CharField(default='', editable=False, max_length=200),
+        ),
+        migrations.RunPython(fill_name_keys, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='genre',
+            index=models.Index(fields=['name_key', 'id'], name='genre_name_key_id_idx'),
+        ),
+    ]
@@ -1,8 +1,11 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F
 from django.urls import reverse #Used to generate URLs by reversing the URL patterns
 import uuid # Required for unique book instances
 from django.contrib.auth.models import User # Used so a user can loan one or more books
 from datetime import date
+from django.utils import timezone
+from .text import normalize
 
 
 class Genre(models.Model):
@@ -10,6 +13,9 @@ class Genre(models.Model):
 	Model representing a book genre (e.g. Science Fiction, Non Fiction).
 	"""
 	name = models.CharField(max_length=200, help_text="Enter a book genre (e.g. Science Fiction, French Poetry etc.)")
+	# The name normalized for prefix searches (see catalog/text.py), set by save()
+	name_key = models.CharField(max_length=200, editable=False, default='')
+	updated_at = models.DateTimeField(auto_now=True)
 	
 	def __str__(self):
 		"""
@@ -17,6 +23,18 @@ class Genre(models.Model):
 		"""
 		return self.name
 
+	def save(self, *args, **kwargs):
+		self.name_key = normalize(self.name)
+		super().save(*args, **kwargs)
+
+	class Meta:
+		# The genre picker (see catalog/widgets.py) is (cursor) paginated by name,
+		# and searched (and then paginated) by name_key
+		indexes = [
+			models.Index(fields=['name', 'id'], name='genre_name_id_idx'),
+			models.Index(fields=['name_key', 'id'], name='genre_name_key_id_idx'),
+		]
+
 
 class Book(models.Model):
 	"""
@@ -31,12 +49,104 @@ class Book(models.Model):
 	genre = models.ManyToManyField(Genre, help_text="Select a genre for this book")
 	# ManyToManyField used because genre can contain many books. Books can cover many genres.
 	# Genre class has already been defined so we can specify the object above.
+	updated_at = models.DateTimeField(auto_now=True, db_index=True)
+	# Also set by the signal handlers when the book's author, genres or copies change,
+	# so it is when the book's page last changed.
+	num_copies = models.IntegerField(default=0, editable=False)
+	num_available = models.IntegerField(default=0, editable=False)
+	num_on_loan = models.IntegerField(default=0, editable=False)
+	num_reserved = models.IntegerField(default=0, editable=False)
+	num_maintenance = models.IntegerField(default=0, editable=False)
+	# The number of copies of the book, in total and with each status. Kept up to
+	# date, in the same transaction as the change to the copy, by the signal
+	# handlers in catalog/signals.py and by catalog/loans.py. They can be checked
+	# and repaired with the 'repair_copy_counts' management command.
+
+	# The copy count for each status (see BookInstance.LOAN_STATUS)
+	STATUS_COUNTS = {'a': 'num_available', 'o': 'num_on_loan', 'r': 'num_reserved', 'd': 'num_maintenance'}
+	COPY_COUNTS = ('num_copies', 'num_available', 'num_on_loan', 'num_reserved', 'num_maintenance')
 	
 	def __str__(self):
 		"""
 		String for representing the Model object.
 		"""
 		return self.title
+
+	def save(self, *args, **kwargs):
+		"""
+		Saves the book without its copy counts (unless they are listed in
+		update_fields), so saving a book that was loaded a while ago doesn't
+		undo the changes made to its copies since.
+		"""
+		if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+			kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+				if not field.primary_key and field.name not in self.COPY_COUNTS]
+		super(Book, self).save(*args, **kwargs)
+
+	@classmethod
+	def copy_count_changes(cls, old_status=None, new_status=None, count=1):
+		"""
+		Returns the changes to a book's copy counts when count of its copies
+		change from old_status to new_status. A status of None means the copies
+		are added to (or removed from) the book.
+		"""
+		changes = {}
+		for status, delta in ((old_status, -count), (new_status, count)):
+			if status is not None:
+				for name in ('num_copies', cls.STATUS_COUNTS.get(status)):
+					if name is not None:
+						changes[name] = changes.get(name, 0) + delta
+		return changes
+
+	@classmethod
+	def adjust_copy_counts(cls, book_id, **deltas):
+		"""
+		Atomically adds the deltas to a book's copy counts, e.g.
+		Book.adjust_copy_counts(5, num_available=-1, num_on_loan=1). Zero
+		deltas are ignored.
+		"""
+		changes = {name: F(name) + delta for name, delta in deltas.items() if delta}
+		if changes and book_id is not None:
+			cls.objects.filter(pk=book_id).update(**changes)
+
+	@classmethod
+	def count_copies(cls, book_ids):
+		"""
+		Counts the copies of the books from the BookInstance table (one query).
+		Returns {book id: {copy count name: count}}.
+		"""
+		counts = {book_id: dict.fromkeys(cls.COPY_COUNTS, 0) for book_id in book_ids}
+		by_status = {name: models.Count('id', filter=models.Q(status=status)) for status, name in cls.STATUS_COUNTS.items()}
+		copies = BookInstance.objects.filter(book_id__in=book_ids).order_by().values('book_id')
+		for row in copies.annotate(num_copies=models.Count('id'), **by_status):
+			counts[row.pop('book_id')].update(row)
+		return counts
+
+	@classmethod
+	def repair_copy_counts(cls, chunk_size=1000, dry_run=False):
+		"""
+		Recounts the copies of every book, a chunk of books at a time, and
+		corrects the stored counts that are wrong (unless dry_run). Each chunk
+		of books is locked while it is checked, so copies changing at the same
+		time are counted correctly. Returns the ids of the books that were wrong.
+		"""
+		wrong = []
+		last_id = 0
+		while True:
+			with transaction.atomic():
+				books = list(cls.objects.select_for_update().filter(pk__gt=last_id).order_by('pk')
+					.values('pk', *cls.COPY_COUNTS)[:chunk_size])
+				if not books:
+					break
+				last_id = books[-1]['pk']
+				counts = cls.count_copies([book['pk'] for book in books])
+				for book in books:
+					book_id = book.pop('pk')
+					if book != counts[book_id]:
+						wrong.append(book_id)
+						if not dry_run:
+							cls.objects.filter(pk=book_id).update(**counts[book_id])
+		return wrong
 	
 	def get_absolute_url(self):
 		"""
@@ -47,8 +157,8 @@ class Book(models.Model):
 	def display_genre(self):
 		"""
 		Creates a string for the Genre field out of the first three values. 
-		Used to display the book's genres in the admin view.
-		This function performs a db lookup every call, so it's not scalable.
+		Used to display the book's genres in the admin view, which prefetches
+		them (otherwise this performs a db lookup every call).
 		"""
 		return ", ".join([genre.name for genre in self.genre.all()[:3]])
 
@@ -66,6 +176,35 @@ class Book(models.Model):
 		# 2). Adding a method 'queryset' to the class based view 
 		# with a .order_by()
 		permissions = (("can_modify_book", "Create, modify, or delete books"),)
+		# The book list is (cursor) paginated by title, with the id as a tiebreaker
+		indexes = [
+			models.Index(fields=['title', 'id'], name='book_title_id_idx'),
+			# The list of books with a copy available, by title, and the
+			# list sorted by the number of copies available
+			models.Index(fields=['title', 'id'], name='book_available_title_idx', condition=models.Q(num_available__gt=0)),
+			models.Index(fields=['num_available', 'id'], name='book_num_available_idx'),
+		]
+
+class BookInstanceQuerySet(models.QuerySet):
+	"""
+	QuerySet for BookInstance, with the overdue test done by the database.
+	A copy is overdue if its due date has passed (as BookInstance.is_overdue).
+	"""
+	def with_overdue(self):
+		"""
+		Annotates each copy with 'overdue' (True or False), e.g. for sorting
+		with order_by('-overdue'). is_overdue uses the annotation when it's there.
+		"""
+		return self.annotate(overdue=models.Case(
+			models.When(due_back__lt=date.today(), then=models.Value(True)),
+			default=models.Value(False), output_field=models.BooleanField()))
+
+	def overdue(self):
+		"""
+		Returns only the overdue copies.
+		"""
+		return self.filter(due_back__lt=date.today())
+
 
 class BookInstance(models.Model):
 	"""
@@ -76,6 +215,7 @@ class BookInstance(models.Model):
 	imprint = models.CharField(max_length=200)
 	lang = models.CharField(max_length=50, help_text="Enter a the book's natural language (e.g. English, French, Japanese etc.)")
 	due_back = models.DateField(null=True, blank=True)
+	updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
 	LOAN_STATUS = (
 		('d', 'Maintenance'),
@@ -90,12 +230,31 @@ class BookInstance(models.Model):
 		ordering = ["due_back"]
 		permissions = (("can_mark_returned", "Set book as returned"),
 				 ("can_renew", "Renew the book for an extended lease"),)  
+		# Indexes for the loan lists, which filter on the status (and borrower)
+		# and are (cursor) paginated by due date, with the id as a tiebreaker
+		indexes = [
+			models.Index(fields=['status', 'due_back', 'id'], name='bookinst_status_due_idx'),
+			models.Index(fields=['borrower', 'status', 'due_back', 'id'], name='bookinst_borrower_due_idx'),
+		]
 
 	# Allow users to borrow one or more books
 	borrower = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
 
+	objects = BookInstanceQuerySet.as_manager()
+
+	def save(self, *args, **kwargs):
+		"""
+		Saves the copy in a transaction with the signal handlers, which update
+		its book's copy counts (and the catalog statistics).
+		"""
+		with transaction.atomic(using=kwargs.get('using')):
+			super(BookInstance, self).save(*args, **kwargs)
+
 	@property
 	def is_overdue(self):
+		# Already worked out by the database if loaded with with_overdue()
+		if 'overdue' in self.__dict__:
+			return self.overdue
 		if self.due_back and date.today() > self.due_back:
 			return True
 		return False
@@ -116,6 +275,9 @@ class Author(models.Model):
 	last_name = models.CharField(max_length=100)
 	date_of_birth = models.DateField(null=True, blank=True)
 	date_of_death = models.DateField('died', null=True, blank=True)
+	updated_at = models.DateTimeField(auto_now=True, db_index=True)
+	# Also set by the signal handlers when the author's books (or their copies) change,
+	# so it is when the author's page last changed.
 	
 	def get_absolute_url(self):
 		"""
@@ -139,4 +301,103 @@ class Author(models.Model):
 		# with a .order_by()
 		# 2). Adding a method 'queryset' to the class based view 
 		# with a .order_by()
-		permissions = (("can_modify_author", "Create, modify, or delete authors"),)
\ No newline at end of file
+		permissions = (("can_modify_author", "Create, modify, or delete authors"),)
+		# The author list is (cursor) paginated by last name, with the id as a tiebreaker
+		indexes = [models.Index(fields=['last_name', 'id'], name='author_last_name_id_idx')]
+
+
+class CatalogStats(models.Model):
+	"""
+	Model holding the denormalized record counts shown on the home page.
+	There is only ever one row (pk=1). It is kept up to date incrementally by the
+	signal handlers in catalog/signals.py, and can be rebuilt from scratch with
+	the 'rebuild_catalog_stats' management command.
+	"""
+	# The word counted in book titles on the home page
+	FILTER_WORD = 'Nac'
+	SINGLETON_PK = 1
+
+	num_books = models.IntegerField(default=0)
+	num_instances = models.IntegerField(default=0)
+	num_instances_available = models.IntegerField(default=0)
+	num_authors = models.IntegerField(default=0)
+	num_genres = models.IntegerField(default=0)
+	num_books_word = models.IntegerField(default=0)
+	# When any count last changed, which includes every creation and deletion
+	updated_at = models.DateTimeField(auto_now=True)
+
+	@classmethod
+	def title_matches(cls, title):
+		"""
+		Returns True if a book title contains the filter word (case-insensitive),
+		mirroring the 'title__icontains' lookup used when rebuilding.
+		"""
+		return bool(title) and cls.FILTER_WORD.lower() in title.lower()
+
+	@classmethod
+	def compute(cls):
+		"""
+		Counts every statistic from the catalog tables (one query per count).
+		"""
+		return {
+			'num_books': Book.objects.count(),
+			'num_instances': BookInstance.objects.count(),
+			'num_instances_available': BookInstance.objects.filter(status__exact='a').count(),
+			'num_authors': Author.objects.count(),
+			'num_genres': Genre.objects.count(),
+			'num_books_word': Book.objects.filter(title__icontains=cls.FILTER_WORD).count(),
+		}
+
+	@classmethod
+	def rebuild(cls):
+		"""
+		Recounts all the statistics and stores them in the singleton row.
+		"""
+		stats, created = cls.objects.update_or_create(pk=cls.SINGLETON_PK, defaults=cls.compute())
+		return stats
+
+	@classmethod
+	def load(cls):
+		"""
+		Returns the statistics row with a single primary key lookup. The row is
+		rebuilt if it doesn't exist yet.
+		"""
+		try:
+			return cls.objects.get(pk=cls.SINGLETON_PK)
+		except cls.DoesNotExist:
+			return cls.rebuild()
+
+	@classmethod
+	def adjust(cls, **deltas):
+		"""
+		Atomically adds the (positive or negative) deltas to the stored counts,
+		e.g. CatalogStats.adjust(num_books=1). Zero deltas are ignored.
+		"""
+		changes = {name: F(name) + delta for name, delta in deltas.items() if delta}
+		if changes:
+			cls.objects.filter(pk=cls.SINGLETON_PK).update(updated_at=timezone.now(), **changes)
+
+	def __str__(self):
+		"""
+		String for representing the Model object.
+		"""
+		return 'Catalog statistics'
+
+	class Meta:
+		verbose_name_plural = 'catalog stats'
+
+
+class VisitCount(models.Model):
+	"""
+	Model representing the number of home page visits by one visitor (a user,
+	or an anonymous browser identified by a cookie). Visits are counted in the
+	cache and only written here in batches, by catalog.visits.VisitCounter.
+	"""
+	visitor = models.CharField(max_length=40, unique=True)
+	count = models.PositiveIntegerField(default=0)
+
+	def __str__(self):
+		"""
+		String for representing the Model object.
+		"""
+		return '%s (%d)' % (self.visitor, self.count)
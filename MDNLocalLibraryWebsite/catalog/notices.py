@@ -0,0 +1,93 @@
+import itertools
+import time
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.template.loader import get_template
+from .models import BookInstance
+
+# Overdue reminders (see the 'send_overdue_notices' management command).
+# The overdue loans are read with one query, in borrower order, so they can
+# be grouped into one digest per borrower as they stream in. The messages are
+# sent in batches over a single mail connection.
+
+# Messages handed to the mail connection at a time
+BATCH_SIZE = 500
+# Loans fetched from the database at a time
+CHUNK_SIZE = 2000
+
+
+def overdue_loans():
+	"""
+	Returns the overdue loans (borrower id, email, name, book title, due date),
+	ordered by borrower and due date.
+	"""
+	loans = BookInstance.objects.filter(status__exact='o', borrower__isnull=False).overdue()
+	return loans.order_by('borrower_id', 'due_back', 'id').values_list('borrower_id', 'borrower__email',
+		'borrower__first_name', 'borrower__username', 'book__title', 'due_back')
+
+
+def _batches(items, size):
+	batch = []
+	for item in items:
+		batch.append(item)
+		if len(batch) == size:
+			yield batch
+			batch = []
+	if batch:
+		yield batch
+
+
+class OverdueNotices(object):
+	"""
+	Builds and sends one overdue notice per borrower. The counts of what was
+	done are kept in stats.
+	"""
+	subject = 'Overdue library books'
+	template_name = 'catalog/email/overdue_notice.txt'
+
+	def __init__(self, batch_size=BATCH_SIZE, dry_run=False, connection=None):
+		self.batch_size = batch_size
+		self.dry_run = dry_run
+		self.connection = connection
+		self.stats = {'loans': 0, 'borrowers': 0, 'sent': 0, 'no_email': 0, 'seconds': 0.0}
+
+	def messages(self):
+		"""
+		Yields the notices, one per borrower with an email address.
+		"""
+		# Load the template once, rather than once per message
+		template = get_template(self.template_name)
+		loans = overdue_loans().iterator(chunk_size=CHUNK_SIZE)
+		for borrower_id, group in itertools.groupby(loans, key=lambda loan: loan[0]):
+			group = list(group)
+			self.stats['loans'] += len(group)
+			self.stats['borrowers'] += 1
+			email, first_name, username = group[0][1:4]
+			if not email:
+				self.stats['no_email'] += 1
+				continue
+			body = template.render({
+				'name': first_name or username,
+				'loans': [{'title': loan[4], 'due_back': loan[5]} for loan in group],
+			})
+			yield EmailMessage(self.subject, body, settings.DEFAULT_FROM_EMAIL, [email])
+
+	def send(self):
+		"""
+		Sends (or in a dry run, only builds) all the notices, and returns the stats.
+		"""
+		started = time.time()
+		connection = self.connection or get_connection()
+		if not self.dry_run:
+			connection.open()
+		try:
+			for batch in _batches(self.messages(), self.batch_size):
+				if self.dry_run:
+					self.stats['sent'] += len(batch)
+				else:
+					self.stats['sent'] += connection.send_messages(batch) or 0
+		finally:
+			if not self.dry_run:
+				connection.close()
+		self.stats['seconds'] = time.time() - started
+		return self.stats
@@ -0,0 +1,289 @@
+import base64
+import json
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.http import Http404, QueryDict
+from django.utils.functional import cached_property
+from django.utils.translation import ugettext as _ # Django translation function
+
+# Keyset (cursor) pagination. Rather than asking the database to skip OFFSET
+# rows and count the whole table for every page, each page remembers the
+# ordering value and primary key of its first and last rows. The next page is
+# then "the rows after (value, pk)", which the database can seek to directly
+# with an index on the ordering column.
+
+
+class InvalidCursor(Exception):
+	"""
+	Raised when a cursor from the query string can't be decoded.
+	"""
+	pass
+
+
+class _ValuesRow(object):
+	"""
+	Attribute access to a values() dict, so the model fields can read it like
+	an instance.
+	"""
+	def __init__(self, values):
+		self.__dict__.update(values)
+
+
+class CursorPaginator(object):
+	"""
+	Paginates a queryset on one ordering field plus the primary key as a
+	tiebreaker, e.g. CursorPaginator(Book.objects.all(), 10, 'title').
+	The ordering field defaults to the first column of the queryset (or model
+	Meta) ordering. A leading '-' orders descending. NULL values go where the
+	database sorts them natively (first on SQLite, last on PostgreSQL), so the
+	pages can be read straight from an index on (field, id).
+	The total count is only calculated (once, lazily) if with_count is True.
+	The queryset can also be a values() queryset, as long as the dicts include
+	the ordering field and primary key.
+	"""
+	def __init__(self, object_list, per_page, ordering=None, with_count=False):
+		self.object_list = object_list
+		self.per_page = int(per_page)
+		self.with_count = with_count
+
+		model = object_list.model
+		if ordering is None:
+			ordering = (object_list.query.order_by or model._meta.ordering or ['pk'])[0]
+		self.descending = ordering.startswith('-')
+		self.field = model._meta.get_field(ordering.lstrip('-'))
+		self.pk_field = model._meta.pk
+		# Whether NULLs come before the other values when going forward
+		nulls_largest = connections[object_list.db].features.nulls_order_largest
+		self.nulls_first = self.field.null and nulls_largest == self.descending
+		self._count = None
+
+	@property
+	def count(self):
+		"""
+		Returns the total number of objects, or None if counting is switched off.
+		"""
+		if not self.with_count:
+			return None
+		if self._count is None:
+			self._count = self.object_list.count()
+		return self._count
+
+	def encode_cursor(self, obj, forward):
+		"""
+		Returns an opaque URL safe token for the rows after (forward) or
+		before (not forward) obj.
+		"""
+		if isinstance(obj, dict):
+			obj = _ValuesRow(obj)
+		value = getattr(obj, self.field.attname)
+		if value is not None:
+			value = self.field.value_to_string(obj)
+		position = [value, self.pk_field.value_to_string(obj), int(forward)]
+		token = base64.urlsafe_b64encode(json.dumps(position).encode('utf-8'))
+		return token.decode('ascii').rstrip('=')
+
+	def decode_cursor(self, cursor):
+		"""
+		Returns the (value, pk, forward) position stored in a cursor token.
+		"""
+		try:
+			token = cursor.encode('ascii')
+			position = json.loads(base64.urlsafe_b64decode(token + b'=' * (-len(token) % 4)).decode('utf-8'))
+			value, pk, forward = position
+			if value is not None:
+				value = self.field.to_python(value)
+			return value, self.pk_field.to_python(pk), bool(forward)
+		except Exception:
+			raise InvalidCursor(_('Invalid cursor'))
+
+	def _seek(self, value, pk, forward):
+		"""
+		Returns the filter for the rows strictly after (value, pk) in the
+		direction of travel.
+		"""
+		name = self.field.name
+		op = 'gt' if forward != self.descending else 'lt'
+		after_pk = Q(**{'pk__%s' % op: pk})
+		# Whether the NULLs are ahead of any other values in this direction
+		nulls_ahead = self.field.null and self.nulls_first == forward
+		if value is None:
+			condition = Q(**{'%s__isnull' % name: True}) & after_pk
+			if nulls_ahead:
+				condition |= Q(**{'%s__isnull' % name: False})
+			return condition
+		# The redundant (field >= value) lets the database seek with a range scan
+		condition = Q(**{'%s__%se' % (name, op): value}) & (Q(**{'%s__%s' % (name, op): value}) | (Q(**{name: value}) & after_pk))
+		if self.field.null and not nulls_ahead:
+			condition |= Q(**{'%s__isnull' % name: True})
+		return condition
+
+	def _ordering(self, forward):
+		"""
+		Returns the order_by() arguments for the direction of travel.
+		"""
+		descending = self.descending != (not forward)
+		if descending:
+			return ['-%s' % self.field.name, '-pk']
+		return [self.field.name, 'pk']
+
+	def page_queryset(self, cursor=None):
+		"""
+		Returns the (queryset, forward) for the page that starts at the cursor.
+		The queryset has one extra row, to find out whether there is a further page.
+		"""
+		forward = True
+		queryset = self.object_list
+		if cursor:
+			value, pk, forward = self.decode_cursor(cursor)
+			queryset = queryset.filter(self._seek(value, pk, forward))
+		return queryset.order_by(*self._ordering(forward))[:self.per_page + 1], forward
+
+	def page(self, cursor=None):
+		"""
+		Returns the page of objects that starts at the cursor (or the first
+		page if there is no cursor).
+		"""
+		queryset, forward = self.page_queryset(cursor)
+		rows = list(queryset)
+		has_more = len(rows) > self.per_page
+		rows = rows[:self.per_page]
+		if forward:
+			has_previous, has_next = bool(cursor), has_more
+		else:
+			rows.reverse()
+			has_previous, has_next = has_more, True
+		return CursorPage(rows, self, has_previous, has_next)
+
+
+class CursorPage(object):
+	"""
+	A page of objects from a CursorPaginator. Provides the has_next()/
+	has_previous() part of the Django Page interface, plus the cursors
+	(and query strings) for the neighbouring pages.
+	"""
+	def __init__(self, object_list, paginator, has_previous, has_next):
+		self.object_list = object_list
+		self.paginator = paginator
+		self._has_previous = has_previous
+		self._has_next = has_next
+		self.query = None # The request.GET the page links are built from
+		self.cursor_kwarg = 'cursor'
+
+	def __repr__(self):
+		return '<Cursor page of %d objects>' % len(self.object_list)
+
+	def __len__(self):
+		return len(self.object_list)
+
+	def __getitem__(self, index):
+		return self.object_list[index]
+
+	def __iter__(self):
+		return iter(self.object_list)
+
+	def has_next(self):
+		return self._has_next
+
+	def has_previous(self):
+		return self._has_previous
+
+	def has_other_pages(self):
+		return self._has_next or self._has_previous
+
+	@property
+	def next_cursor(self):
+		if self._has_next and self.object_list:
+			return self.paginator.encode_cursor(self.object_list[-1], True)
+		return None
+
+	@property
+	def previous_cursor(self):
+		if self._has_previous and self.object_list:
+			return self.paginator.encode_cursor(self.object_list[0], False)
+		return None
+
+	def _query_string(self, cursor):
+		query = self.query.copy() if self.query is not None else QueryDict(mutable=True)
+		query[self.cursor_kwarg] = cursor
+		return query.urlencode()
+
+	@property
+	def next_query_string(self):
+		"""
+		The current query string with the cursor replaced by the next page's.
+		"""
+		return self._query_string(self.next_cursor)
+
+	@property
+	def previous_query_string(self):
+		"""
+		The current query string with the cursor replaced by the previous page's.
+		"""
+		return self._query_string(self.previous_cursor)
+
+
+class CursorPaginationMixin(object):
+	"""
+	ListView mixin that pages with a CursorPaginator (?cursor=...) rather than
+	the OFFSET based Django Paginator (?page=N).
+	Set cursor_ordering (or override get_cursor_ordering()) to choose the ordering
+	field (the queryset/model ordering is used by default) and cursor_count to
+	also show the total number of rows.
+	"""
+	cursor_ordering = None
+	cursor_count = False
+	cursor_kwarg = 'cursor'
+
+	def get_cursor_ordering(self):
+		return self.cursor_ordering
+
+	def get_paginator(self, queryset, per_page, orphans=0, allow_empty_first_page=True, **kwargs):
+		return CursorPaginator(queryset, per_page, ordering=self.get_cursor_ordering(), with_count=self.cursor_count)
+
+	def paginate_queryset(self, queryset, page_size):
+		"""
+		Overwrites the generic MultipleObjectMixin method. Returns the
+		(paginator, page, object_list, is_paginated) tuple for the current cursor.
+		"""
+		paginator = self.get_paginator(queryset, page_size)
+		cursor = self.kwargs.get(self.cursor_kwarg) or self.request.GET.get(self.cursor_kwarg)
+		try:
+			page = paginator.page(cursor)
+		except InvalidCursor as e:
+			raise Http404(str(e))
+		page.query = self.request.GET
+		return (paginator, page, page.object_list, page.has_other_pages())
+
+
+class EstimatedCountPaginator(Paginator):
+	"""
+	OFFSET based Django Paginator (as used by the admin changelists) that
+	doesn't COUNT(*) big tables. The number of rows of the unfiltered queryset
+	comes from total, a callable (e.g. reading a denormalized count), and a
+	filtered queryset is only counted up to max_count rows, so the page links
+	stop there. count_is_lower_bound tells when the count is such a limit
+	(the admin templates in templates/admin/catalog show it as e.g. "10000+").
+	"""
+	max_count = 10000
+
+	def __init__(self, object_list, per_page, orphans=0, allow_empty_first_page=True, total=None):
+		super().__init__(object_list, per_page, orphans, allow_empty_first_page)
+		self.total = total
+
+	def _uses_total(self):
+		return self.total is not None and not self.object_list.query.where
+
+	@cached_property
+	def count(self):
+		if self._uses_total():
+			return self.total()
+		# SELECT COUNT(*) FROM (SELECT ... LIMIT max_count)
+		return self.object_list.order_by()[:self.max_count].count()
+
+	@property
+	def count_is_lower_bound(self):
+		"""
+		Whether the queryset has at least count rows rather than exactly count.
+		"""
+		return not self._uses_total() and self.count >= self.max_count
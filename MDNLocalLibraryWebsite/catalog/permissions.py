@@ -0,0 +1,86 @@
+import time
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+from django.db import transaction
+from . import routers
+
+# Authentication backend that caches each user's permissions across requests,
+# so the {{ perms }} checks in the templates and PermissionRequiredMixin don't
+# query the user and group permission tables on every request.
+# A user's permission set is cached under (user id, version), where the
+# version combines a counter for the user (bumped when their groups, their own
+# permissions or the user row change) and a counter for everyone (bumped when
+# a group's permissions change, or a group or permission is deleted or
+# renamed). The signal handlers in catalog/signals.py do the bumping, once the
+# change commits, so stale sets are never read again (and simply expire). A set
+# that isn't cached is loaded from the primary database, as a replica may not
+# have the latest change yet. As with the fragment versions (see
+# catalog/fragments.py), counters start from the current time in milliseconds,
+# so one that is evicted restarts above any value it had.
+# Within a request the set is also kept on the user object, as ModelBackend does.
+
+# Counter for changes that affect every user
+ALL = 'all'
+
+
+def _version_key(user_id):
+	return 'catalog:perm-version:%s' % user_id
+
+
+def _new_version():
+	return int(time.time() * 1000)
+
+
+def get_version(user_id):
+	"""
+	Returns the current version string of a user's permission set.
+	"""
+	keys = [_version_key(ALL), _version_key(user_id)]
+	versions = cache.get_many(keys)
+	missing = [key for key in keys if key not in versions]
+	if missing:
+		for key in missing:
+			cache.add(key, _new_version(), None)
+		versions.update(cache.get_many(missing))
+	return '%s.%s' % tuple(versions.get(key, 0) for key in keys)
+
+
+def bump(user_id=ALL):
+	"""
+	Invalidates the cached permissions of a user (or, by default, of everyone),
+	once the current transaction commits (see _bump()).
+	"""
+	transaction.on_commit(lambda: _bump(user_id))
+
+
+def _bump(user_id):
+	# Not before the commit: a request in between would cache the old set
+	# (still the committed one) under the new version
+	key = _version_key(user_id)
+	try:
+		cache.incr(key)
+	except ValueError:
+		cache.set(key, _new_version(), None)
+
+
+class CachedPermissionBackend(ModelBackend):
+	"""
+	ModelBackend whose permission sets are cached across requests (see the
+	top of this module) for PERMISSION_CACHE_TIMEOUT seconds (an hour by
+	default).
+	"""
+	def get_all_permissions(self, user_obj, obj=None):
+		if not user_obj.is_active or user_obj.is_anonymous or obj is not None:
+			return set()
+		if not hasattr(user_obj, '_perm_cache'):
+			# The version is read first, so a change made while the set is
+			# loaded leaves it under an old version
+			key = 'catalog:perms:%s:%s' % (user_obj.pk, get_version(user_obj.pk))
+			perms = cache.get(key)
+			if perms is None:
+				with routers.use_primary():
+					perms = super().get_all_permissions(user_obj)
+				cache.set(key, perms, getattr(settings, 'PERMISSION_CACHE_TIMEOUT', 3600))
+			user_obj._perm_cache = perms
+		return user_obj._perm_cache
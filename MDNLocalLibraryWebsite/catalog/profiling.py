@@ -0,0 +1,177 @@
+import cProfile
+import datetime
+import os
+import pstats
+import random
+import re
+import threading
+import tracemalloc
+from django.conf import settings
+
+# Opt-in profiling of single requests (ProfilingMiddleware, and the
+# 'profile_url' management command). A profiled request runs its view under
+# cProfile, with tracemalloc snapshots taken before and after, and writes
+# three reports to REQUEST_PROFILING_DIRECTORY:
+#  <name>.collapsed        one "frame;frame;frame microseconds" line per call
+#                          stack, for flamegraph.pl, speedscope or inferno
+#  <name>.pstats           the raw cProfile data, for pstats or snakeviz
+#  <name>.allocations.txt  the lines that allocated the most memory
+# A request is profiled if a staff user adds ?profile=1, or it is picked by
+# REQUEST_PROFILING_SAMPLE_RATE (0 by default). Profiling slows a request
+# down many times over, so only one request is profiled at a time.
+
+QUERY_PARAM = 'profile'
+# Allocation report lines
+TOP_ALLOCATIONS = 25
+# Call stacks that took less than this are left out of the collapsed report
+MIN_STACK_MICROSECONDS = 1
+
+_lock = threading.Lock()
+
+
+def get_directory():
+	return getattr(settings, 'REQUEST_PROFILING_DIRECTORY', os.path.join(settings.BASE_DIR, 'profiles'))
+
+
+def report_name(label):
+	"""
+	Returns a unique file name (without an extension) for a report, e.g.
+	'20261017-101500-123456-GET-catalog-books'.
+	"""
+	slug = re.sub(r'[^A-Za-z0-9]+', '-', label).strip('-')[:80]
+	return '%s-%s' % (datetime.datetime.now().strftime('%Y%m%d-%H%M%S-%f'), slug or 'root')
+
+
+def _frame_name(func):
+	filename, line, name = func
+	if filename == '~':
+		# Built in functions, e.g. "<method 'join' of 'str' objects>"
+		return name.replace(';', ',')
+	return ('%s:%s:%d' % (os.path.basename(filename), name, line)).replace(';', ',')
+
+
+def collapsed_stacks(stats):
+	"""
+	Yields the (stack, microseconds) of the time spent in each call stack.
+	cProfile only records caller -> callee edges, so the stacks are rebuilt by
+	walking the call graph from its roots, splitting the time of a function
+	that has several callers in proportion to the time each edge took.
+	"""
+	callees = {}
+	for func, (cc, nc, tt, ct, callers) in stats.stats.items():
+		for caller, edge in callers.items():
+			callees.setdefault(caller, []).append((func, edge[3]))
+	roots = [func for func, (cc, nc, tt, ct, callers) in stats.stats.items()
+		if not any(caller in stats.stats for caller in callers)]
+
+	def walk(func, seconds, stack, on_stack):
+		cc, nc, tt, ct, callers = stats.stats[func]
+		share = seconds / ct if ct else 0.0
+		stack = stack + [_frame_name(func)]
+		own = tt * share * 1e6
+		if own >= MIN_STACK_MICROSECONDS:
+			yield ';'.join(stack), int(round(own))
+		for callee, edge_seconds in callees.get(func, ()):
+			# Recursive calls are already counted in the outer call
+			if callee not in on_stack and edge_seconds * share * 1e6 >= MIN_STACK_MICROSECONDS:
+				for result in walk(callee, edge_seconds * share, stack, on_stack | {callee}):
+					yield result
+
+	for root in roots:
+		for result in walk(root, stats.stats[root][3], [], {root}):
+			yield result
+
+
+def allocation_report(before, after, title):
+	"""
+	Returns the text of the top allocations between two tracemalloc snapshots.
+	"""
+	differences = after.compare_to(before, 'lineno')
+	lines = [title, '']
+	lines += [str(difference) for difference in differences[:TOP_ALLOCATIONS]]
+	total = sum(difference.size_diff for difference in differences)
+	lines += ['', 'Total change: %.1f KiB' % (total / 1024.0)]
+	return '\n'.join(lines) + '\n'
+
+
+class Profile(object):
+	"""
+	Runs a function under cProfile and tracemalloc, and writes the reports.
+	The reports' paths are in paths once write() has been called. If run() is
+	called several times, the reports cover all the runs: the allocations are
+	those between the snapshot before the first run and the one after the
+	last (keep tracemalloc tracing in between, see the 'profile_url' command).
+	"""
+	def __init__(self, label):
+		self.label = label
+		self.name = report_name(label)
+		self.profiler = cProfile.Profile()
+		self.before = self.after = None
+		self.peak = 0
+		self.paths = []
+
+	def run(self, func, *args, **kwargs):
+		started_tracing = not tracemalloc.is_tracing()
+		if started_tracing:
+			tracemalloc.start()
+		try:
+			if self.before is None:
+				self.before = tracemalloc.take_snapshot()
+				if hasattr(tracemalloc, 'reset_peak'): # Python 3.9+
+					tracemalloc.reset_peak()
+			result = self.profiler.runcall(func, *args, **kwargs)
+			self.after = tracemalloc.take_snapshot()
+			self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+		finally:
+			if started_tracing:
+				tracemalloc.stop()
+		return result
+
+	def write(self, directory=None):
+		"""
+		Writes the reports to the directory, and returns their paths.
+		"""
+		directory = directory or get_directory()
+		os.makedirs(directory, exist_ok=True)
+		base = os.path.join(directory, self.name)
+		stats = pstats.Stats(self.profiler)
+
+		with open(base + '.collapsed', 'w', encoding='utf-8') as f:
+			for stack, microseconds in collapsed_stacks(stats):
+				f.write('%s %d\n' % (stack, microseconds))
+		stats.dump_stats(base + '.pstats')
+		with open(base + '.allocations.txt', 'w', encoding='utf-8') as f:
+			f.write(allocation_report(self.before, self.after, '%s (peak %.1f KiB traced)' % (self.label, self.peak / 1024.0)))
+		self.paths = [base + '.collapsed', base + '.pstats', base + '.allocations.txt']
+		return self.paths
+
+
+def should_profile(request):
+	if request.GET.get(QUERY_PARAM) == '1' and request.user.is_staff:
+		return True
+	return random.random() < getattr(settings, 'REQUEST_PROFILING_SAMPLE_RATE', 0)
+
+
+class ProfilingMiddleware(object):
+	"""
+	Profiles the requests picked by should_profile(). It must come after the
+	authentication middleware, and is best last, so only the view is profiled:
+	the rest of the request (the view middleware, the view in its transaction
+	if ATOMIC_REQUESTS is on, exception handling and rendering a template
+	response) is the normal handler's, within the profile. The name of the
+	reports is returned in the X-Profile header.
+	"""
+	def __init__(self, get_response):
+		self.get_response = get_response
+
+	def __call__(self, request):
+		if not should_profile(request) or not _lock.acquire(blocking=False):
+			return self.get_response(request)
+		try:
+			profile = Profile('%s %s' % (request.method, request.path))
+			response = profile.run(self.get_response, request)
+			profile.write()
+		finally:
+			_lock.release()
+		response['X-Profile'] = profile.name
+		return response
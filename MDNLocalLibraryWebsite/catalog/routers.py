@@ -0,0 +1,122 @@
+import random
+import threading
+from contextlib import contextmanager
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# Read replicas. The aliases of the replica databases are listed in the
+# DATABASE_REPLICAS setting (built from $DATABASE_REPLICA_URLS in settings.py).
+# PrimaryReplicaRouter sends writes to the default (primary) database, and
+# reads to one of the replicas - the same one for the whole request, so the
+# reads are consistent with each other.
+# Replicas lag behind the primary, so a request that has written (or will
+# write: any POST) reads from the primary from then on, and so does any read
+# inside a transaction. ReplicaRoutingMiddleware also sets a short-lived cookie
+# after a write, so that the next requests from the same browser (typically
+# the redirect after a form) read from the primary while the replicas catch up.
+# With no replicas configured, everything goes to the primary as before.
+
+PIN_COOKIE = 'use_primary'
+# Methods that don't write, which can read from a replica
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+
+# The routing state of the request (or management command) this thread is running
+_state = threading.local()
+
+
+def get_replicas():
+	return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+def pin_to_primary():
+	"""
+	Sends the rest of this thread's reads to the primary, until reset().
+	"""
+	_state.pinned = True
+
+
+def is_pinned():
+	return getattr(_state, 'pinned', False)
+
+
+def reset():
+	"""
+	Forgets the state of the previous request: reads can go to a replica again.
+	"""
+	_state.pinned = False
+	_state.wrote = False
+	_state.replica = None
+
+
+@contextmanager
+def use_primary():
+	"""
+	Sends the reads within the block to the primary, e.g. to read data that
+	must be current before writing it.
+	"""
+	pinned = is_pinned()
+	pin_to_primary()
+	try:
+		yield
+	finally:
+		_state.pinned = pinned
+
+
+class PrimaryReplicaRouter(object):
+	"""
+	Sends reads to a replica and writes to the primary (see the top of this
+	module).
+	"""
+	def db_for_read(self, model, **hints):
+		replicas = get_replicas()
+		if not replicas or is_pinned() or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+			return DEFAULT_DB_ALIAS
+		replica = getattr(_state, 'replica', None)
+		if replica not in replicas:
+			replica = _state.replica = random.choice(replicas)
+		return replica
+
+	def db_for_write(self, model, **hints):
+		# Read your own writes for the rest of the request
+		_state.pinned = True
+		_state.wrote = True
+		return DEFAULT_DB_ALIAS
+
+	def allow_relation(self, obj1, obj2, **hints):
+		databases = [DEFAULT_DB_ALIAS] + list(get_replicas())
+		if obj1._state.db in databases and obj2._state.db in databases:
+			return True
+		return None
+
+	def allow_migrate(self, db, app_label, model_name=None, **hints):
+		# Replicas get their schema from the primary
+		if db in get_replicas():
+			return False
+		return None
+
+
+class ReplicaRoutingMiddleware(object):
+	"""
+	Resets the routing state for each request, and reads from the primary for
+	requests that may write (anything but GET, HEAD, OPTIONS or TRACE) and for
+	DATABASE_REPLICA_PIN_SECONDS (5 by default) after a request that wrote. It
+	must come before any middleware that uses the database (e.g. sessions).
+	"""
+	def __init__(self, get_response):
+		self.get_response = get_response
+
+	def __call__(self, request):
+		if not get_replicas():
+			return self.get_response(request)
+		reset()
+		if request.method not in SAFE_METHODS or request.COOKIES.get(PIN_COOKIE):
+			pin_to_primary()
+		try:
+			response = self.get_response(request)
+			pin_seconds = getattr(settings, 'DATABASE_REPLICA_PIN_SECONDS', 5)
+			if _state.wrote and pin_seconds:
+				response.set_cookie(PIN_COOKIE, '1', max_age=pin_seconds,
+					secure=settings.SESSION_COOKIE_SECURE, httponly=True)
+		finally:
+			reset()
+		return response
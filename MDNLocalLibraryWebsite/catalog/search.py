@@ -0,0 +1,199 @@
+import re
+from django.db import connections, router
+from .models import Book
+
+# Full-text search over book titles, summaries and author names.
+# The index itself is created by migration 0010 and depends on the database:
+#  - SQLite: an FTS5 virtual table (catalog_book_fts) keyed by the book id.
+#  - PostgreSQL: a tsvector column (catalog_book.search_vector) with a GIN index.
+# The signal handlers in catalog/signals.py keep it in sync with Book and
+# Author, and the 'rebuild_search_index' management command rebuilds it.
+# Other databases fall back to a (slow) title__icontains filter.
+
+FTS_TABLE = 'catalog_book_fts'
+
+# Rows (re)indexed per statement when rebuilding the whole index
+REBUILD_CHUNK_SIZE = 10000
+# Ids per statement when (re)indexing or removing a list of books. Keeps well
+# under the SQLite limit on query parameters.
+ID_CHUNK_SIZE = 500
+
+
+def search_terms(query):
+	"""
+	Splits the user's query into plain words, dropping any punctuation that
+	the database would otherwise treat as search syntax.
+	"""
+	return re.findall(r'\w+', query or '')
+
+
+class SearchBackend(object):
+	"""
+	Fallback search for databases without a full-text index. Nothing needs to
+	be kept in sync, and results are ordered by title rather than ranked.
+	"""
+	def __init__(self, connection):
+		self.connection = connection
+
+	def index_where(self, where, params):
+		"""
+		(Re)indexes the books matched by the SQL condition on the book table,
+		aliased as 'b', e.g. index_where('b.author_id = %s', [author_id]).
+		"""
+		pass
+
+	def remove(self, book_ids):
+		"""
+		Removes deleted books from the index.
+		"""
+		pass
+
+	def prune(self):
+		"""
+		Removes index entries for books that no longer exist.
+		"""
+		pass
+
+	def search(self, terms, offset, limit):
+		"""
+		Returns the ids of the books matching every term, best match first.
+		"""
+		books = Book.objects.all()
+		for term in terms:
+			books = books.filter(title__icontains=term)
+		return list(books.order_by('title', 'id').values_list('id', flat=True)[offset:offset + limit])
+
+
+class SQLiteSearchBackend(SearchBackend):
+	"""
+	Search backed by an FTS5 virtual table, ranked with bm25 (weighting
+	title matches over author names over summary matches).
+	"""
+	def index_where(self, where, params):
+		with self.connection.cursor() as cursor:
+			cursor.execute('DELETE FROM {fts} WHERE rowid IN (SELECT b.id FROM catalog_book b WHERE {where})'.format(
+				fts=FTS_TABLE, where=where), params)
+			cursor.execute(
+				"INSERT INTO {fts} (rowid, title, summary, author) "
+				"SELECT b.id, b.title, b.summary, COALESCE(a.first_name || ' ' || a.last_name, '') "
+				"FROM catalog_book b LEFT JOIN catalog_author a ON a.id = b.author_id "
+				"WHERE {where}".format(fts=FTS_TABLE, where=where), params)
+
+	def remove(self, book_ids):
+		with self.connection.cursor() as cursor:
+			cursor.execute('DELETE FROM {fts} WHERE rowid IN ({ids})'.format(
+				fts=FTS_TABLE, ids=', '.join(['%s'] * len(book_ids))), list(book_ids))
+
+	def prune(self):
+		with self.connection.cursor() as cursor:
+			cursor.execute('DELETE FROM {fts} WHERE rowid NOT IN (SELECT id FROM catalog_book)'.format(fts=FTS_TABLE))
+
+	def search(self, terms, offset, limit):
+		match = ' '.join('"%s"' % term for term in terms)
+		with self.connection.cursor() as cursor:
+			cursor.execute(
+				'SELECT rowid FROM {fts} WHERE {fts} MATCH %s '
+				'ORDER BY bm25({fts}, 10.0, 1.0, 5.0), rowid LIMIT %s OFFSET %s'.format(fts=FTS_TABLE),
+				[match, limit, offset])
+			return [row[0] for row in cursor.fetchall()]
+
+
+class PostgresSearchBackend(SearchBackend):
+	"""
+	Search backed by a weighted tsvector column with a GIN index, ranked
+	with ts_rank_cd.
+	"""
+	def index_where(self, where, params):
+		with self.connection.cursor() as cursor:
+			cursor.execute(
+				"UPDATE catalog_book AS t SET search_vector = "
+				"setweight(to_tsvector('english', b.title), 'A') || "
+				"setweight(to_tsvector('english', COALESCE(a.first_name || ' ' || a.last_name, '')), 'B') || "
+				"setweight(to_tsvector('english', b.summary), 'C') "
+				"FROM catalog_book b LEFT JOIN catalog_author a ON a.id = b.author_id "
+				"WHERE t.id = b.id AND {where}".format(where=where), params)
+
+	def search(self, terms, offset, limit):
+		with self.connection.cursor() as cursor:
+			cursor.execute(
+				"SELECT id FROM catalog_book, plainto_tsquery('english', %s) query "
+				"WHERE search_vector @@ query "
+				"ORDER BY ts_rank_cd(search_vector, query) DESC, id LIMIT %s OFFSET %s",
+				[' '.join(terms), limit, offset])
+			return [row[0] for row in cursor.fetchall()]
+
+
+BACKENDS = {
+	'sqlite': SQLiteSearchBackend,
+	'postgresql': PostgresSearchBackend,
+}
+
+
+def get_backend(write=False):
+	"""
+	Returns the search backend for the database that holds the books.
+	"""
+	alias = router.db_for_write(Book) if write else router.db_for_read(Book)
+	connection = connections[alias]
+	return BACKENDS.get(connection.vendor, SearchBackend)(connection)
+
+
+def index_books(book_ids):
+	"""
+	(Re)indexes the given books.
+	"""
+	book_ids = list(book_ids)
+	backend = get_backend(write=True)
+	for i in range(0, len(book_ids), ID_CHUNK_SIZE):
+		chunk = book_ids[i:i + ID_CHUNK_SIZE]
+		backend.index_where('b.id IN (%s)' % ', '.join(['%s'] * len(chunk)), chunk)
+
+
+def index_author_books(author_id):
+	"""
+	(Re)indexes all the books by an author (e.g. after their name changes).
+	"""
+	get_backend(write=True).index_where('b.author_id = %s', [author_id])
+
+
+def remove_books(book_ids):
+	"""
+	Removes deleted books from the index.
+	"""
+	book_ids = list(book_ids)
+	backend = get_backend(write=True)
+	for i in range(0, len(book_ids), ID_CHUNK_SIZE):
+		backend.remove(book_ids[i:i + ID_CHUNK_SIZE])
+
+
+def rebuild_index(chunk_size=REBUILD_CHUNK_SIZE):
+	"""
+	Rebuilds the whole index, a range of book ids at a time so no single
+	statement holds the table for long. Searches keep working (from the old
+	entries) while it runs. Returns the number of books indexed.
+	"""
+	backend = get_backend(write=True)
+	ids = Book.objects.order_by('id').values_list('id', flat=True)
+	count = 0
+	last_id = 0
+	while True:
+		chunk = list(ids.filter(id__gt=last_id)[:chunk_size])
+		if not chunk:
+			backend.prune()
+			return count
+		backend.index_where('b.id BETWEEN %s AND %s', [chunk[0], chunk[-1]])
+		count += len(chunk)
+		last_id = chunk[-1]
+
+
+def search_books(query, offset=0, limit=10):
+	"""
+	Returns the books matching every word of the query, best match first,
+	with their authors already loaded.
+	"""
+	terms = search_terms(query)
+	if not terms:
+		return []
+	ids = get_backend().search(terms, offset, limit)
+	books = Book.objects.select_related('author').in_bulk(ids)
+	return [books[pk] for pk in ids if pk in books]
@@ -0,0 +1,162 @@
+import logging
+import threading
+import time
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.sessions.backends import cached_db
+from django.core.cache import caches
+from django.db import DatabaseError, router, transaction
+
+# Session engine (SESSION_ENGINE = 'catalog.sessions') that keeps sessions in
+# the cache (SESSION_CACHE_ALIAS), so a logged-in request doesn't read the
+# django_session table, and writes changes back to the database behind the
+# requests:
+#  - New sessions are written to the database straight away, which
+#    guarantees their keys are unique, and so are logins and logouts (changes
+#    of the session's user), which mustn't be lost.
+#  - A changed session is written to the cache, and its new row (data and
+#    expiry date) kept in an in-process buffer. The buffer is written to the
+#    database in one transaction once it holds SESSION_WRITE_BEHIND_THRESHOLD
+#    sessions, or when a session changes more than
+#    SESSION_WRITE_BEHIND_INTERVAL seconds after the last write. The buffer
+#    doesn't depend on the cache, so a session the cache has culled in the
+#    meantime is still written.
+#  - A session that is saved without any change to its data isn't written at
+#    all. So with SESSION_SAVE_EVERY_REQUEST the expiry date only moves on
+#    when the data changes.
+# The database is only read when a session isn't in the cache. The cache must
+# be shared by all the processes (e.g. the file cache, not the local-memory
+# one, if there are several), and is best one of its own (see 'sessions' in
+# CACHES), big enough for all the active sessions, so the sessions aren't culled
+# to make room for other data. Changes still buffered when a process stops are
+# only in the cache, and are lost if the cache loses them too.
+
+logger = logging.getLogger('catalog.sessions')
+
+KEY_PREFIX = 'catalog.sessions.'
+# The session data that is written to the database straight away when it changes
+AUTH_KEYS = (SESSION_KEY, BACKEND_SESSION_KEY, HASH_SESSION_KEY)
+
+
+class WriteBehindBuffer(object):
+	"""
+	The sessions changed in the cache but not yet in the database, as the
+	Session instances to write, by session key.
+	"""
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.pending = {}
+		self.last_flush = time.time()
+
+	@property
+	def flush_threshold(self):
+		return getattr(settings, 'SESSION_WRITE_BEHIND_THRESHOLD', 100)
+
+	@property
+	def flush_interval(self):
+		return getattr(settings, 'SESSION_WRITE_BEHIND_INTERVAL', 30)
+
+	def add(self, session):
+		"""
+		Records a changed session (a Session instance), and writes the buffer
+		if it is due.
+		"""
+		with self.lock:
+			self.pending[session.session_key] = session
+			flush_due = (len(self.pending) >= self.flush_threshold
+				or time.time() - self.last_flush >= self.flush_interval)
+		if flush_due:
+			try:
+				self.flush()
+			except DatabaseError:
+				# The sessions stay buffered for the next flush; the request
+				# that happened to trigger this one doesn't fail
+				logger.exception('Could not write the buffered sessions')
+
+	def discard(self, session_key):
+		with self.lock:
+			self.pending.pop(session_key, None)
+
+	def flush(self):
+		"""
+		Writes the buffered sessions to the database in one transaction, and
+		returns the number written.
+		"""
+		with self.lock:
+			pending, self.pending = self.pending, {}
+			self.last_flush = time.time()
+		if not pending:
+			return 0
+
+		Session = SessionStore.get_model_class()
+		try:
+			with transaction.atomic(using=router.db_for_write(Session)):
+				existing = set(Session.objects.filter(session_key__in=list(pending))
+					.values_list('session_key', flat=True))
+				updated = [session for session_key, session in pending.items() if session_key in existing]
+				Session.objects.bulk_update(updated, ['session_data', 'expire_date'])
+				# A session that is no longer in the database was either removed by
+				# clearsessions while it was only in the cache (and is written back),
+				# or deleted, e.g. by a logout in another process (and must not be)
+				session_cache = caches[settings.SESSION_CACHE_ALIAS]
+				missing = [session for session_key, session in pending.items() if session_key not in existing]
+				cached = session_cache.get_many([KEY_PREFIX + session.session_key for session in missing])
+				restored = [session for session in missing if KEY_PREFIX + session.session_key in cached]
+				Session.objects.bulk_create(restored, ignore_conflicts=True)
+		except Exception:
+			# Keep the sessions (unless they have changed again since), to be
+			# written by the next flush
+			with self.lock:
+				for session_key, session in pending.items():
+					self.pending.setdefault(session_key, session)
+			raise
+		if len(restored) < len(missing):
+			logger.warning('Dropped %d buffered session changes: the sessions were deleted from the database '
+				'and are no longer in the cache', len(missing) - len(restored))
+		return len(updated) + len(restored)
+
+
+class SessionStore(cached_db.SessionStore):
+	"""
+	Cached sessions, written to the database behind the requests (see the
+	top of this module).
+	"""
+	cache_key_prefix = KEY_PREFIX
+
+	def _fingerprint(self, data):
+		return self.serializer().dumps(data)
+
+	def _saved_as(self, data):
+		# What is in the cache (and will be in the database), to tell whether a
+		# save changes anything
+		self._saved = self._fingerprint(data)
+		self._saved_auth = tuple(data.get(key) for key in AUTH_KEYS)
+
+	def load(self):
+		data = super().load()
+		self._saved_as(data)
+		return data
+
+	def save(self, must_create=False):
+		data = self._get_session(no_load=must_create)
+		if must_create or self.session_key is None \
+				or tuple(data.get(key) for key in AUTH_KEYS) != getattr(self, '_saved_auth', None):
+			# A new session, or a login or logout: write it to the database now
+			super().save(must_create)
+			write_behind.discard(self.session_key)
+			self._saved_as(self._session)
+			return
+		fingerprint = self._fingerprint(data)
+		if fingerprint == self._saved:
+			return
+		self._cache.set(self.cache_key, data, self.get_expiry_age())
+		self._saved = fingerprint
+		write_behind.add(self.create_model_instance(data))
+
+	def delete(self, session_key=None):
+		super().delete(session_key)
+		write_behind.discard(session_key or self.session_key)
+
+
+# The sessions changed by this process
+write_behind = WriteBehindBuffer()
@@ -0,0 +1,307 @@
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete, m2m_changed
+from django.contrib.auth.models import Group, Permission, User
+from django.dispatch import receiver
+from django.utils import timezone
+from .models import Book, Author, BookInstance, Genre, CatalogStats
+from . import search, fragments, permissions, autocomplete
+
+# Signal handlers keep the denormalized CatalogStats row and the books' copy
+# counts up to date as the catalog changes, so the home page and book list
+# never have to count whole tables.
+# NB: queryset.update() and bulk_create() don't send these signals. Code that
+# uses them must adjust the counts itself (or run 'rebuild_catalog_stats' and
+# 'repair_copy_counts').
+
+
+@receiver(pre_save, sender=Book)
+def remember_book_title(sender, instance, raw, **kwargs):
+	"""
+	Store the title and author the book had in the database before this save,
+	so post_save can tell whether it moved in or out of the filter word count
+	(and which author's page it has left).
+	"""
+	instance._stats_old_title = None
+	instance._old_author_id = None
+	if instance.pk is not None and not raw:
+		old = Book.objects.filter(pk=instance.pk).values_list('title', 'author_id').first()
+		if old is not None:
+			instance._stats_old_title, instance._old_author_id = old
+
+
+@receiver(post_save, sender=Book)
+def book_saved(sender, instance, created, raw, **kwargs):
+	matches = CatalogStats.title_matches(instance.title)
+	if created:
+		CatalogStats.adjust(num_books=1, num_books_word=int(matches))
+	elif not raw:
+		old_matches = CatalogStats.title_matches(instance._stats_old_title)
+		CatalogStats.adjust(num_books_word=int(matches) - int(old_matches))
+
+
+@receiver(post_delete, sender=Book)
+def book_deleted(sender, instance, **kwargs):
+	CatalogStats.adjust(num_books=-1, num_books_word=-int(CatalogStats.title_matches(instance.title)))
+
+
+@receiver(pre_save, sender=BookInstance)
+def remember_bookinstance_status(sender, instance, raw, **kwargs):
+	"""
+	Store the status and book the copy had in the database before this save. Copies use
+	a UUID primary key (set before the first save), so a missing row means
+	this is an insert.
+	"""
+	instance._stats_old_status = None
+	instance._old_book_id = None
+	if not raw:
+		old = BookInstance.objects.filter(pk=instance.pk).values_list('status', 'book_id').first()
+		if old is not None:
+			instance._stats_old_status, instance._old_book_id = old
+
+
+@receiver(post_save, sender=BookInstance)
+def bookinstance_saved(sender, instance, created, raw, **kwargs):
+	available = int(instance.status == 'a')
+	if created:
+		CatalogStats.adjust(num_instances=1, num_instances_available=available)
+	elif not raw:
+		CatalogStats.adjust(num_instances_available=available - int(instance._stats_old_status == 'a'))
+
+
+@receiver(post_delete, sender=BookInstance)
+def bookinstance_deleted(sender, instance, **kwargs):
+	CatalogStats.adjust(num_instances=-1, num_instances_available=-int(instance.status == 'a'))
+
+
+@receiver(post_save, sender=BookInstance)
+def count_saved_copy(sender, instance, created, raw, **kwargs):
+	"""
+	Update the copy counts of the copy's book (or, if it was moved to another
+	book, of both books). BookInstance.save() runs this in its transaction.
+	"""
+	if created:
+		Book.adjust_copy_counts(instance.book_id, **Book.copy_count_changes(None, instance.status))
+	elif not raw:
+		if instance._old_book_id == instance.book_id:
+			Book.adjust_copy_counts(instance.book_id, **Book.copy_count_changes(instance._stats_old_status, instance.status))
+		else:
+			Book.adjust_copy_counts(instance._old_book_id, **Book.copy_count_changes(instance._stats_old_status, None))
+			Book.adjust_copy_counts(instance.book_id, **Book.copy_count_changes(None, instance.status))
+
+
+@receiver(post_delete, sender=BookInstance)
+def count_deleted_copy(sender, instance, **kwargs):
+	Book.adjust_copy_counts(instance.book_id, **Book.copy_count_changes(instance.status, None))
+
+
+@receiver(post_save, sender=Author)
+def author_saved(sender, instance, created, **kwargs):
+	if created:
+		CatalogStats.adjust(num_authors=1)
+
+
+@receiver(post_delete, sender=Author)
+def author_deleted(sender, instance, **kwargs):
+	CatalogStats.adjust(num_authors=-1)
+
+
+@receiver(post_save, sender=Genre)
+def genre_saved(sender, instance, created, **kwargs):
+	if created:
+		CatalogStats.adjust(num_genres=1)
+
+
+@receiver(post_delete, sender=Genre)
+def genre_deleted(sender, instance, **kwargs):
+	CatalogStats.adjust(num_genres=-1)
+
+
+# Signal handlers that keep the full-text search index (see catalog/search.py)
+# in step with book titles, summaries and author names. Bulk changes must run
+# 'rebuild_search_index' instead.
+
+@receiver(post_save, sender=Book)
+def index_saved_book(sender, instance, raw, **kwargs):
+	if not raw:
+		search.index_books([instance.pk])
+
+
+@receiver(post_delete, sender=Book)
+def unindex_deleted_book(sender, instance, **kwargs):
+	search.remove_books([instance.pk])
+
+
+@receiver(post_save, sender=Author)
+def index_saved_author_books(sender, instance, created, raw, **kwargs):
+	# A new author doesn't have any books yet
+	if not created and not raw:
+		search.index_author_books(instance.pk)
+
+
+@receiver(pre_delete, sender=Author)
+def remember_author_books(sender, instance, **kwargs):
+	"""
+	Store the author's books before they are deleted, as the books'
+	author is set to NULL (without sending any signals) by the delete.
+	"""
+	instance._search_book_ids = list(instance.book_set.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=Author)
+def index_deleted_author_books(sender, instance, **kwargs):
+	search.index_books(getattr(instance, '_search_book_ids', []))
+
+
+# Signal handlers that track when the detail pages change. They invalidate the
+# cached page fragments (see catalog/fragments.py) and set the updated_at times
+# used for conditional GETs (see catalog/conditional.py). A book's page shows its
+# author, genres and copies; an author's page shows their books and each book's
+# number of copies. The touches use queryset.update(), which sends no signals.
+# The fragment versions only move on once the change commits (see fragments.bump()).
+
+def books_changed(book_ids):
+	"""
+	Mark the pages of the books, and of their authors, as changed.
+	"""
+	book_ids = [pk for pk in set(book_ids) if pk is not None]
+	if not book_ids:
+		return
+	now = timezone.now()
+	Book.objects.filter(pk__in=book_ids).update(updated_at=now)
+	for pk in book_ids:
+		fragments.bump('book', pk)
+	authors_changed(Book.objects.filter(pk__in=book_ids).values_list('author_id', flat=True), now)
+
+
+def authors_changed(author_ids, now=None):
+	"""
+	Mark the pages of the authors as changed.
+	"""
+	author_ids = [pk for pk in set(author_ids) if pk is not None]
+	if not author_ids:
+		return
+	Author.objects.filter(pk__in=author_ids).update(updated_at=now or timezone.now())
+	for pk in author_ids:
+		fragments.bump('author', pk)
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+def book_changed(sender, instance, **kwargs):
+	# The book's own updated_at is set by the save
+	fragments.bump('book', instance.pk)
+	authors_changed([instance.author_id, getattr(instance, '_old_author_id', None)])
+
+
+@receiver(m2m_changed, sender=Book.genre.through)
+def book_genres_changed(sender, instance, action, reverse, pk_set, **kwargs):
+	if not reverse:
+		if action.startswith('post_'):
+			books_changed([instance.pk])
+	elif action == 'pre_clear':
+		# Genre.book_set.clear() doesn't say which books changed
+		Book.objects.filter(genre=instance).update(updated_at=timezone.now())
+		fragments.bump(fragments.CATALOG)
+	elif action.startswith('post_') and pk_set:
+		# Genre.book_set.add(...) etc. lists the books that changed
+		books_changed(pk_set)
+
+
+@receiver(post_save, sender=BookInstance)
+@receiver(post_delete, sender=BookInstance)
+def bookinstance_changed(sender, instance, **kwargs):
+	books_changed([instance.book_id, getattr(instance, '_old_book_id', None)])
+
+
+@receiver(post_save, sender=Author)
+def author_changed(sender, instance, created, raw, **kwargs):
+	# The author's own updated_at is set by the save
+	fragments.bump('author', instance.pk)
+	if not created and not raw:
+		# The author's name is shown on all their books' pages too, so (as
+		# authors rarely change) every fragment is invalidated.
+		Book.objects.filter(author=instance).update(updated_at=timezone.now())
+		fragments.bump(fragments.CATALOG)
+
+
+@receiver(pre_delete, sender=Author)
+def author_deleted_from_books(sender, instance, **kwargs):
+	# Runs before the books' author is set to NULL
+	Book.objects.filter(author=instance).update(updated_at=timezone.now())
+	fragments.bump('author', instance.pk)
+	fragments.bump(fragments.CATALOG)
+
+
+@receiver(post_save, sender=Genre)
+def genre_changed(sender, instance, created, raw, **kwargs):
+	if not created and not raw:
+		Book.objects.filter(genre=instance).update(updated_at=timezone.now())
+		fragments.bump(fragments.CATALOG)
+
+
+@receiver(pre_delete, sender=Genre)
+def genre_deleted_from_books(sender, instance, **kwargs):
+	# Runs before the genre is removed from its books
+	Book.objects.filter(genre=instance).update(updated_at=timezone.now())
+	fragments.bump(fragments.CATALOG)
+
+
+# The in-memory autocomplete indexes (see catalog/autocomplete.py) reload the
+# books and authors recorded here, once the change commits.
+
+@receiver(post_save, sender=Book)
+def autocomplete_book_saved(sender, instance, created, raw, **kwargs):
+	if created or raw or instance.title != instance._stats_old_title:
+		autocomplete.changed('book', [instance.pk])
+
+
+@receiver(post_delete, sender=Book)
+def autocomplete_book_deleted(sender, instance, **kwargs):
+	autocomplete.changed('book', [instance.pk])
+
+
+@receiver(post_save, sender=Author)
+@receiver(post_delete, sender=Author)
+def autocomplete_author_changed(sender, instance, **kwargs):
+	autocomplete.changed('author', [instance.pk])
+
+
+# Cached permission sets (see catalog/permissions.py): a change to a user's
+# groups or permissions moves that user's set to a new version, and a change to
+# a group's permissions (or a deleted group or permission) moves everyone's,
+# once the change commits (see permissions.bump()).
+
+@receiver(m2m_changed, sender=User.groups.through)
+@receiver(m2m_changed, sender=User.user_permissions.through)
+def user_permissions_changed(sender, instance, action, reverse, pk_set, **kwargs):
+	if not action.startswith('post_'):
+		return
+	if not reverse:
+		permissions.bump(instance.pk)
+	elif pk_set is None:
+		# e.g. Group.user_set.clear() doesn't say which users changed
+		permissions.bump()
+	else:
+		for pk in pk_set:
+			permissions.bump(pk)
+
+
+@receiver(m2m_changed, sender=Group.permissions.through)
+def group_permissions_changed(sender, action, **kwargs):
+	if action.startswith('post_'):
+		permissions.bump()
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+@receiver(post_save, sender=Permission)
+@receiver(post_delete, sender=Permission)
+def group_or_permission_changed(sender, instance, **kwargs):
+	permissions.bump()
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, instance, **kwargs):
+	# e.g. is_superuser or is_active changed. Not when a login only updates last_login.
+	if kwargs.get('update_fields') != frozenset(['last_login']):
+		permissions.bump(instance.pk)
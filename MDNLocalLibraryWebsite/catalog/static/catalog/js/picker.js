@@ -0,0 +1,53 @@
+/*
+ * Lazy pickers for the selects rendered by catalog/widgets.py. Each select
+ * with a data-lookup-url only contains its selected options; this adds a
+ * search box and a "More" button that load the other choices from the lookup
+ * URL, a page at a time: {"results": [{"id": 1, "label": "..."}], "next": url}.
+ */
+(function ($) {
+	'use strict';
+
+	function Picker(select) {
+		this.select = $(select);
+		this.url = this.select.data('lookup-url');
+		this.next = null;
+		this.request = null;
+		this.search = $('<input type="search" class="picker-search" placeholder="Type to search...">');
+		this.more = $('<button type="button" class="picker-more">More</button>').hide();
+		this.select.before(this.search).after(this.more);
+
+		var picker = this, timer = null;
+		this.search.on('input', function () {
+			clearTimeout(timer);
+			timer = setTimeout(function () { picker.load(picker.url, {q: picker.search.val()}, true); }, 200);
+		});
+		this.more.on('click', function () { picker.load(picker.next, null, false); });
+		this.load(this.url, null, true);
+	}
+
+	Picker.prototype.load = function (url, params, replace) {
+		var picker = this;
+		if (this.request) {
+			this.request.abort();
+		}
+		this.request = $.getJSON(url, params).done(function (data) {
+			if (replace) {
+				// Keep the selected options (and the empty choice)
+				picker.select.find('option').not(':selected').filter(function () { return this.value; }).remove();
+			}
+			var present = {};
+			picker.select.find('option').each(function () { present[this.value] = true; });
+			$.each(data.results, function (i, choice) {
+				if (!present[choice.id]) {
+					picker.select.append($('<option>').val(choice.id).text(choice.label));
+				}
+			});
+			picker.next = data.next;
+			picker.more.toggle(Boolean(data.next));
+		});
+	};
+
+	$(function () {
+		$('select[data-lookup-url]').each(function () { new Picker(this); });
+	});
+}(jQuery));
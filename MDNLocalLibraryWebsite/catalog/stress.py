@@ -0,0 +1,70 @@
+import random
+import threading
+import time
+from django.db import connection
+from . import loans
+
+# Drives the loan service (catalog/loans.py) from many threads at once, to
+# check that concurrent checkouts never lend a copy twice. Used by the
+# LoanConcurrencyTest and by benchmarks/loan_stress.py, which also reports the
+# throughput. Each thread opens its own database connection, so the database
+# can't be in-memory SQLite.
+
+
+class StressResults(object):
+	"""
+	The outcome of stress_checkouts(): the (copy id, user) of each successful
+	checkout, the number of conflicts, and any unexpected errors.
+	"""
+	def __init__(self):
+		self.loans = []
+		self.conflicts = 0
+		self.errors = []
+		self.seconds = 0.0
+		self.lock = threading.Lock()
+
+	@property
+	def attempts(self):
+		return len(self.loans) + self.conflicts + len(self.errors)
+
+
+def stress_checkouts(copy_ids, users, seed=0):
+	"""
+	Starts one thread per user, all at once, each trying to check out every
+	copy (in its own random order). Returns the StressResults.
+	"""
+	results = StressResults()
+	barrier = threading.Barrier(len(users))
+
+	def borrow(user, order):
+		try:
+			barrier.wait()
+			for pk in order:
+				try:
+					loans.checkout(pk, user)
+				except loans.LoanConflict:
+					with results.lock:
+						results.conflicts += 1
+				except Exception as e:
+					with results.lock:
+						results.errors.append(e)
+				else:
+					with results.lock:
+						results.loans.append((pk, user))
+		finally:
+			# Each thread has its own connection
+			connection.close()
+
+	rng = random.Random(seed)
+	threads = []
+	for user in users:
+		order = list(copy_ids)
+		rng.shuffle(order)
+		threads.append(threading.Thread(target=borrow, args=(user, order)))
+	started = time.perf_counter()
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	results.seconds = time.perf_counter() - started
+	return results
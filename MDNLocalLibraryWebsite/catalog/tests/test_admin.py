@@ -0,0 +1,123 @@
+import datetime
+from unittest import mock
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from catalog.models import Author, Book, BookInstance, Genre
+from catalog.pagination import EstimatedCountPaginator
+
+
+class CatalogAdminTest(TestCase):
+
+	def setUp(self):
+		cache.clear()
+		User.objects.create_superuser(username='admin', email='admin@example.com', password='12345')
+		self.client.login(username='admin', password='12345')
+		self.borrower = User.objects.create_user(username='testuser1', password='12345')
+		self.author = Author.objects.create(first_name='John', last_name='Smith')
+		self.genres = [Genre.objects.create(name='Genre %d' % i) for i in range(3)]
+		self.book = self.create_book('Book 00')
+
+	def create_book(self, title):
+		book = Book.objects.create(title=title, summary='My book summary', isbn='ABCDEFG', author=self.author)
+		book.genre.set(self.genres)
+		return book
+
+	def create_copies(self, count):
+		due_back = datetime.date.today()
+		for i in range(count):
+			BookInstance.objects.create(book=self.book, imprint='Unlikely Imprint, 2016', status='o',
+				due_back=due_back + datetime.timedelta(days=i), borrower=self.borrower)
+
+	def count_queries(self, url, **params):
+		with CaptureQueriesContext(connection) as queries:
+			resp = self.client.get(url, params)
+		self.assertEqual(resp.status_code, 200)
+		return len(queries)
+
+	def test_changelist_queries_do_not_grow_with_rows(self):
+		self.create_copies(2)
+		copies = self.count_queries(reverse('admin:catalog_bookinstance_changelist'))
+		books = self.count_queries(reverse('admin:catalog_book_changelist'))
+		self.create_copies(8)
+		for i in range(1, 9):
+			self.create_book('Book %02d' % i)
+		self.assertEqual(self.count_queries(reverse('admin:catalog_bookinstance_changelist')), copies)
+		self.assertEqual(self.count_queries(reverse('admin:catalog_book_changelist')), books)
+
+	def test_changelist_counts(self):
+		self.create_copies(5)
+		url = reverse('admin:catalog_bookinstance_changelist')
+		with CaptureQueriesContext(connection) as queries:
+			resp = self.client.get(url)
+		self.assertEqual(resp.context['cl'].result_count, 5)
+		self.assertFalse([q for q in queries if 'COUNT(' in q['sql'] and 'catalog_bookinstance' in q['sql']])
+		resp = self.client.get(url, {'status__exact': 'o'})
+		self.assertEqual(resp.context['cl'].result_count, 5)
+		self.assertFalse(resp.context['cl'].paginator.count_is_lower_bound)
+		with mock.patch.object(EstimatedCountPaginator, 'max_count', 3):
+			resp = self.client.get(url, {'status__exact': 'o'})
+			# Only counted up to max_count, and shown as a lower bound
+			self.assertEqual(resp.context['cl'].result_count, 3)
+			self.assertTrue(resp.context['cl'].paginator.count_is_lower_bound)
+			self.assertContains(resp, '3+ book instances')
+			self.assertContains(resp, 'Select all 3+ book instances')
+			self.assertContains(resp, 'All 3+ selected')
+			# The unfiltered count comes from the statistics, so it is exact
+			resp = self.client.get(url)
+			self.assertFalse(resp.context['cl'].paginator.count_is_lower_bound)
+			self.assertContains(resp, '5 book instances')
+
+	def test_inline_is_paginated(self):
+		self.create_copies(25)
+		url = reverse('admin:catalog_book_change', args=[self.book.pk])
+		resp = self.client.get(url)
+		self.assertEqual(resp.status_code, 200)
+		formset = resp.context['inline_admin_formsets'][0].formset
+		self.assertEqual(len(formset.forms), 20)
+		self.assertTrue(formset.page.has_next())
+		self.assertContains(resp, 'bookinstance_set-cursor=')
+		resp = self.client.get(url + '?' + formset.page.next_query_string)
+		formset = resp.context['inline_admin_formsets'][0].formset
+		self.assertEqual(len(formset.forms), 5)
+		self.assertFalse(formset.page.has_next())
+		self.assertEqual([form.instance.due_back for form in formset.forms],
+			[datetime.date.today() + datetime.timedelta(days=i) for i in range(20, 25)])
+
+	def test_inline_queries_do_not_grow_with_rows(self):
+		self.create_copies(2)
+		url = reverse('admin:catalog_book_change', args=[self.book.pk])
+		queries = self.count_queries(url)
+		self.create_copies(10)
+		self.assertEqual(self.count_queries(url), queries)
+
+	def test_change_with_read_only_inline(self):
+		self.create_copies(3)
+		other = Author.objects.create(first_name='Jane', last_name='Austen')
+		resp = self.client.get(reverse('admin:catalog_book_change', args=[self.book.pk]))
+		data = {'title': 'New Title', 'author': other.pk, 'summary': 'My book summary', 'isbn': 'ABCDEFG',
+			'genre': ','.join(str(genre.pk) for genre in self.genres[:2])}
+		formset = resp.context['inline_admin_formsets'][0].formset
+		for name, value in formset.management_form.initial.items():
+			data['%s-%s' % (formset.prefix, name)] = value
+		for i, form in enumerate(formset.forms):
+			data['%s-%d-id' % (formset.prefix, i)] = form.instance.pk
+			data['%s-%d-book' % (formset.prefix, i)] = self.book.pk
+		resp = self.client.post(reverse('admin:catalog_book_change', args=[self.book.pk]), data)
+		self.assertRedirects(resp, reverse('admin:catalog_book_changelist'))
+		self.book.refresh_from_db()
+		self.assertEqual((self.book.title, self.book.author), ('New Title', other))
+		self.assertEqual(set(self.book.genre.all()), set(self.genres[:2]))
+		self.assertEqual(self.book.bookinstance_set.count(), 3)
+
+	def test_author_inline(self):
+		for i in range(1, 25):
+			self.create_book('Book %02d' % i)
+		resp = self.client.get(reverse('admin:catalog_author_change', args=[self.author.pk]))
+		self.assertEqual(resp.status_code, 200)
+		self.assertContains(resp, 'Book 19')
+		self.assertNotContains(resp, 'Book 20')
+		self.assertContains(resp, 'book_set-cursor=')
@@ -0,0 +1,216 @@
+import datetime
+import gzip
+import json
+import os
+import shutil
+import tempfile
+from io import StringIO
+from unittest import mock
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+from catalog.models import Author, BookInstance, Book, Genre, CatalogStats
+from catalog import search, notices
+
+
+class ImportCatalogCommandTest(TestCase):
+
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, self.directory)
+		self.existing_author = Author.objects.create(first_name='John', last_name='Tolkien')
+		Genre.objects.create(name='Fantasy')
+		CatalogStats.rebuild()
+
+	def write(self, name, text):
+		path = os.path.join(self.directory, name)
+		with open(path, 'w', encoding='utf-8') as f:
+			f.write(text)
+		return path
+
+	def import_catalog(self, path, *args):
+		out = StringIO()
+		call_command('import_catalog', path, *args, stdout=out)
+		return out.getvalue()
+
+	def test_import_csv(self):
+		path = self.write('books.csv',
+			'title,summary,isbn,author_first_name,author_last_name,genres,copies,status\n'
+			'The Hobbit,A journey,9780261102217,John,Tolkien,Fantasy|Adventure,2,a\n'
+			'Nacelle Dreams,Engines,1234567890123,Ada,Lovelace,Adventure,1,d\n'
+			'Anonymous Poems,Verse,,,,,0,\n')
+		output = self.import_catalog(path, '--chunk-size', '2')
+		self.assertIn('Imported 3 rows', output)
+		self.assertIn('rows/s', output)
+
+		hobbit = Book.objects.get(title='The Hobbit')
+		self.assertEqual(hobbit.author, self.existing_author)
+		self.assertEqual(sorted(genre.name for genre in hobbit.genre.all()), ['Adventure', 'Fantasy'])
+		self.assertEqual(hobbit.bookinstance_set.filter(status='a').count(), 2)
+		self.assertEqual(Author.objects.filter(last_name='Lovelace').count(), 1)
+		self.assertIsNone(Book.objects.get(title='Anonymous Poems').author)
+		self.assertEqual(Genre.objects.filter(name='Adventure').count(), 1)
+		self.assertEqual(Genre.objects.get(name='Adventure').name_key, 'adventure')
+
+		# The statistics and search index are kept up to date
+		self.assertEqual({field: getattr(CatalogStats.load(), field) for field in CatalogStats.compute()},
+			CatalogStats.compute())
+		self.assertEqual(search.search_books('hobbit'), [hobbit])
+		self.assertEqual((hobbit.num_copies, hobbit.num_available), (2, 2))
+		self.assertEqual(Book.objects.get(title='Nacelle Dreams').num_maintenance, 1)
+		self.assertFalse(os.path.exists(path + '.checkpoint'))
+
+	def test_import_json_lines(self):
+		path = self.write('books.jsonl', '\n'.join(json.dumps(row) for row in [
+			{'title': 'The Hobbit', 'author_first_name': 'John', 'author_last_name': 'Tolkien',
+				'genres': ['Fantasy'], 'copies': 3, 'imprint': 'Allen & Unwin'},
+			{'title': 'The Silmarillion', 'author_first_name': 'John', 'author_last_name': 'Tolkien'},
+		]))
+		self.import_catalog(path)
+		self.assertEqual(self.existing_author.book_set.count(), 2)
+		self.assertEqual(BookInstance.objects.filter(imprint='Allen & Unwin').count(), 3)
+
+	def test_resume_from_checkpoint(self):
+		rows = ['title,author_first_name,author_last_name,copies']
+		rows += ['Book %d,Jane,Doe,1' % n for n in range(5)]
+		rows[4] = ',Jane,Doe,1' # The fourth book has no title
+		path = self.write('books.csv', '\n'.join(rows) + '\n')
+		with self.assertRaisesMessage(CommandError, 'Row 4: the title is missing'):
+			self.import_catalog(path, '--chunk-size', '2')
+		# The first chunk was written, and the one with the bad row rolled back
+		self.assertEqual(Book.objects.filter(title__startswith='Book').count(), 2)
+
+		rows[4] = 'Book 3,Jane,Doe,1'
+		self.write('books.csv', '\n'.join(rows) + '\n')
+		output = self.import_catalog(path, '--chunk-size', '2')
+		self.assertIn('Resuming after row 2', output)
+		self.assertEqual(sorted(Book.objects.filter(title__startswith='Book').values_list('title', flat=True)),
+			['Book %d' % n for n in range(5)])
+		self.assertEqual(Author.objects.filter(last_name='Doe').count(), 1)
+		self.assertEqual(BookInstance.objects.count(), 5)
+
+
+class ExportCatalogCommandTest(TestCase):
+
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, self.directory)
+		test_author = Author.objects.create(first_name='John', last_name='Tolkien')
+		for n in range(3):
+			Book.objects.create(title='Book %d' % n, summary='My book summary', isbn='ABCDEFG', author=test_author)
+
+	def test_export_to_standard_output(self):
+		out = StringIO()
+		call_command('export_catalog', 'authors', '--format', 'jsonl', stdout=out)
+		self.assertEqual(json.loads(out.getvalue())['last_name'], 'Tolkien')
+
+	def test_compressed_export_can_be_imported(self):
+		path = os.path.join(self.directory, 'books.csv.gz')
+		out = StringIO()
+		call_command('export_catalog', 'books', '--output', path, stdout=out)
+		self.assertIn('Exported 3 books', out.getvalue())
+		with gzip.open(path, 'rt', encoding='utf-8') as f:
+			text = f.read()
+		self.assertEqual(len(text.splitlines()), 4)
+
+		Book.objects.all().delete()
+		csv_path = os.path.join(self.directory, 'books.csv')
+		with open(csv_path, 'w', encoding='utf-8', newline='') as f:
+			f.write(text)
+		call_command('import_catalog', csv_path, stdout=StringIO())
+		self.assertEqual(sorted(Book.objects.values_list('title', flat=True)), ['Book 0', 'Book 1', 'Book 2'])
+		self.assertEqual(Author.objects.count(), 1)
+
+
+class RepairCopyCountsCommandTest(TestCase):
+
+	def setUp(self):
+		self.book = Book.objects.create(title='Book Title', summary='My book summary', isbn='ABCDEFG')
+		BookInstance.objects.create(book=self.book, imprint='Imprint', status='a')
+
+	def repair(self, *args):
+		out = StringIO()
+		call_command('repair_copy_counts', *args, stdout=out)
+		return out.getvalue()
+
+	def test_repair(self):
+		self.assertIn('The copy counts of every book are correct', self.repair())
+		# Bulk updates bypass the signal handlers
+		BookInstance.objects.update(status='o')
+		output = self.repair('--dry-run')
+		self.assertIn('1 books have wrong copy counts', output)
+		self.assertEqual(Book.objects.get(pk=self.book.pk).num_available, 1)
+		self.assertIn('Repaired the copy counts of 1 books', self.repair())
+		book = Book.objects.get(pk=self.book.pk)
+		self.assertEqual((book.num_available, book.num_on_loan), (0, 1))
+
+
+class ProfileUrlCommandTest(TestCase):
+
+	def setUp(self):
+		cache.clear()
+		author = Author.objects.create(first_name='John', last_name='Smith')
+		Book.objects.create(title='Book Title', summary='My book summary', isbn='ABCDEFG', author=author)
+		User.objects.create_user(username='librarian', password='12345', is_staff=True)
+		self.directory = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, self.directory)
+
+	def test_profile_url(self):
+		out = StringIO()
+		call_command('profile_url', '/catalog/books/', '--user', 'librarian', '--repeat', '2',
+			'--output-dir', self.directory, stdout=out)
+		output = out.getvalue()
+		self.assertIn('/catalog/books/: 200', output)
+		self.assertIn('cumulative', output)
+		self.assertEqual(len(os.listdir(self.directory)), 3)
+		for name in os.listdir(self.directory):
+			self.assertIn('Wrote %s' % os.path.join(self.directory, name), output)
+
+	def test_unknown_user(self):
+		with self.assertRaises(CommandError):
+			call_command('profile_url', '/catalog/books/', '--user', 'nobody', '--output-dir', self.directory)
+
+
+class SendOverdueNoticesCommandTest(TestCase):
+
+	def setUp(self):
+		today = datetime.date.today()
+		book = Book.objects.create(title='Book Title', summary='My book summary', isbn='ABCDEFG')
+		other_book = Book.objects.create(title='Other Title', summary='My book summary', isbn='ABCDEFG')
+		self.reader = User.objects.create_user(username='reader', email='reader@example.com', password='12345')
+		no_email = User.objects.create_user(username='noemail', password='12345')
+		on_time = User.objects.create_user(username='ontime', email='ontime@example.com', password='12345')
+		for copy_book in (book, other_book):
+			BookInstance.objects.create(book=copy_book, imprint='Imprint', status='o', borrower=self.reader,
+				due_back=today - datetime.timedelta(days=2))
+		BookInstance.objects.create(book=book, imprint='Imprint', status='o', borrower=no_email,
+			due_back=today - datetime.timedelta(days=1))
+		BookInstance.objects.create(book=book, imprint='Imprint', status='o', borrower=on_time,
+			due_back=today + datetime.timedelta(days=1))
+
+	def test_one_digest_per_borrower(self):
+		out = StringIO()
+		with mock.patch('django.core.mail.backends.locmem.EmailBackend.open') as open_connection:
+			call_command('send_overdue_notices', stdout=out)
+		self.assertEqual(open_connection.call_count, 1)
+		self.assertEqual(len(mail.outbox), 1)
+		message = mail.outbox[0]
+		self.assertEqual(message.to, ['reader@example.com'])
+		self.assertIn('Book Title', message.body)
+		self.assertIn('Other Title', message.body)
+		self.assertIn('Sent 1 notices for 3 overdue loans', out.getvalue())
+		self.assertIn('1 borrowers have no email address', out.getvalue())
+
+	def test_dry_run_sends_nothing(self):
+		out = StringIO()
+		call_command('send_overdue_notices', '--dry-run', stdout=out)
+		self.assertEqual(len(mail.outbox), 0)
+		self.assertIn('Would send 1 notices', out.getvalue())
+
+	def test_loans_are_one_query(self):
+		with self.assertNumQueries(1):
+			stats = notices.OverdueNotices(dry_run=True).send()
+		self.assertEqual(stats['borrowers'], 2)
@@ -2,7 +2,7 @@ from django.test import SimpleTestCase
 
 import datetime
 from django.utils import timezone
-from catalog.forms import RenewBookForm
+from catalog.forms import RenewBookForm, BulkLoanForm
 
 class RenewBookFormTest(SimpleTestCase):
 
@@ -40,3 +40,25 @@ class RenewBookFormTest(SimpleTestCase):
 		form = RenewBookForm(data=form_data)
 		self.assertTrue(form.is_valid())
 
+
+class BulkLoanFormTest(SimpleTestCase):
+
+	def test_ids_are_split_and_deduplicated(self):
+		form = BulkLoanForm(data={'action': 'return', 'instances': 'a, b\nc a\n'})
+		self.assertTrue(form.is_valid())
+		self.assertEqual(form.cleaned_data['instances'], ['a', 'b', 'c'])
+
+	def test_too_many_ids(self):
+		ids = '\n'.join(str(n) for n in range(BulkLoanForm.MAX_INSTANCES + 1))
+		form = BulkLoanForm(data={'action': 'return', 'instances': ids})
+		self.assertFalse(form.is_valid())
+
+	def test_renew_needs_a_valid_date(self):
+		form = BulkLoanForm(data={'action': 'renew', 'instances': 'a'})
+		self.assertFalse(form.is_valid())
+		date = datetime.date.today() - datetime.timedelta(days=1)
+		form = BulkLoanForm(data={'action': 'renew', 'instances': 'a', 'renewal_date': date})
+		self.assertFalse(form.is_valid())
+		date = datetime.date.today() + datetime.timedelta(weeks=4)
+		form = BulkLoanForm(data={'action': 'renew', 'instances': 'a', 'renewal_date': date})
+		self.assertTrue(form.is_valid())
@@ -1,5 +1,6 @@
+import datetime
 from django.test import TestCase
-from catalog.models import Author, Genre, Book
+from catalog.models import Author, Genre, Book, BookInstance, CatalogStats
 
 class AuthorModelTest(TestCase):
 
@@ -111,4 +112,132 @@ class BookModelTest(TestCase):
 	def test_get_absolute_url(self):
 		book=Book.objects.get(id=1)
 		#This will also fail if the urlconf is not defined.
-		self.assertEquals(book.get_absolute_url(),'/catalog/book/1')
\ No newline at end of file
+		self.assertEquals(book.get_absolute_url(),'/catalog/book/1')
+
+
+class BookInstanceOverdueTest(TestCase):
+
+	@classmethod
+	def setUpTestData(cls):
+		book = Book.objects.create(title='A Short History of Everything', summary='A very cool book!', isbn=1234567891011)
+		today = datetime.date.today()
+		for days, status in ((-1, 'o'), (0, 'o'), (1, 'o'), (None, 'a')):
+			BookInstance.objects.create(book=book, imprint='Imprint', status=status,
+				due_back=today + datetime.timedelta(days=days) if days is not None else None)
+
+	def test_overdue_filter(self):
+		overdue = BookInstance.objects.overdue()
+		self.assertEqual(overdue.count(), 1)
+		self.assertEqual(overdue.get().due_back, datetime.date.today() - datetime.timedelta(days=1))
+
+	def test_annotation_matches_property(self):
+		for copy in BookInstance.objects.with_overdue():
+			self.assertEqual(copy.overdue, BookInstance.objects.get(pk=copy.pk).is_overdue)
+		self.assertEqual(BookInstance.objects.with_overdue().order_by('-overdue')[0].due_back,
+			datetime.date.today() - datetime.timedelta(days=1))
+
+	def test_is_overdue_uses_annotation(self):
+		copy = BookInstance.objects.with_overdue().get(due_back=datetime.date.today())
+		copy.overdue = True
+		self.assertTrue(copy.is_overdue)
+
+
+class CatalogStatsModelTest(TestCase):
+
+	def setUp(self):
+		author = Author.objects.create(first_name='Big', last_name='Bob')
+		Genre.objects.create(name='Fantasy')
+		self.book = Book.objects.create(title='Nacho Recipes', summary='Crunchy', isbn='1234567891011', author=author)
+		Book.objects.create(title='Other Book', summary='Dull', isbn='1234567891012', author=author)
+		self.copy = BookInstance.objects.create(book=self.book, imprint='Imprint', status='a')
+		BookInstance.objects.create(book=self.book, imprint='Imprint', status='o')
+
+	def assertStatsMatchTables(self):
+		stats = CatalogStats.load()
+		for name, value in CatalogStats.compute().items():
+			self.assertEqual(getattr(stats, name), value, name)
+
+	def test_counts_follow_creation(self):
+		stats = CatalogStats.load()
+		self.assertEqual(stats.num_books, 2)
+		self.assertEqual(stats.num_instances, 2)
+		self.assertEqual(stats.num_instances_available, 1)
+		self.assertEqual(stats.num_authors, 1)
+		self.assertEqual(stats.num_genres, 1)
+		self.assertEqual(stats.num_books_word, 1)
+
+	def test_counts_follow_updates(self):
+		self.book.title = 'Plain Recipes'
+		self.book.save()
+		self.copy.status = 'o'
+		self.copy.save()
+		self.assertStatsMatchTables()
+		self.assertEqual(CatalogStats.load().num_books_word, 0)
+		self.assertEqual(CatalogStats.load().num_instances_available, 0)
+
+	def test_counts_follow_deletion(self):
+		self.copy.delete()
+		self.book.delete()
+		Author.objects.all().delete()
+		Genre.objects.all().delete()
+		self.assertStatsMatchTables()
+
+	def test_load_rebuilds_missing_row(self):
+		CatalogStats.objects.all().delete()
+		self.assertStatsMatchTables()
+
+
+class BookCopyCountsTest(TestCase):
+
+	def setUp(self):
+		self.book = Book.objects.create(title='Book Title', summary='My book summary', isbn='ABCDEFG')
+		self.other_book = Book.objects.create(title='Other Title', summary='My book summary', isbn='ABCDEFH')
+		self.copy = BookInstance.objects.create(book=self.book, imprint='Imprint', status='a')
+		BookInstance.objects.create(book=self.book, imprint='Imprint', status='o')
+		BookInstance.objects.create(book=self.book, imprint='Imprint', status='d')
+
+	def assertCountsMatchCopies(self):
+		book_ids = [self.book.pk, self.other_book.pk]
+		for book_id, counts in Book.count_copies(book_ids).items():
+			stored = Book.objects.values(*Book.COPY_COUNTS).get(pk=book_id)
+			self.assertEqual(stored, counts)
+
+	def test_counts_follow_creation(self):
+		book = Book.objects.get(pk=self.book.pk)
+		self.assertEqual((book.num_copies, book.num_available, book.num_on_loan, book.num_reserved, book.num_maintenance),
+			(3, 1, 1, 0, 1))
+		self.assertCountsMatchCopies()
+
+	def test_counts_follow_status_changes_and_moves(self):
+		self.copy.status = 'r'
+		self.copy.save()
+		self.assertEqual(Book.objects.get(pk=self.book.pk).num_reserved, 1)
+		self.copy.book = self.other_book
+		self.copy.status = 'a'
+		self.copy.save()
+		self.assertEqual(Book.objects.get(pk=self.book.pk).num_copies, 2)
+		self.assertEqual(Book.objects.get(pk=self.other_book.pk).num_available, 1)
+		self.assertCountsMatchCopies()
+
+	def test_counts_follow_deletion(self):
+		self.copy.delete()
+		BookInstance.objects.filter(status='o').delete()
+		self.assertEqual(Book.objects.get(pk=self.book.pk).num_copies, 1)
+		self.assertCountsMatchCopies()
+
+	def test_saving_a_stale_book_keeps_the_counts(self):
+		stale = Book.objects.get(pk=self.book.pk)
+		self.copy.status = 'o'
+		self.copy.save()
+		stale.title = 'New Title'
+		stale.save()
+		book = Book.objects.get(pk=self.book.pk)
+		self.assertEqual((book.title, book.num_available, book.num_on_loan), ('New Title', 0, 2))
+
+	def test_repair_copy_counts(self):
+		BookInstance.objects.filter(status='d').update(status='a')
+		Book.objects.filter(pk=self.other_book.pk).update(num_copies=5)
+		self.assertEqual(sorted(Book.repair_copy_counts(dry_run=True)), [self.book.pk, self.other_book.pk])
+		self.assertEqual(sorted(Book.repair_copy_counts(chunk_size=1)), [self.book.pk, self.other_book.pk])
+		self.assertCountsMatchCopies()
+		self.assertEqual(Book.repair_copy_counts(), [])
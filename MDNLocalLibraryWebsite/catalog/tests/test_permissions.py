@@ -0,0 +1,117 @@
+import threading
+from django.contrib.auth.models import Group, Permission, User
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+from catalog.tests.utils import OnCommitMixin
+
+
+class CachedPermissionBackendTest(OnCommitMixin, TestCase):
+
+	def setUp(self):
+		cache.clear()
+		self.user = User.objects.create_user(username='testuser1', password='12345')
+		self.librarians = Group.objects.create(name='Librarians')
+		self.can_mark_returned = Permission.objects.get(codename='can_mark_returned')
+		self.can_modify_book = Permission.objects.get(codename='can_modify_book')
+		self.librarians.permissions.add(self.can_mark_returned)
+		self.user.groups.add(self.librarians)
+
+	def fresh_user(self):
+		# As loaded by a new request
+		return User.objects.get(pk=self.user.pk)
+
+	def test_permissions_are_cached_across_requests(self):
+		self.assertTrue(self.fresh_user().has_perm('catalog.can_mark_returned'))
+		user = self.fresh_user()
+		with self.assertNumQueries(0):
+			self.assertTrue(user.has_perm('catalog.can_mark_returned'))
+			self.assertFalse(user.has_perm('catalog.can_modify_book'))
+			self.assertTrue(user.has_module_perms('catalog'))
+
+	def test_user_permission_changes(self):
+		self.assertFalse(self.fresh_user().has_perm('catalog.can_modify_book'))
+		with self.captureOnCommitCallbacks(execute=True):
+			self.user.user_permissions.add(self.can_modify_book)
+		self.assertTrue(self.fresh_user().has_perm('catalog.can_modify_book'))
+		with self.captureOnCommitCallbacks(execute=True):
+			self.can_modify_book.user_set.remove(self.user)
+		self.assertFalse(self.fresh_user().has_perm('catalog.can_modify_book'))
+
+	def test_group_changes(self):
+		self.assertTrue(self.fresh_user().has_perm('catalog.can_mark_returned'))
+		with self.captureOnCommitCallbacks(execute=True):
+			self.librarians.user_set.remove(self.user)
+		self.assertFalse(self.fresh_user().has_perm('catalog.can_mark_returned'))
+		with self.captureOnCommitCallbacks(execute=True):
+			self.user.groups.add(self.librarians)
+			self.librarians.permissions.add(self.can_modify_book)
+		self.assertTrue(self.fresh_user().has_perm('catalog.can_modify_book'))
+		with self.captureOnCommitCallbacks(execute=True):
+			self.librarians.permissions.clear()
+		self.assertFalse(self.fresh_user().has_perm('catalog.can_mark_returned'))
+
+	def test_deleted_group(self):
+		self.assertTrue(self.fresh_user().has_perm('catalog.can_mark_returned'))
+		with self.captureOnCommitCallbacks(execute=True):
+			self.librarians.delete()
+		self.assertFalse(self.fresh_user().has_perm('catalog.can_mark_returned'))
+
+	def test_superuser_and_inactive_users(self):
+		self.assertFalse(self.fresh_user().has_perm('catalog.can_modify_book'))
+		self.user.is_superuser = True
+		with self.captureOnCommitCallbacks(execute=True):
+			self.user.save()
+		self.assertTrue(self.fresh_user().has_perm('catalog.can_modify_book'))
+		self.user.is_active = False
+		self.user.save()
+		self.assertFalse(self.fresh_user().has_perm('catalog.can_modify_book'))
+
+	def test_changes_only_take_effect_once_committed(self):
+		self.assertTrue(self.fresh_user().has_perm('catalog.can_mark_returned'))
+		with self.captureOnCommitCallbacks() as callbacks:
+			self.librarians.user_set.remove(self.user)
+		self.assertTrue(callbacks)
+		# The version hasn't moved, so the cached set is still used until the commit
+		self.assertTrue(self.fresh_user().has_perm('catalog.can_mark_returned'))
+		for callback in callbacks:
+			callback()
+		self.assertFalse(self.fresh_user().has_perm('catalog.can_mark_returned'))
+
+	def test_views_do_not_query_permissions(self):
+		self.client.login(username='testuser1', password='12345')
+		self.client.get(reverse('all-borrowed'))
+		with self.assertNumQueries(6):
+			# Last modified lookups (3), user, loans with their books, overdue count
+			response = self.client.get(reverse('all-borrowed'))
+		self.assertEqual(response.status_code, 200)
+
+
+class PermissionRevokedInTransactionTest(TransactionTestCase):
+
+	def setUp(self):
+		cache.clear()
+		self.user = User.objects.create_user(username='testuser1', password='12345')
+		self.user.user_permissions.add(Permission.objects.get(codename='can_mark_returned'))
+
+	def has_perm_in_another_request(self):
+		# A request on another thread (with its own connection) while the
+		# revoking transaction is still open
+		results = []
+		def request():
+			try:
+				results.append(User.objects.get(pk=self.user.pk).has_perm('catalog.can_mark_returned'))
+			finally:
+				connection.close()
+		thread = threading.Thread(target=request)
+		thread.start()
+		thread.join()
+		return results[0]
+
+	def test_concurrent_read_does_not_cache_the_old_set_under_the_new_version(self):
+		with transaction.atomic():
+			self.user.user_permissions.clear()
+			# Not committed yet, so the other request still sees the permission
+			self.assertTrue(self.has_perm_in_another_request())
+		self.assertFalse(User.objects.get(pk=self.user.pk).has_perm('catalog.can_mark_returned'))
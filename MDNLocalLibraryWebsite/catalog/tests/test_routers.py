@@ -0,0 +1,78 @@
+from django.http import HttpResponse
+from django.test import SimpleTestCase, RequestFactory, override_settings
+from catalog import routers
+from catalog.models import Book
+
+
+@override_settings(DATABASE_REPLICAS=['replica1', 'replica2'])
+class PrimaryReplicaRouterTest(SimpleTestCase):
+
+	def setUp(self):
+		self.router = routers.PrimaryReplicaRouter()
+		routers.reset()
+		self.addCleanup(routers.reset)
+
+	def test_reads_go_to_one_replica(self):
+		replica = self.router.db_for_read(Book)
+		self.assertIn(replica, ['replica1', 'replica2'])
+		for i in range(10):
+			self.assertEqual(self.router.db_for_read(Book), replica)
+
+	def test_writes_go_to_the_primary_and_pin_the_reads(self):
+		self.assertEqual(self.router.db_for_write(Book), 'default')
+		self.assertEqual(self.router.db_for_read(Book), 'default')
+		routers.reset()
+		self.assertNotEqual(self.router.db_for_read(Book), 'default')
+
+	def test_use_primary(self):
+		with routers.use_primary():
+			self.assertEqual(self.router.db_for_read(Book), 'default')
+		self.assertNotEqual(self.router.db_for_read(Book), 'default')
+
+	@override_settings(DATABASE_REPLICAS=[])
+	def test_no_replicas(self):
+		self.assertEqual(self.router.db_for_read(Book), 'default')
+
+	def test_replicas_are_not_migrated(self):
+		self.assertFalse(self.router.allow_migrate('replica1', 'catalog'))
+		self.assertIsNone(self.router.allow_migrate('default', 'catalog'))
+
+
+@override_settings(DATABASE_REPLICAS=['replica1'], DATABASE_REPLICA_PIN_SECONDS=5)
+class ReplicaRoutingMiddlewareTest(SimpleTestCase):
+
+	def setUp(self):
+		self.router = routers.PrimaryReplicaRouter()
+		self.factory = RequestFactory()
+		self.reads = []
+		self.addCleanup(routers.reset)
+
+	def view(self, write=False):
+		def get_response(request):
+			self.reads.append(self.router.db_for_read(Book))
+			if write:
+				self.router.db_for_write(Book)
+				self.reads.append(self.router.db_for_read(Book))
+			return HttpResponse()
+		return routers.ReplicaRoutingMiddleware(get_response)
+
+	def test_get_reads_the_replica(self):
+		response = self.view()(self.factory.get('/catalog/books/'))
+		self.assertEqual(self.reads, ['replica1'])
+		self.assertNotIn(routers.PIN_COOKIE, response.cookies)
+
+	def test_post_reads_the_primary(self):
+		self.view()(self.factory.post('/catalog/book/1/update/'))
+		self.assertEqual(self.reads, ['default'])
+
+	def test_write_pins_the_request_and_the_next_ones(self):
+		response = self.view(write=True)(self.factory.get('/catalog/'))
+		self.assertEqual(self.reads, ['replica1', 'default'])
+		self.assertEqual(response.cookies[routers.PIN_COOKIE]['max-age'], 5)
+		# The routing state doesn't outlive the request
+		self.assertEqual(self.router.db_for_read(Book), 'replica1')
+
+		request = self.factory.get('/catalog/')
+		request.COOKIES[routers.PIN_COOKIE] = '1'
+		self.view()(request)
+		self.assertEqual(self.reads[-1], 'default')
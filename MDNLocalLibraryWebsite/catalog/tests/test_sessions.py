@@ -0,0 +1,132 @@
+from unittest import mock
+from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
+from django.conf import settings
+from django.core.cache import caches
+from django.db import OperationalError, connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from catalog import sessions
+from catalog.sessions import SessionStore
+
+
+@override_settings(SESSION_ENGINE='catalog.sessions', SESSION_WRITE_BEHIND_THRESHOLD=100, SESSION_WRITE_BEHIND_INTERVAL=3600)
+class SessionStoreTest(TestCase):
+
+	def setUp(self):
+		self.session_cache = caches[settings.SESSION_CACHE_ALIAS]
+		self.session_cache.clear()
+		sessions.write_behind.pending.clear()
+		self.addCleanup(sessions.write_behind.pending.clear)
+		store = SessionStore()
+		store['name'] = 'Jane'
+		store.save()
+		self.session_key = store.session_key
+
+	def stored_data(self):
+		return SessionStore().decode(Session.objects.get(session_key=self.session_key).session_data)
+
+	def test_new_sessions_are_written_to_the_database(self):
+		self.assertEqual(self.stored_data(), {'name': 'Jane'})
+
+	def test_loads_from_the_cache(self):
+		with self.assertNumQueries(0):
+			self.assertEqual(SessionStore(self.session_key)['name'], 'Jane')
+
+	def test_falls_back_to_the_database(self):
+		self.session_cache.clear()
+		with self.assertNumQueries(1):
+			self.assertEqual(SessionStore(self.session_key)['name'], 'Jane')
+		with self.assertNumQueries(0):
+			self.assertEqual(SessionStore(self.session_key)['name'], 'Jane')
+
+	def test_changes_are_written_behind(self):
+		store = SessionStore(self.session_key)
+		store['name'] = 'John'
+		with self.assertNumQueries(0):
+			store.save()
+		self.assertEqual(SessionStore(self.session_key)['name'], 'John')
+		self.assertEqual(self.stored_data(), {'name': 'Jane'})
+		self.assertEqual(sessions.write_behind.flush(), 1)
+		self.assertEqual(self.stored_data(), {'name': 'John'})
+
+	def test_logins_are_written_straight_away(self):
+		store = SessionStore(self.session_key)
+		store['_auth_user_id'] = '1'
+		store.save()
+		self.assertEqual(self.stored_data(), {'name': 'Jane', '_auth_user_id': '1'})
+		self.assertEqual(sessions.write_behind.pending, {})
+
+	def test_unchanged_sessions_are_not_saved(self):
+		store = SessionStore(self.session_key)
+		store['name'] = 'Jane'
+		store.save()
+		self.assertEqual(sessions.write_behind.pending, {})
+
+	@override_settings(SESSION_WRITE_BEHIND_THRESHOLD=2)
+	def test_writes_once_the_threshold_is_reached(self):
+		other = SessionStore()
+		other.create()
+		for session_key in [self.session_key, other.session_key]:
+			store = SessionStore(session_key)
+			store['page'] = 2
+			store.save()
+		self.assertEqual(sessions.write_behind.pending, {})
+		self.assertEqual(self.stored_data(), {'name': 'Jane', 'page': 2})
+
+	@override_settings(SESSION_WRITE_BEHIND_THRESHOLD=1)
+	def test_failed_write_is_retried(self):
+		store = SessionStore(self.session_key)
+		store['name'] = 'John'
+		with mock.patch.object(Session.objects, 'bulk_update', side_effect=OperationalError('database is locked')):
+			with self.assertLogs('catalog.sessions', 'ERROR'):
+				store.save()
+		self.assertEqual(list(sessions.write_behind.pending), [self.session_key])
+		self.assertEqual(SessionStore(self.session_key)['name'], 'John')
+		self.assertEqual(sessions.write_behind.flush(), 1)
+		self.assertEqual(self.stored_data(), {'name': 'John'})
+
+	def test_changes_are_written_after_the_cache_culls_the_session(self):
+		store = SessionStore(self.session_key)
+		store['name'] = 'John'
+		store.save()
+		self.session_cache.clear()
+		self.assertEqual(sessions.write_behind.flush(), 1)
+		self.assertEqual(self.stored_data(), {'name': 'John'})
+
+	def test_sessions_removed_by_clearsessions_are_written_back(self):
+		store = SessionStore(self.session_key)
+		store['name'] = 'John'
+		store.save()
+		Session.objects.filter(session_key=self.session_key).delete()
+		self.assertEqual(sessions.write_behind.flush(), 1)
+		self.assertEqual(self.stored_data(), {'name': 'John'})
+
+	def test_sessions_deleted_by_another_process_are_logged_not_written(self):
+		store = SessionStore(self.session_key)
+		store['name'] = 'John'
+		store.save()
+		# The other process deletes the row and the cache entry, not this process's buffer
+		Session.objects.filter(session_key=self.session_key).delete()
+		self.session_cache.clear()
+		with self.assertLogs('catalog.sessions', 'WARNING') as logs:
+			self.assertEqual(sessions.write_behind.flush(), 0)
+		self.assertIn('Dropped 1 buffered session changes', logs.output[0])
+		self.assertFalse(Session.objects.filter(session_key=self.session_key).exists())
+
+	def test_deleted_sessions_are_not_written(self):
+		store = SessionStore(self.session_key)
+		store['name'] = 'John'
+		store.save()
+		store.delete()
+		self.assertEqual(sessions.write_behind.flush(), 0)
+		self.assertFalse(Session.objects.filter(session_key=self.session_key).exists())
+
+	def test_login(self):
+		User.objects.create_user(username='testuser1', password='12345')
+		self.assertTrue(self.client.login(username='testuser1', password='12345'))
+		with CaptureQueriesContext(connection) as queries:
+			response = self.client.get(reverse('my-borrowed'))
+		self.assertEqual(str(response.context['user']), 'testuser1')
+		self.assertFalse([query for query in queries if 'django_session' in query['sql']])
@@ -1,10 +1,686 @@
 import datetime
+import json
+import os
+import shutil
+import tempfile
+import threading
+from unittest import mock
 from django.utils import timezone
 #from django.core.urlresolvers import reverse
 from django.urls import reverse
 from django.contrib.auth.models import User, Permission #Required to assign User as a borrower
-from django.test import TestCase
-from catalog.models import Author, BookInstance, Book, Genre
+from django.conf import settings
+from django.core.cache import cache
+from django.db import OperationalError, connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from catalog.models import Author, BookInstance, Book, Genre, CatalogStats, VisitCount
+from catalog import visits, autocomplete, routers
+from catalog.stress import stress_checkouts
+from catalog.text import prefix_filter
+from catalog.tests.utils import OnCommitMixin
+
+
+class IndexViewTest(TestCase):
+
+	@classmethod
+	def setUpTestData(cls):
+		test_author = Author.objects.create(first_name='John', last_name='Smith')
+		for book_num in range(3):
+			Book.objects.create(title='Nacelle %s' % book_num, summary='My book summary', isbn='ABCDEFG', author=test_author)
+
+	def test_counts_come_from_stats(self):
+		resp = self.client.get(reverse('index'))
+		self.assertEqual(resp.status_code, 200)
+		self.assertEqual(resp.context['num_books'], 3)
+		self.assertEqual(resp.context['num_books_word'], 3)
+		self.assertEqual(resp.context['num_authors'], 1)
+
+	def test_counts_are_one_query(self):
+		# A fresh visit buffer, so the request doesn't flush it
+		patcher = mock.patch.object(visits, 'counter', visits.VisitCounter())
+		patcher.start()
+		self.addCleanup(patcher.stop)
+		cache.clear()
+		# The first visit also looks up the visitor's stored visit count
+		self.client.get(reverse('index'))
+		# All the record counts come from a single primary key lookup
+		with self.assertNumQueries(1):
+			resp = self.client.get(reverse('index'))
+		self.assertEqual(resp.status_code, 200)
+		self.assertEqual(resp.context['num_books'], 3)
+
+
+class IndexVisitCountTest(TestCase):
+
+	def setUp(self):
+		# Start each test with an empty buffer and cache
+		patcher = mock.patch.object(visits, 'counter', visits.VisitCounter())
+		patcher.start()
+		self.addCleanup(patcher.stop)
+		cache.clear()
+
+	def test_visits_are_counted_per_visitor(self):
+		resp = self.client.get(reverse('index'))
+		self.assertEqual(resp.context['num_visits'], 0)
+		self.assertIn(visits.VISITOR_COOKIE, resp.cookies)
+		resp = self.client.get(reverse('index'))
+		self.assertEqual(resp.context['num_visits'], 1)
+		self.assertNotIn(visits.VISITOR_COOKIE, resp.cookies)
+		# Another browser starts from zero
+		self.client.cookies.clear()
+		resp = self.client.get(reverse('index'))
+		self.assertEqual(resp.context['num_visits'], 0)
+
+	def test_visit_does_not_save_the_session(self):
+		self.client.get(reverse('index'))
+		resp = self.client.get(reverse('index'))
+		self.assertNotIn(settings.SESSION_COOKIE_NAME, resp.cookies)
+		# Only the statistics lookup hits the database
+		with self.assertNumQueries(1):
+			self.client.get(reverse('index'))
+
+	@override_settings(VISIT_COUNTER_FLUSH_THRESHOLD=3)
+	def test_visits_are_flushed_in_batches(self):
+		self.client.get(reverse('index'))
+		self.client.get(reverse('index'))
+		self.assertFalse(VisitCount.objects.exists())
+		self.client.get(reverse('index'))
+		self.assertEqual(VisitCount.objects.get().count, 3)
+
+	def test_count_survives_cache_eviction(self):
+		test_user = User.objects.create_user(username='testuser1', password='12345')
+		self.client.login(username='testuser1', password='12345')
+		for i in range(3):
+			self.client.get(reverse('index'))
+		visits.counter.flush()
+		cache.clear()
+		resp = self.client.get(reverse('index'))
+		self.assertEqual(resp.context['num_visits'], 3)
+		self.assertEqual(VisitCount.objects.get().visitor, 'user:%d' % test_user.pk)
+
+	@override_settings(VISIT_COUNTER_FLUSH_THRESHOLD=1)
+	def test_failed_flush_still_renders_the_page(self):
+		with mock.patch.object(VisitCount.objects, 'bulk_create', side_effect=OperationalError('database is locked')):
+			with self.assertLogs('catalog.visits', 'ERROR'):
+				resp = self.client.get(reverse('index'))
+		self.assertEqual(resp.status_code, 200)
+		self.assertEqual(resp.context['num_visits'], 0)
+		# The next flush writes the visit that failed too
+		self.client.get(reverse('index'))
+		self.assertEqual(VisitCount.objects.get().count, 2)
+
+
+class DetailViewQueryCountTest(TestCase):
+	"""
+	The detail pages must cost a fixed number of queries, however many books
+	and copies there are.
+	"""
+
+	def setUp(self):
+		# Measure the uncached pages
+		cache.clear()
+
+	@classmethod
+	def setUpTestData(cls):
+		cls.test_author = Author.objects.create(first_name='John', last_name='Smith')
+		Genre.objects.create(name='Fantasy')
+		Genre.objects.create(name='Mystery')
+		for book_num in range(5):
+			book = Book.objects.create(title='Book %s' % book_num, summary='My book summary', isbn='ABCDEFG', author=cls.test_author)
+			book.genre.set(Genre.objects.all())
+			for copy_num in range(book_num):
+				BookInstance.objects.create(book=book, imprint='Unlikely Imprint, 2016', status='a')
+		cls.test_book = book
+
+	def test_book_detail_queries(self):
+		# Last modified time (on a cache miss), book and author, genres, copies
+		with self.assertNumQueries(4):
+			resp = self.client.get(reverse('book-detail', args=[self.test_book.pk]))
+		self.assertEqual(resp.status_code, 200)
+		self.assertContains(resp, 'Unlikely Imprint', count=4)
+
+	def test_book_detail_queries_do_not_grow_with_copies(self):
+		for copy_num in range(10):
+			BookInstance.objects.create(book=self.test_book, imprint='Unlikely Imprint, 2016', status='o')
+		cache.clear()
+		with self.assertNumQueries(4):
+			self.client.get(reverse('book-detail', args=[self.test_book.pk]))
+
+	def test_author_detail_queries(self):
+		# Last modified time (on a cache miss), author, books with their copy counts
+		with self.assertNumQueries(3):
+			resp = self.client.get(reverse('author-detail', args=[self.test_author.pk]))
+		self.assertEqual(resp.status_code, 200)
+		self.assertEqual([book.num_copies for book in resp.context['author'].book_set.all()], [0, 1, 2, 3, 4])
+		self.assertContains(resp, '(4)</h5>')
+
+	def test_author_detail_queries_do_not_grow_with_books(self):
+		for book_num in range(10):
+			book = Book.objects.create(title='More %s' % book_num, summary='My book summary', isbn='ABCDEFG', author=self.test_author)
+			BookInstance.objects.create(book=book, imprint='Unlikely Imprint, 2016', status='a')
+		cache.clear()
+		with self.assertNumQueries(3):
+			self.client.get(reverse('author-detail', args=[self.test_author.pk]))
+
+
+class DetailFragmentCacheTest(OnCommitMixin, TestCase):
+
+	def setUp(self):
+		cache.clear()
+		self.test_author = Author.objects.create(first_name='John', last_name='Smith')
+		self.test_genre = Genre.objects.create(name='Fantasy')
+		self.test_book = Book.objects.create(title='Book Title', summary='My book summary', isbn='ABCDEFG', author=self.test_author)
+		self.test_book.genre.set([self.test_genre])
+		self.test_copy = BookInstance.objects.create(book=self.test_book, imprint='Unlikely Imprint, 2016', status='a')
+		self.book_url = reverse('book-detail', args=[self.test_book.pk])
+		self.author_url = reverse('author-detail', args=[self.test_author.pk])
+
+	def test_cached_pages_run_no_queries(self):
+		first = self.client.get(self.book_url)
+		self.client.get(self.author_url)
+		with self.assertNumQueries(0):
+			resp = self.client.get(self.book_url)
+			self.client.get(self.author_url)
+		self.assertEqual(resp.content, first.content)
+
+	def test_misses_are_rendered_from_the_primary(self):
+		reads = []
+		def db_for_read(router, model, **hints):
+			reads.append(routers.is_pinned())
+			return 'default'
+		routers.reset()
+		self.addCleanup(routers.reset)
+		with mock.patch.object(routers.PrimaryReplicaRouter, 'db_for_read', autospec=True, side_effect=db_for_read):
+			self.client.get(self.book_url)
+			self.assertTrue(reads)
+			self.assertTrue(all(reads))
+			del reads[:]
+			self.client.get(self.book_url)
+		self.assertEqual(reads, [])
+
+	def test_copy_change_invalidates_book_and_author(self):
+		self.client.get(self.book_url)
+		self.client.get(self.author_url)
+		with self.captureOnCommitCallbacks(execute=True):
+			BookInstance.objects.create(book=self.test_book, imprint='Second Imprint', status='o')
+		self.assertContains(self.client.get(self.book_url), 'Second Imprint')
+		self.assertContains(self.client.get(self.author_url), '(2)</h5>')
+
+	def test_genre_and_author_changes_invalidate_book(self):
+		self.client.get(self.book_url)
+		self.test_genre.name = 'Horror'
+		with self.captureOnCommitCallbacks(execute=True):
+			self.test_genre.save()
+		self.assertContains(self.client.get(self.book_url), 'Horror')
+		with self.captureOnCommitCallbacks(execute=True):
+			self.test_book.genre.add(Genre.objects.create(name='Comedy'))
+		self.assertContains(self.client.get(self.book_url), 'Comedy')
+		self.test_author.last_name = 'Jones'
+		with self.captureOnCommitCallbacks(execute=True):
+			self.test_author.save()
+		self.assertContains(self.client.get(self.book_url), 'Jones')
+
+	def test_moving_book_invalidates_both_authors(self):
+		self.client.get(self.author_url)
+		other_author = Author.objects.create(first_name='Jane', last_name='Doe')
+		self.test_book.author = other_author
+		with self.captureOnCommitCallbacks(execute=True):
+			self.test_book.save()
+		self.assertNotContains(self.client.get(self.author_url), 'Book Title')
+		self.assertContains(self.client.get(reverse('author-detail', args=[other_author.pk])), 'Book Title')
+
+	def test_perms_block_is_not_cached(self):
+		self.client.get(self.book_url)
+		test_user = User.objects.create_user(username='testuser1', password='12345')
+		test_user.user_permissions.add(Permission.objects.get(name='Create, modify, or delete books'))
+		self.client.login(username='testuser1', password='12345')
+		self.assertContains(self.client.get(self.book_url), reverse('book_update', args=[self.test_book.pk]))
+
+	def test_invalidated_on_commit(self):
+		self.client.get(self.book_url)
+		with self.captureOnCommitCallbacks() as callbacks:
+			BookInstance.objects.create(book=self.test_book, imprint='Second Imprint', status='o')
+			# Until the commit, the page is still the committed one
+			self.assertNotContains(self.client.get(self.book_url), 'Second Imprint')
+		for callback in callbacks:
+			callback()
+		self.assertContains(self.client.get(self.book_url), 'Second Imprint')
+
+	def test_deleted_book_is_404(self):
+		self.client.get(self.book_url)
+		with self.captureOnCommitCallbacks(execute=True):
+			self.test_book.delete()
+		self.assertEqual(self.client.get(self.book_url).status_code, 404)
+
+
+class ConditionalGetTest(OnCommitMixin, TestCase):
+
+	def setUp(self):
+		cache.clear()
+		patcher = mock.patch.object(visits, 'counter', visits.VisitCounter())
+		patcher.start()
+		self.addCleanup(patcher.stop)
+		self.test_author = Author.objects.create(first_name='John', last_name='Smith')
+		self.test_book = Book.objects.create(title='Book Title', summary='My book summary', isbn='ABCDEFG', author=self.test_author)
+		self.book_url = reverse('book-detail', args=[self.test_book.pk])
+
+	def test_unchanged_book_is_not_modified(self):
+		resp = self.client.get(self.book_url)
+		self.assertTrue(resp.has_header('ETag'))
+		self.assertTrue(resp.has_header('Last-Modified'))
+		with self.assertNumQueries(0):
+			resp = self.client.get(self.book_url, HTTP_IF_NONE_MATCH=resp['ETag'])
+		self.assertEqual(resp.status_code, 304)
+
+	def test_copy_change_modifies_book(self):
+		etag = self.client.get(self.book_url)['ETag']
+		with self.captureOnCommitCallbacks(execute=True):
+			BookInstance.objects.create(book=self.test_book, imprint='Unlikely Imprint, 2016', status='a')
+		resp = self.client.get(self.book_url, HTTP_IF_NONE_MATCH=etag)
+		self.assertEqual(resp.status_code, 200)
+		self.assertNotEqual(resp['ETag'], etag)
+
+	def test_etag_depends_on_user(self):
+		etag = self.client.get(self.book_url)['ETag']
+		User.objects.create_user(username='testuser1', password='12345')
+		self.client.login(username='testuser1', password='12345')
+		resp = self.client.get(self.book_url, HTTP_IF_NONE_MATCH=etag)
+		self.assertEqual(resp.status_code, 200)
+
+	def test_list_is_modified_by_new_book(self):
+		etag = self.client.get(reverse('books'))['ETag']
+		self.assertEqual(self.client.get(reverse('books'), HTTP_IF_NONE_MATCH=etag).status_code, 304)
+		Book.objects.create(title='Another Title', summary='My book summary', isbn='ABCDEFG', author=self.test_author)
+		self.assertEqual(self.client.get(reverse('books'), HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+	def test_loan_lists_check_authorization_first(self):
+		future = 'Fri, 01 Jan 2100 00:00:00 GMT'
+		for name in ('my-borrowed', 'all-borrowed'):
+			with self.assertNumQueries(0):
+				resp = self.client.get(reverse(name), HTTP_IF_MODIFIED_SINCE=future)
+			self.assertEqual(resp.status_code, 302)
+			self.assertFalse(resp.has_header('Last-Modified'))
+			self.assertFalse(resp.has_header('ETag'))
+		User.objects.create_user(username='testuser1', password='12345')
+		self.client.login(username='testuser1', password='12345')
+		resp = self.client.get(reverse('all-borrowed'), HTTP_IF_MODIFIED_SINCE=future)
+		self.assertEqual(resp.status_code, 403)
+		self.assertFalse(resp.has_header('Last-Modified'))
+		resp = self.client.get(reverse('my-borrowed'), HTTP_IF_MODIFIED_SINCE=future)
+		self.assertEqual(resp.status_code, 304)
+
+	def test_not_modified_index_still_counts_the_visit(self):
+		resp = self.client.get(reverse('index'))
+		resp = self.client.get(reverse('index'), HTTP_IF_NONE_MATCH=resp['ETag'])
+		self.assertEqual(resp.status_code, 304)
+		resp = self.client.get(reverse('index'))
+		self.assertEqual(resp.context['num_visits'], 2)
+
+
+class BookListViewTest(TestCase):
+
+	def setUp(self):
+		author = Author.objects.create(first_name='John', last_name='Smith')
+		for title, statuses in (('Alpha', 'o'), ('Beta', 'aaa'), ('Gamma', 'ao'), ('Delta', '')):
+			book = Book.objects.create(title=title, summary='My book summary', isbn='ABCDEFG', author=author)
+			for status in statuses:
+				BookInstance.objects.create(book=book, imprint='Imprint', status=status)
+
+	def titles(self, query=''):
+		response = self.client.get(reverse('books') + query)
+		self.assertEqual(response.status_code, 200)
+		return [book.title for book in response.context['book_list']]
+
+	def test_sorted_by_title(self):
+		self.assertEqual(self.titles(), ['Alpha', 'Beta', 'Delta', 'Gamma'])
+
+	def test_only_available(self):
+		self.assertEqual(self.titles('?available=1'), ['Beta', 'Gamma'])
+
+	def test_sorted_by_availability(self):
+		self.assertEqual(self.titles('?sort=available')[:2], ['Beta', 'Gamma'])
+		self.assertEqual(self.titles('?sort=available&available=1'), ['Beta', 'Gamma'])
+
+	def test_pages_keep_the_filter(self):
+		for i in range(10):
+			book = Book.objects.create(title='Extra %d' % i, summary='My book summary', isbn='ABCDEFG')
+			BookInstance.objects.create(book=book, imprint='Imprint', status='a')
+		response = self.client.get(reverse('books') + '?sort=available&available=1')
+		self.assertTrue(response.context['is_paginated'])
+		next_page = self.client.get(reverse('books') + '?' + response.context['page_obj'].next_query_string)
+		titles = [book.title for book in response.context['book_list'] + next_page.context['book_list']]
+		self.assertEqual(len(titles), 12)
+		self.assertEqual(titles[0], 'Beta')
+
+
+@override_settings(REQUEST_TIMING_SAMPLE_RATE=1)
+class RequestTimingMiddlewareTest(TestCase):
+
+	def setUp(self):
+		cache.clear()
+		author = Author.objects.create(first_name='John', last_name='Smith')
+		for i in range(3):
+			Book.objects.create(title='Book %d' % i, summary='My book summary', isbn='ABCDEFG', author=author)
+
+	def test_server_timing_header(self):
+		with self.assertLogs('catalog.timing', 'INFO') as logs:
+			response = self.client.get(reverse('books'))
+		metrics = dict(part.split(';', 1) for part in response['Server-Timing'].split(', '))
+		self.assertEqual(sorted(metrics), ['db', 'total', 'tpl', 'view'])
+		self.assertRegex(metrics['db'], r'^dur=[\d.]+;desc="\d+ queries"$')
+		self.assertEqual(logs.records[0].levelname, 'INFO')
+		self.assertIn('path=/catalog/books/ status=200', logs.output[0])
+		self.assertGreater(logs.records[0].timings['queries'], 0)
+		self.assertGreater(logs.records[0].timings['template_ms'], 0)
+
+	@override_settings(REQUEST_TIMING_THRESHOLDS={'queries': 1})
+	def test_requests_over_a_threshold_are_warnings(self):
+		with self.assertLogs('catalog.timing', 'WARNING') as logs:
+			self.client.get(reverse('books'))
+		self.assertIn('over=queries', logs.output[0])
+
+	def test_streaming_responses_are_measured_once_sent(self):
+		librarian = User.objects.create_user(username='librarian', password='12345')
+		librarian.user_permissions.add(Permission.objects.get(codename='can_mark_returned'))
+		self.client.login(username='librarian', password='12345')
+		with self.assertLogs('catalog.timing', 'INFO') as logs:
+			response = self.client.get(reverse('catalog-export', args=['books', 'csv']))
+			logged_before_the_content = len(logs.records)
+			content = b''.join(response.streaming_content)
+		self.assertEqual(logged_before_the_content, 0)
+		self.assertEqual(len(content.splitlines()), 4)
+		self.assertNotIn('Server-Timing', response)
+		self.assertEqual(len(logs.records), 1)
+		self.assertIn('path=/catalog/export/books.csv status=200', logs.output[0])
+		# The queries made while the content was produced are included
+		self.assertGreater(logs.records[0].timings['queries'], 0)
+
+	@override_settings(REQUEST_TIMING_SAMPLE_RATE=0)
+	def test_unsampled_requests_are_not_measured(self):
+		response = self.client.get(reverse('books'))
+		self.assertNotIn('Server-Timing', response)
+
+
+class ProfilingMiddlewareTest(TestCase):
+
+	def setUp(self):
+		cache.clear()
+		author = Author.objects.create(first_name='John', last_name='Smith')
+		Book.objects.create(title='Book Title', summary='My book summary', isbn='ABCDEFG', author=author)
+		self.staff = User.objects.create_user(username='staff', password='12345', is_staff=True)
+		self.user = User.objects.create_user(username='user', password='12345')
+		self.directory = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, self.directory)
+		profiling_settings = override_settings(REQUEST_PROFILING_DIRECTORY=self.directory, REQUEST_PROFILING_SAMPLE_RATE=0)
+		profiling_settings.enable()
+		self.addCleanup(profiling_settings.disable)
+
+	def test_staff_can_profile_a_request(self):
+		self.client.login(username='staff', password='12345')
+		response = self.client.get(reverse('books') + '?profile=1')
+		self.assertEqual(response.status_code, 200)
+		self.assertContains(response, 'Book Title')
+		name = response['X-Profile']
+		self.assertEqual(sorted(os.listdir(self.directory)),
+			[name + '.allocations.txt', name + '.collapsed', name + '.pstats'])
+		with open(os.path.join(self.directory, name + '.collapsed'), encoding='utf-8') as f:
+			stacks = f.read()
+		# The view is called by the normal handler, and its template rendered, within the profile
+		self.assertIn('base.py:_get_response:', stacks)
+		self.assertIn('views.py:', stacks)
+		self.assertIn('render', stacks)
+		self.assertRegex(stacks.splitlines()[0], r'^\S.* \d+$')
+
+	def test_views_that_raise_are_profiled(self):
+		self.client.login(username='staff', password='12345')
+		response = self.client.get(reverse('book-detail', args=[999999]) + '?profile=1')
+		self.assertEqual(response.status_code, 404)
+		self.assertEqual(len(os.listdir(self.directory)), 3)
+		self.assertIn('X-Profile', response)
+
+	def test_other_users_cannot_profile(self):
+		self.client.login(username='user', password='12345')
+		response = self.client.get(reverse('books') + '?profile=1')
+		self.assertNotIn('X-Profile', response)
+		self.assertEqual(os.listdir(self.directory), [])
+
+	def test_sampled_requests_are_profiled(self):
+		with self.settings(REQUEST_PROFILING_SAMPLE_RATE=1):
+			response = self.client.get(reverse('books'))
+		self.assertIn('X-Profile', response)
+		self.assertEqual(len(os.listdir(self.directory)), 3)
+
+
+class AutocompleteViewTest(OnCommitMixin, TestCase):
+
+	def setUp(self):
+		cache.clear()
+		autocomplete.index.version = None
+		self.tolkien = Author.objects.create(first_name='John', last_name='Tolkien')
+		self.bronte = Author.objects.create(first_name='Émily', last_name='Brontë')
+		self.hobbit = Book.objects.create(title='The Hobbit', summary='My book summary', isbn='ABCDEFG', author=self.tolkien)
+		self.heights = Book.objects.create(title='Wuthering Heights', summary='My book summary', isbn='ABCDEFG', author=self.bronte)
+
+	def lookup(self, **params):
+		resp = self.client.get(reverse('autocomplete'), params)
+		self.assertEqual(resp.status_code, 200)
+		return [(result['kind'], result['label']) for result in resp.json()['results']]
+
+	def test_prefixes(self):
+		self.assertEqual(self.lookup(q='hob'), [('book', 'The Hobbit')])
+		self.assertEqual(self.lookup(q='The  HOB'), [('book', 'The Hobbit')])
+		self.assertEqual(self.lookup(q='bronte'), [('author', 'Brontë, Émily')])
+		self.assertEqual(self.lookup(q='emily b'), [('author', 'Brontë, Émily')])
+		self.assertEqual(self.lookup(q='xyz'), [])
+
+	def test_result(self):
+		resp = self.client.get(reverse('autocomplete'), {'q': 'tolk'})
+		self.assertEqual(resp.json(), {'query': 'tolk', 'results': [
+			{'kind': 'author', 'id': self.tolkien.pk, 'label': 'Tolkien, John', 'url': self.tolkien.get_absolute_url()}]})
+
+	def test_kind_and_limit(self):
+		Book.objects.create(title='Wuthering Heights (abridged)', summary='My book summary', isbn='ABCDEFG')
+		Author.objects.create(first_name='Walt', last_name='Whitman')
+		self.assertEqual(self.lookup(q='w'), [('author', 'Whitman, Walt'), ('book', 'Wuthering Heights'),
+			('book', 'Wuthering Heights (abridged)')])
+		self.assertEqual(self.lookup(q='w', kind='book', limit=1), [('book', 'Wuthering Heights')])
+		resp = self.client.get(reverse('autocomplete'), {'q': 'w', 'kind': 'genre'})
+		self.assertEqual(resp.status_code, 400)
+
+	def test_index_follows_changes_without_rebuilding(self):
+		self.lookup(q='h')
+		with mock.patch.object(autocomplete.index, 'rebuild') as rebuild:
+			self.hobbit.title = 'The Hobbit, or There and Back Again'
+			with self.captureOnCommitCallbacks(execute=True):
+				self.hobbit.save()
+				self.heights.delete()
+				Author.objects.create(first_name='Thomas', last_name='Hardy')
+			self.assertEqual(self.lookup(q='h'), [('author', 'Hardy, Thomas'), ('book', 'The Hobbit, or There and Back Again')])
+		self.assertFalse(rebuild.called)
+
+	def test_lookups_need_no_queries(self):
+		self.lookup(q='h')
+		with self.assertNumQueries(0):
+			self.lookup(q='hob')
+
+	def test_changes_are_only_recorded_once_committed(self):
+		self.lookup(q='h')
+		with self.captureOnCommitCallbacks() as callbacks:
+			Author.objects.create(first_name='Thomas', last_name='Hardy')
+		self.assertEqual(self.lookup(q='hardy'), [])
+		for callback in callbacks:
+			callback()
+		self.assertEqual(self.lookup(q='hardy'), [('author', 'Hardy, Thomas')])
+
+	def test_lookups_do_not_wait_for_a_rebuild(self):
+		self.lookup(q='h')
+		# A new version that can't be caught up on, so the next sync rebuilds
+		cache.set(autocomplete.VERSION_KEY, autocomplete.index.version + autocomplete.MAX_CHANGES + 1, None)
+		loading, release = threading.Event(), threading.Event()
+		rows = autocomplete._rows
+		def slow_rows(*args, **kwargs):
+			loading.set()
+			release.wait(5)
+			return rows(*args, **kwargs)
+		def lookup():
+			try:
+				autocomplete.index.lookup('x')
+			finally:
+				connection.close()
+		with mock.patch.object(autocomplete, '_rows', side_effect=slow_rows):
+			thread = threading.Thread(target=lookup)
+			thread.start()
+			self.assertTrue(loading.wait(5))
+			# Answered from the index as it was, while the other thread loads the new one
+			self.assertEqual(autocomplete.index.lookup('hob'), [('book', self.hobbit.pk, 'The Hobbit')])
+			release.set()
+			thread.join()
+
+
+class BookFormViewTest(TestCase):
+
+	def setUp(self):
+		cache.clear()
+		autocomplete.index.version = None
+		user = User.objects.create_user(username='testuser1', password='12345')
+		user.user_permissions.add(Permission.objects.get(codename='can_modify_book'))
+		self.client.login(username='testuser1', password='12345')
+		self.authors = [Author.objects.create(first_name='John', last_name='Smith%02d' % i) for i in range(5)]
+		self.genres = [Genre.objects.create(name='Genre %02d' % i) for i in range(5)]
+		self.book = Book.objects.create(title='Book Title', summary='My book summary', isbn='ABCDEFG', author=self.authors[3])
+		self.book.genre.set(self.genres[1:3])
+
+	def test_form_renders_only_the_selected_choices(self):
+		resp = self.client.get(reverse('book_update', args=[self.book.pk]))
+		self.assertEqual(resp.status_code, 200)
+		self.assertContains(resp, 'data-lookup-url="%s"' % reverse('picker-choices', args=['authors']))
+		self.assertContains(resp, 'catalog/js/picker.js')
+		self.assertContains(resp, '<option value="%d" selected>Smith03, John</option>' % self.authors[3].pk, html=True)
+		self.assertContains(resp, '<option value="%d" selected>Genre 01</option>' % self.genres[1].pk, html=True)
+		for author in self.authors[:3]:
+			self.assertNotContains(resp, str(author))
+		for genre in self.genres[3:] + self.genres[:1]:
+			self.assertNotContains(resp, genre.name)
+		resp = self.client.get(reverse('book_create'))
+		self.assertEqual(resp.status_code, 200)
+		self.assertNotContains(resp, 'Smith')
+		self.assertNotContains(resp, 'Genre 0')
+
+	def test_post_validates_the_submitted_ids(self):
+		data = {'title': 'New Title', 'summary': 'My book summary', 'isbn': 'ABCDEFG', 'author': self.authors[0].pk,
+			'genre': [self.genres[0].pk, self.genres[4].pk]}
+		resp = self.client.post(reverse('book_update', args=[self.book.pk]), data)
+		self.assertRedirects(resp, self.book.get_absolute_url())
+		self.book.refresh_from_db()
+		self.assertEqual(self.book.author, self.authors[0])
+		self.assertEqual(set(self.book.genre.all()), {self.genres[0], self.genres[4]})
+
+		resp = self.client.post(reverse('book_create'), dict(data, author=999999, genre=[self.genres[0].pk, 999999]))
+		self.assertEqual(resp.status_code, 200)
+		self.assertFormError(resp, 'form', 'author', 'Select a valid choice. That choice is not one of the available choices.')
+		self.assertFormError(resp, 'form', 'genre', 'Select a valid choice. 999999 is not one of the available choices.')
+		# The valid submitted genre is still rendered as selected
+		self.assertContains(resp, '<option value="%d" selected>Genre 00</option>' % self.genres[0].pk, html=True)
+
+	def choices(self, kind, url=None, **params):
+		resp = self.client.get(url or reverse('picker-choices', args=[kind]), params)
+		self.assertEqual(resp.status_code, 200)
+		data = resp.json()
+		return [result['label'] for result in data['results']], data['next']
+
+	def test_choices_are_paginated(self):
+		with mock.patch('catalog.views.PICKER_PAGE_SIZE', 2):
+			labels, next_url = self.choices('authors')
+			self.assertEqual(labels, ['Smith00, John', 'Smith01, John'])
+			labels, next_url = self.choices('authors', next_url)
+			self.assertEqual(labels, ['Smith02, John', 'Smith03, John'])
+			labels, next_url = self.choices('authors', next_url)
+			self.assertEqual((labels, next_url), (['Smith04, John'], None))
+			labels, next_url = self.choices('genres')
+			self.assertEqual(labels, ['Genre 00', 'Genre 01'])
+			self.assertEqual(self.choices('genres', next_url)[0], ['Genre 02', 'Genre 03'])
+
+	def test_choices_search(self):
+		Author.objects.create(first_name='Jane', last_name='Austen')
+		Genre.objects.create(name='Fantasy')
+		self.assertEqual(self.choices('authors', q='aus'), (['Austen, Jane'], None))
+		self.assertEqual(self.choices('authors', q='jane a'), (['Austen, Jane'], None))
+		self.assertEqual(self.choices('genres', q='fan'), (['Fantasy'], None))
+		Genre.objects.create(name='Poésie Française')
+		self.assertEqual(self.choices('genres', q='POESIE  f'), (['Poésie Française'], None))
+		# The search is read from the (name_key, id) index
+		genres = Genre.objects.filter(prefix_filter('name_key', 'fan')).order_by('name_key', 'id')
+		self.assertIn('genre_name_key_id_idx', genres.explain())
+		with mock.patch('catalog.views.PICKER_PAGE_SIZE', 2):
+			labels, next_url = self.choices('authors', q='smith')
+			self.assertEqual(labels, ['Smith00, John', 'Smith01, John'])
+			self.assertEqual(self.choices('authors', next_url)[0], ['Smith02, John', 'Smith03, John'])
+			labels, next_url = self.choices('genres', q='genre')
+			self.assertEqual(self.choices('genres', next_url)[0], ['Genre 02', 'Genre 03'])
+
+	def test_invalid_cursor(self):
+		resp = self.client.get(reverse('picker-choices', args=['genres']), {'cursor': 'nonsense'})
+		self.assertEqual(resp.status_code, 400)
+
+
+class BookSearchViewTest(TestCase):
+
+	@classmethod
+	def setUpTestData(cls):
+		cls.tolkien = Author.objects.create(first_name='John', last_name='Tolkien')
+		cls.austen = Author.objects.create(first_name='Jane', last_name='Austen')
+		cls.hobbit = Book.objects.create(title='The Hobbit', summary='A journey to the Lonely Mountain.', isbn='ABCDEFG', author=cls.tolkien)
+		cls.emma = Book.objects.create(title='Emma', summary='Matchmaking in Highbury, with a hobbit-free plot.', isbn='ABCDEFG', author=cls.austen)
+		for book_num in range(12):
+			Book.objects.create(title='Persuasion %s' % book_num, summary='My book summary', isbn='ABCDEFG', author=cls.austen)
+
+	def test_view_url_accessible_by_name(self):
+		resp = self.client.get(reverse('search'))
+		self.assertEqual(resp.status_code, 200)
+		self.assertTemplateUsed(resp, 'catalog/book_search.html')
+
+	def test_title_match_ranks_first(self):
+		resp = self.client.get(reverse('search'), {'q': 'hobbit'})
+		self.assertEqual(list(resp.context['book_list']), [self.hobbit, self.emma])
+
+	def test_matches_author_name_and_stems(self):
+		resp = self.client.get(reverse('search'), {'q': 'tolkien journeys'})
+		self.assertEqual(list(resp.context['book_list']), [self.hobbit])
+
+	def test_search_syntax_is_ignored(self):
+		resp = self.client.get(reverse('search'), {'q': '("hobbit*'})
+		self.assertEqual(resp.status_code, 200)
+		self.assertEqual(len(resp.context['book_list']), 2)
+
+	def test_results_are_paginated(self):
+		resp = self.client.get(reverse('search'), {'q': 'austen'})
+		self.assertEqual(len(resp.context['book_list']), 10)
+		self.assertTrue(resp.context['has_next'])
+		resp = self.client.get(reverse('search'), {'q': 'austen', 'page': 2})
+		self.assertEqual(len(resp.context['book_list']), 3)
+		self.assertFalse(resp.context['has_next'])
+
+	def test_index_follows_book_and_author_changes(self):
+		# Work on fresh copies, as the class objects are shared between tests
+		hobbit = Book.objects.get(pk=self.hobbit.pk)
+		hobbit.title = 'There and Back Again'
+		hobbit.save()
+		resp = self.client.get(reverse('search'), {'q': 'hobbit'})
+		self.assertEqual(list(resp.context['book_list']), [self.emma])
+
+		tolkien = Author.objects.get(pk=self.tolkien.pk)
+		tolkien.last_name = 'Ronald'
+		tolkien.save()
+		resp = self.client.get(reverse('search'), {'q': 'ronald'})
+		self.assertEqual(list(resp.context['book_list']), [hobbit])
+
+		Book.objects.get(pk=self.emma.pk).delete()
+		tolkien.delete()
+		resp = self.client.get(reverse('search'), {'q': 'hobbit'})
+		self.assertEqual(list(resp.context['book_list']), [])
+		resp = self.client.get(reverse('search'), {'q': 'ronald'})
+		self.assertEqual(list(resp.context['book_list']), [])
 
 
 class AuthorListViewTest(TestCase):
@@ -51,17 +727,40 @@ class AuthorListViewTest(TestCase):
 		self.assertTrue( len(resp.context['author_list']) == 10)
 
 	def test_lists_all_authors(self):
-		#Get second page and confirm it has (exactly) remaining 3 items
-		resp = self.client.get(reverse('authors')+'?page=2')
+		#Follow the next cursor and confirm the second page has (exactly) remaining 3 items
+		resp = self.client.get(reverse('authors'))
+		resp = self.client.get(reverse('authors')+'?'+resp.context['page_obj'].next_query_string)
 		self.assertEqual(resp.status_code, 200)
 		self.assertTrue('is_paginated' in resp.context)
 		self.assertTrue(resp.context['is_paginated'] == True)
 		self.assertTrue( len(resp.context['author_list']) == 3)
+		self.assertFalse(resp.context['page_obj'].has_next())
+
+	def test_previous_cursor_returns_first_page(self):
+		resp = self.client.get(reverse('authors'))
+		first_page = list(resp.context['author_list'])
+		resp = self.client.get(reverse('authors')+'?'+resp.context['page_obj'].next_query_string)
+		resp = self.client.get(reverse('authors')+'?'+resp.context['page_obj'].previous_query_string)
+		self.assertEqual(list(resp.context['author_list']), first_page)
+		self.assertFalse(resp.context['page_obj'].has_previous())
+
+	def test_pages_skip_the_total_count(self):
+		# The last modified lookups (MAX(updated_at) and the statistics row), then
+		# the page (and whether there is a next one) as a single query, with no COUNT(*)
+		with self.assertNumQueries(3) as queries:
+			resp = self.client.get(reverse('authors'))
+		self.assertFalse([query for query in queries.captured_queries if 'COUNT(' in query['sql']])
+		self.assertIsNone(resp.context['paginator'].count)
+
+	def test_invalid_cursor_is_404(self):
+		resp = self.client.get(reverse('authors')+'?cursor=not-a-cursor')
+		self.assertEqual(resp.status_code, 404)
 
 
 class AuthorCreateViewTest(TestCase):
 
 	def setUp(self):
+		cache.clear()
 		#Create a user
 		test_user1 = User.objects.create_user(username='testuser1', password='12345')
 		test_user1.save()
@@ -289,10 +988,364 @@ class LoanedBookInstancesByUserListViewTest(TestCase):
 			else:
 				self.assertTrue(last_date <= copy.due_back)
 
+	def test_cursor_pages_cover_every_loan_once(self):
+		# Due dates repeat, so this relies on the id tiebreaker
+		BookInstance.objects.all().update(status='o')
+		undated = BookInstance.objects.filter(borrower__username='testuser1').values_list('id', flat=True)[:2]
+		BookInstance.objects.filter(id__in=list(undated)).update(due_back=None)
+		login = self.client.login(username='testuser1', password='12345')
+		seen = []
+		url = reverse('my-borrowed')
+		while url:
+			resp = self.client.get(url)
+			self.assertEqual(resp.status_code, 200)
+			seen.extend(copy.id for copy in resp.context['bookinstance_list'])
+			page = resp.context['page_obj']
+			url = reverse('my-borrowed')+'?'+page.next_query_string if page.has_next() else None
+		self.assertEqual(len(seen), 15)
+		self.assertEqual(set(seen), set(BookInstance.objects.filter(borrower__username='testuser1').values_list('id', flat=True)))
+
+
+class AllLoanedBooksListViewTest(TestCase):
+
+	def setUp(self):
+		cache.clear()
+		test_user = User.objects.create_user(username='testuser1', password='12345')
+		test_user.user_permissions.add(Permission.objects.get(name='Set book as returned'))
+		self.client.login(username='testuser1', password='12345')
+		test_book = Book.objects.create(title='Book Title', summary='My book summary', isbn='ABCDEFG')
+		today = datetime.date.today()
+		for days in range(-3, 3):
+			BookInstance.objects.create(book=test_book, imprint='Unlikely Imprint, 2016', status='o',
+				due_back=today + datetime.timedelta(days=days), borrower=test_user)
+		# Overdue, but not on loan
+		BookInstance.objects.create(book=test_book, imprint='Unlikely Imprint, 2016', status='r',
+			due_back=today - datetime.timedelta(days=5))
+
+	def test_overdue_count_and_highlight(self):
+		resp = self.client.get(reverse('all-borrowed'))
+		self.assertEqual(resp.context['num_overdue'], 3)
+		self.assertFalse(resp.context['overdue_only'])
+		self.assertEqual(len(resp.context['bookinstance_list']), 6)
+		self.assertContains(resp, 'class="text-danger"', count=3)
+
+	def test_overdue_only(self):
+		resp = self.client.get(reverse('all-borrowed'), {'overdue': '1'})
+		self.assertTrue(resp.context['overdue_only'])
+		loans = resp.context['bookinstance_list']
+		self.assertEqual(len(loans), 3)
+		self.assertTrue(all(loan.overdue for loan in loans))
+
+	def count_queries(self):
+		with CaptureQueriesContext(connection) as queries:
+			resp = self.client.get(reverse('all-borrowed'))
+		self.assertEqual(resp.status_code, 200)
+		return len(queries), len(resp.context['bookinstance_list'])
+
+	def test_queries_do_not_grow_with_loans(self):
+		self.count_queries() # Caches the user's permissions
+		num_queries, num_listed = self.count_queries()
+		# More overdue and current loans, each of a different book
+		borrower = User.objects.get(username='testuser1')
+		today = datetime.date.today()
+		for days in range(-4, 4):
+			book = Book.objects.create(title='Book %d' % days, summary='My book summary', isbn='ABCDEFG')
+			BookInstance.objects.create(book=book, imprint='Unlikely Imprint, 2016', status='o',
+				due_back=today + datetime.timedelta(days=days), borrower=borrower)
+		self.assertEqual(self.count_queries(), (num_queries, 10))
+		self.assertEqual(num_listed, 6)
+
+
+class BulkLoansViewTest(OnCommitMixin, TestCase):
+
+	def setUp(self):
+		cache.clear()
+		self.borrower = User.objects.create_user(username='testuser1', password='12345')
+		librarian = User.objects.create_user(username='testuser2', password='12345')
+		librarian.user_permissions.add(Permission.objects.get(name='Set book as returned'),
+			Permission.objects.get(name='Renew the book for an extended lease'))
+		self.client.login(username='testuser2', password='12345')
+		test_book = Book.objects.create(title='Book Title', summary='My book summary', isbn='ABCDEFG')
+		self.loans = [BookInstance.objects.create(book=test_book, imprint='Unlikely Imprint, 2016', status='o',
+			due_back=datetime.date.today(), borrower=self.borrower) for i in range(3)]
+		self.available = BookInstance.objects.create(book=test_book, imprint='Unlikely Imprint, 2016', status='a')
+		self.unknown = '00000000-0000-0000-0000-000000000000'
+
+	def post(self, action, ids, renewal_date=None):
+		data = {'action': action, 'instances': '\n'.join(str(pk) for pk in ids)}
+		if renewal_date is not None:
+			data['renewal_date'] = renewal_date
+		return self.client.post(reverse('bulk-loans-librarian'), data)
+
+	def test_return_reports_each_copy(self):
+		ids = [loan.pk for loan in self.loans] + [self.available.pk, self.unknown, 'not-an-id']
+		with CaptureQueriesContext(connection) as queries:
+			resp = self.post('return', ids)
+		self.assertEqual(resp.status_code, 200)
+		updates = [query for query in queries.captured_queries
+			if query['sql'].startswith('UPDATE "catalog_bookinstance"')]
+		self.assertEqual(len(updates), 1)
+		self.assertEqual(resp.context['results'], [(str(loan.pk), 'returned') for loan in self.loans] + [
+			(str(self.available.pk), 'not on loan'), (self.unknown, 'not found'), ('not-an-id', 'invalid id')])
+		self.assertFalse(BookInstance.objects.filter(status='o').exists())
+		self.assertFalse(BookInstance.objects.filter(borrower__isnull=False).exists())
+		self.assertEqual(CatalogStats.load().num_instances_available, 4)
+
+	def test_renew(self):
+		renewal_date = datetime.date.today() + datetime.timedelta(weeks=2)
+		resp = self.post('renew', [self.loans[0].pk, self.available.pk], renewal_date)
+		self.assertEqual(resp.context['results'], [(str(self.loans[0].pk), 'renewed'), (str(self.available.pk), 'not on loan')])
+		self.assertEqual(BookInstance.objects.get(pk=self.loans[0].pk).due_back, renewal_date)
+		self.assertEqual(BookInstance.objects.get(pk=self.loans[1].pk).due_back, datetime.date.today())
+
+	def test_renewal_date_rules(self):
+		resp = self.post('renew', [self.loans[0].pk], datetime.date.today() + datetime.timedelta(weeks=5))
+		self.assertFormError(resp, 'form', 'renewal_date', 'Invalid date - renewal more than 4 weeks ahead')
+		self.assertIsNone(resp.context['results'])
+		self.assertEqual(BookInstance.objects.get(pk=self.loans[0].pk).due_back, datetime.date.today())
+
+	def test_renew_needs_permission(self):
+		self.client.login(username='testuser1', password='12345')
+		self.assertEqual(self.post('return', [self.loans[0].pk]).status_code, 302)
+		with self.captureOnCommitCallbacks(execute=True):
+			self.borrower.user_permissions.add(Permission.objects.get(name='Set book as returned'))
+		self.assertEqual(self.post('renew', [self.loans[0].pk], datetime.date.today()).status_code, 403)
+
+	def test_admin_return_action(self):
+		User.objects.create_superuser(username='admin', email='admin@example.com', password='12345')
+		self.client.login(username='admin', password='12345')
+		resp = self.client.post(reverse('admin:catalog_bookinstance_changelist'), {'action': 'return_loans',
+			'_selected_action': [str(self.loans[0].pk), str(self.available.pk)]}, follow=True)
+		self.assertContains(resp, '1 not on loan, 1 returned')
+		self.assertEqual(BookInstance.objects.get(pk=self.loans[0].pk).status, 'a')
+
+
+class LoanViewTest(OnCommitMixin, TestCase):
+
+	def setUp(self):
+		cache.clear()
+		self.borrower = User.objects.create_user(username='testuser1', password='12345')
+		self.librarian = User.objects.create_user(username='testuser2', password='12345')
+		self.librarian.user_permissions.add(Permission.objects.get(name='Set book as returned'))
+		author = Author.objects.create(first_name='John', last_name='Smith')
+		self.book = Book.objects.create(title='Book Title', summary='My book summary', isbn='ABCDEFG', author=author)
+		self.copy = BookInstance.objects.create(book=self.book, imprint='Unlikely Imprint, 2016', status='a')
+		self.due_back = datetime.date.today() + datetime.timedelta(weeks=2)
+
+	def lend(self, username='testuser1'):
+		return self.client.post(reverse('checkout-book-librarian', args=[self.copy.pk]),
+			{'borrower': username, 'due_back': self.due_back})
+
+	def test_lend_requires_permission(self):
+		self.client.login(username='testuser1', password='12345')
+		response = self.lend()
+		self.assertEqual(response.status_code, 302)
+		self.assertTrue(response.url.startswith('/accounts/login/'))
+		self.assertEqual(BookInstance.objects.get(pk=self.copy.pk).status, 'a')
+
+	def test_lend_and_return(self):
+		self.client.login(username='testuser2', password='12345')
+		response = self.client.get(reverse('checkout-book-librarian', args=[self.copy.pk]))
+		self.assertEqual(response.status_code, 200)
+		self.assertTemplateUsed(response, 'catalog/bookinstance_loan_form.html')
+		self.assertEqual(response.context['form'].initial['due_back'], datetime.date.today() + datetime.timedelta(weeks=3))
+
+		self.assertRedirects(self.lend(), reverse('all-borrowed'))
+		copy = BookInstance.objects.get(pk=self.copy.pk)
+		self.assertEqual((copy.status, copy.borrower, copy.due_back), ('o', self.borrower, self.due_back))
+		self.assertEqual(CatalogStats.load().num_instances_available, 0)
+		book = Book.objects.get(pk=self.book.pk)
+		self.assertEqual((book.num_available, book.num_on_loan), (0, 1))
+
+		self.assertRedirects(self.client.post(reverse('return-book-librarian', args=[self.copy.pk])), reverse('all-borrowed'))
+		copy = BookInstance.objects.get(pk=self.copy.pk)
+		self.assertEqual((copy.status, copy.borrower, copy.due_back), ('a', None, None))
+		self.assertEqual(CatalogStats.load().num_instances_available, 1)
+
+	def test_lend_unknown_borrower(self):
+		self.client.login(username='testuser2', password='12345')
+		response = self.lend('nobody')
+		self.assertEqual(response.status_code, 200)
+		self.assertFormError(response, 'form', 'borrower', 'There is no borrower with that username')
+
+	def test_lend_copy_on_loan_is_a_conflict(self):
+		self.client.login(username='testuser2', password='12345')
+		self.lend()
+		response = self.lend('testuser2')
+		self.assertEqual(response.status_code, 409)
+		self.assertEqual(response.context['error'], 'This copy is already on loan.')
+		self.assertEqual(BookInstance.objects.get(pk=self.copy.pk).borrower, self.borrower)
+
+	def test_return_copy_not_on_loan_is_a_conflict(self):
+		self.client.login(username='testuser2', password='12345')
+		response = self.client.post(reverse('return-book-librarian', args=[self.copy.pk]))
+		self.assertEqual(response.status_code, 409)
+		self.assertEqual(CatalogStats.load().num_instances_available, 1)
+
+	def test_reserve_then_lend_to_the_same_borrower(self):
+		self.client.login(username='testuser1', password='12345')
+		response = self.client.post(reverse('reserve-book', args=[self.copy.pk]))
+		self.assertRedirects(response, reverse('book-detail', args=[self.book.pk]))
+		copy = BookInstance.objects.get(pk=self.copy.pk)
+		self.assertEqual((copy.status, copy.borrower), ('r', self.borrower))
+		self.assertEqual(CatalogStats.load().num_instances_available, 0)
+
+		# Reserved for testuser1, so it can't be lent to anyone else
+		self.client.login(username='testuser2', password='12345')
+		self.assertEqual(self.lend('testuser2').status_code, 409)
+		self.assertRedirects(self.lend(), reverse('all-borrowed'))
+		self.assertEqual(BookInstance.objects.get(pk=self.copy.pk).status, 'o')
+		self.assertEqual(CatalogStats.load().num_instances_available, 0)
+
+	def test_reserve_updates_the_cached_book_page(self):
+		self.client.login(username='testuser1', password='12345')
+		response = self.client.get(reverse('book-detail', args=[self.book.pk]))
+		self.assertContains(response, reverse('reserve-book', args=[self.copy.pk]))
+		with self.captureOnCommitCallbacks(execute=True):
+			self.client.post(reverse('reserve-book', args=[self.copy.pk]))
+		response = self.client.get(reverse('book-detail', args=[self.book.pk]))
+		self.assertNotContains(response, reverse('reserve-book', args=[self.copy.pk]))
+		self.assertContains(response, 'Reserved')
+
+	def test_missing_copy(self):
+		self.client.login(username='testuser2', password='12345')
+		response = self.client.post(reverse('return-book-librarian', args=['00000000-0000-0000-0000-000000000000']))
+		self.assertEqual(response.status_code, 404)
+
+
+class LoanConcurrencyTest(TransactionTestCase):
+	"""
+	Many threads try to lend the same copies at once. Each copy must be lent
+	exactly once, however the attempts interleave. The threads open their own
+	connections, so the test settings give SQLite a file test database.
+	The throughput is measured by benchmarks/loan_stress.py.
+	"""
+	THREADS = 8
+	COPIES = 20
+
+	def setUp(self):
+		self.users = [User.objects.create_user(username='user%d' % i) for i in range(self.THREADS)]
+		self.book = book = Book.objects.create(title='Book Title', summary='My book summary', isbn='ABCDEFG')
+		self.copies = [BookInstance.objects.create(book=book, imprint='Unlikely Imprint, 2016', status='a').pk
+			for i in range(self.COPIES)]
+
+	def test_no_double_loans(self):
+		results = stress_checkouts(self.copies, self.users)
+		self.assertEqual(sorted(pk for pk, user in results.loans), sorted(self.copies))
+		self.assertEqual(results.conflicts, self.COPIES * (self.THREADS - 1))
+		self.assertEqual(results.errors, [])
+		borrowers = dict(results.loans)
+		for copy in BookInstance.objects.filter(pk__in=self.copies):
+			self.assertEqual((copy.status, copy.borrower_id), ('o', borrowers[copy.pk].pk))
+		self.assertEqual(CatalogStats.load().num_instances_available, 0)
+		book = Book.objects.get(pk=self.book.pk)
+		self.assertEqual((book.num_available, book.num_on_loan), (0, self.COPIES))
+
+
+class ExportCatalogViewTest(TestCase):
+
+	def setUp(self):
+		cache.clear()
+		test_user1 = User.objects.create_user(username='testuser1', password='12345')
+		test_user2 = User.objects.create_user(username='testuser2', password='12345')
+		test_user2.user_permissions.add(Permission.objects.get(name='Set book as returned'))
+
+		test_author = Author.objects.create(first_name='John', last_name='Smith')
+		self.test_book = Book.objects.create(title='Book Title', summary='My book summary', isbn='ABCDEFG', author=test_author)
+		self.test_book.genre.set([Genre.objects.create(name='Fantasy'), Genre.objects.create(name='Horror')])
+		Book.objects.create(title='No Genres', summary='My book summary', isbn='ABCDEFG', author=test_author)
+		BookInstance.objects.create(book=self.test_book, imprint='Unlikely Imprint, 2016', status='o',
+			due_back=datetime.date.today(), borrower=test_user1)
+
+	def test_only_for_librarians(self):
+		url = reverse('catalog-export', args=['books', 'csv'])
+		self.assertRedirects(self.client.get(url), '/accounts/login/?next=%s' % url)
+		self.client.login(username='testuser1', password='12345')
+		self.assertEqual(self.client.get(url).status_code, 302)
+
+	def test_books_csv(self):
+		self.client.login(username='testuser2', password='12345')
+		resp = self.client.get(reverse('catalog-export', args=['books', 'csv']))
+		self.assertEqual(resp.status_code, 200)
+		self.assertTrue(resp.streaming)
+		self.assertEqual(resp['Content-Type'], 'text/csv')
+		self.assertIn('attachment', resp['Content-Disposition'])
+		lines = b''.join(resp.streaming_content).decode('utf-8').splitlines()
+		self.assertEqual(lines[0], 'id,title,summary,isbn,author_first_name,author_last_name,genres')
+		self.assertEqual(lines[1], '%d,Book Title,My book summary,ABCDEFG,John,Smith,Fantasy|Horror' % self.test_book.pk)
+		self.assertTrue(lines[2].endswith(',No Genres,My book summary,ABCDEFG,John,Smith,'))
+
+	def test_copies_json_lines(self):
+		self.client.login(username='testuser2', password='12345')
+		resp = self.client.get(reverse('catalog-export', args=['copies', 'jsonl']))
+		rows = [json.loads(line) for line in b''.join(resp.streaming_content).decode('utf-8').splitlines()]
+		self.assertEqual(len(rows), 1)
+		self.assertEqual(rows[0]['title'], 'Book Title')
+		self.assertEqual(rows[0]['status'], 'o')
+		self.assertEqual(rows[0]['borrower'], 'testuser1')
+		self.assertEqual(rows[0]['due_back'], datetime.date.today().isoformat())
+
+
+class CatalogApiTest(TestCase):
+
+	@classmethod
+	def setUpTestData(cls):
+		cls.test_author = Author.objects.create(first_name='John', last_name='Smith')
+		cls.test_genre = Genre.objects.create(name='Fantasy')
+		for book_num in range(25):
+			book = Book.objects.create(title='Book %02d' % book_num, summary='My book summary', isbn='ABCDEFG', author=cls.test_author)
+			book.genre.set([cls.test_genre])
+		cls.test_book = book
+		borrower = User.objects.create_user(username='testuser1', password='12345')
+		BookInstance.objects.create(book=book, imprint='Unlikely Imprint, 2016', status='a')
+		BookInstance.objects.create(book=book, imprint='Unlikely Imprint, 2016', status='o', borrower=borrower,
+			due_back=datetime.date.today())
+
+	def test_book_list_pages(self):
+		# The page, then the genres of its books
+		with self.assertNumQueries(2):
+			resp = self.client.get(reverse('api:books-list'))
+		self.assertEqual(resp.status_code, 200)
+		data = resp.json()
+		self.assertEqual(len(data['results']), 20)
+		self.assertEqual(data['results'][0], {'id': data['results'][0]['id'], 'title': 'Book 00', 'isbn': 'ABCDEFG',
+			'author': self.test_author.pk, 'author_first_name': 'John', 'author_last_name': 'Smith',
+			'genres': [self.test_genre.pk]})
+		self.assertIsNone(data['previous'])
+		data = self.client.get(data['next']).json()
+		self.assertEqual([book['title'] for book in data['results']], ['Book %02d' % n for n in range(20, 25)])
+		self.assertIsNone(data['next'])
+		self.assertIsNotNone(data['previous'])
+
+	def test_sparse_fields(self):
+		data = self.client.get(reverse('api:books-detail', args=[self.test_book.pk]), {'fields': 'title,copies_available'}).json()
+		self.assertEqual(data, {'id': self.test_book.pk, 'title': 'Book 24', 'copies_available': 1})
+		resp = self.client.get(reverse('api:books-list'), {'fields': 'title,borrower'})
+		self.assertEqual(resp.status_code, 400)
+		self.assertEqual(resp.json(), {'error': 'Unknown fields: borrower'})
+
+	def test_author_books(self):
+		data = self.client.get(reverse('api:authors-detail', args=[self.test_author.pk]), {'fields': 'books'}).json()
+		self.assertEqual(len(data['books']), 25)
+
+	def test_copy_availability(self):
+		data = self.client.get(reverse('api:copies-list'), {'book': self.test_book.pk, 'status': 'a'}).json()
+		self.assertEqual(len(data['results']), 1)
+		self.assertEqual(data['results'][0]['status'], 'a')
+		self.assertNotIn('borrower', data['results'][0])
+
+	def test_errors(self):
+		self.assertEqual(self.client.get(reverse('api:books-detail', args=[0])).status_code, 404)
+		self.assertEqual(self.client.get(reverse('api:copies-detail', args=['not-a-uuid'])).status_code, 404)
+		self.assertEqual(self.client.get(reverse('api:books-list'), {'author': 'x'}).status_code, 400)
+		self.assertEqual(self.client.get(reverse('api:books-list'), {'cursor': 'x'}).status_code, 400)
+		self.assertEqual(self.client.post(reverse('api:books-list')).status_code, 405)
+
 
 class RenewBookInstancesViewTest(TestCase):
 
 	def setUp(self):
+		cache.clear()
 		#Create a user
 		test_user1 = User.objects.create_user(username='testuser1', password='12345')
 		test_user1.save()
@@ -0,0 +1,23 @@
+from contextlib import contextmanager
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+class OnCommitMixin(object):
+	"""
+	TestCase mixin with a backport of Django 3.2's captureOnCommitCallbacks().
+	TestCase runs each test in a transaction that is never committed, so the
+	transaction.on_commit() callbacks (e.g. the cache invalidation in
+	catalog/fragments.py) never run by themselves. With execute=True the ones
+	registered in the block are run at its end, as the commit would.
+	"""
+	@contextmanager
+	def captureOnCommitCallbacks(self, using=DEFAULT_DB_ALIAS, execute=False):
+		callbacks = []
+		start = len(connections[using].run_on_commit)
+		try:
+			yield callbacks
+		finally:
+			callbacks[:] = [func for sids, func in connections[using].run_on_commit[start:]]
+			if execute:
+				for callback in callbacks:
+					callback()
@@ -0,0 +1,31 @@
+import unicodedata
+from django.db.models import Q
+
+# Normalized text for prefix lookups: the autocomplete index (see
+# catalog/autocomplete.py) and the genres' name_key column, searched by the
+# genre picker. Both sides of a lookup are normalized, so the comparison itself
+# can be a plain (case-sensitive) one, which an ordinary index can answer.
+
+
+def normalize(text):
+	"""
+	Returns the key text is indexed or looked up by: lower case, without
+	accents, and with single spaces between words.
+	"""
+	text = unicodedata.normalize('NFKD', text or '')
+	text = ''.join(c for c in text if not unicodedata.combining(c))
+	return ' '.join(text.casefold().split())
+
+
+def prefix_filter(field, prefix):
+	"""
+	Returns the filter for the rows whose (normalized) field starts with the
+	(normalized) prefix. The range (prefix <= field < the prefix with its last
+	character incremented) is what the database reads from an index on the
+	field, whatever its LIKE does with case; the startswith keeps the result
+	exact under collations that don't compare character by character.
+	"""
+	condition = Q(**{'%s__gte' % field: prefix, '%s__startswith' % field: prefix})
+	if prefix and ord(prefix[-1]) < 0x10FFFF:
+		condition &= Q(**{'%s__lt' % field: prefix[:-1] + chr(ord(prefix[-1]) + 1)})
+	return condition
@@ -0,0 +1,194 @@
+import logging
+import random
+import threading
+import time
+from contextlib import ExitStack
+from django.conf import settings
+from django.db import connections
+from django.template.backends.django import Template
+from django.utils.encoding import iri_to_uri
+
+# Per-request instrumentation (RequestTimingMiddleware). For a sample of the
+# requests it measures the total time, the number of queries and the time
+# spent in the database (with a database execute wrapper), and the time spent
+# rendering templates. The times are sent back in a Server-Timing header (shown
+# by the browser's developer tools), and logged as one line per request to the
+# 'catalog.timing' logger: a warning if the request went over any of the
+# REQUEST_TIMING_THRESHOLDS, otherwise info.
+# Requests that aren't sampled cost one random number, so the middleware can
+# be left on in production with a low REQUEST_TIMING_SAMPLE_RATE.
+# The body of a streaming response (e.g. the catalog export) is produced after
+# the view returns, so its measurements carry on while the content is iterated
+# and the request is logged once it has all been sent. Its headers are sent
+# before then, so it has no Server-Timing header.
+
+logger = logging.getLogger('catalog.timing')
+
+# Limits above which a request is logged as a warning
+DEFAULT_THRESHOLDS = {'queries': 20, 'db_ms': 500, 'total_ms': 1000}
+
+# The timings of the request being handled by this thread (if it is sampled)
+_current = threading.local()
+
+
+class RequestTimings(object):
+	"""
+	The measurements for one request. Also the database execute wrapper that
+	counts and times the queries.
+	"""
+	def __init__(self):
+		self.queries = 0
+		self.db_seconds = 0.0
+		self.template_seconds = 0.0
+		self.total_seconds = 0.0
+
+	def __call__(self, execute, sql, params, many, context):
+		started = time.perf_counter()
+		try:
+			return execute(sql, params, many, context)
+		finally:
+			self.db_seconds += time.perf_counter() - started
+			self.queries += 1
+
+	def as_dict(self):
+		"""
+		Returns the measurements in milliseconds. The view time is everything
+		but the template rendering (so it includes the view's queries).
+		"""
+		return {
+			'total_ms': round(self.total_seconds * 1000, 3),
+			'view_ms': round((self.total_seconds - self.template_seconds) * 1000, 3),
+			'db_ms': round(self.db_seconds * 1000, 3),
+			'template_ms': round(self.template_seconds * 1000, 3),
+			'queries': self.queries,
+		}
+
+
+def _timed_render(render):
+	"""
+	Wraps the Django template backend's Template.render to add the time taken
+	to the current request's timings. Templates included by another are
+	rendered within its render() call, so they aren't counted twice.
+	"""
+	def timed_render(self, *args, **kwargs):
+		timings = getattr(_current, 'timings', None)
+		if timings is None:
+			return render(self, *args, **kwargs)
+		started = time.perf_counter()
+		try:
+			return render(self, *args, **kwargs)
+		finally:
+			timings.template_seconds += time.perf_counter() - started
+	timed_render.untimed = render
+	return timed_render
+
+
+def install_template_timer():
+	if not hasattr(Template.render, 'untimed'):
+		Template.render = _timed_render(Template.render)
+
+
+def server_timing(metrics):
+	"""
+	Returns the Server-Timing header value for the measurements.
+	"""
+	return ', '.join([
+		'total;dur=%.3f' % metrics['total_ms'],
+		'view;dur=%.3f' % metrics['view_ms'],
+		'db;dur=%.3f;desc="%d queries"' % (metrics['db_ms'], metrics['queries']),
+		'tpl;dur=%.3f' % metrics['template_ms'],
+	])
+
+
+class MeasuredStream(object):
+	"""
+	Wraps the content of a streaming response so that its queries and
+	templates are measured as it is iterated. finish() is called once, when
+	the content is exhausted or closed (the server closes the response even if
+	the client goes away).
+	"""
+	def __init__(self, content, timings, finish):
+		self.content = iter(content)
+		self.timings = timings
+		self.finish = finish
+
+	def __iter__(self):
+		return self
+
+	def __next__(self):
+		_current.timings = self.timings
+		try:
+			return next(self.content)
+		except StopIteration:
+			self.close()
+			raise
+		finally:
+			_current.timings = None
+
+	def close(self):
+		if self.finish is None:
+			return
+		finish, self.finish = self.finish, None
+		try:
+			if hasattr(self.content, 'close'):
+				self.content.close()
+		finally:
+			finish()
+
+
+class RequestTimingMiddleware(object):
+	"""
+	Measures a sample of the requests (see the top of this module). Settings:
+	REQUEST_TIMING_SAMPLE_RATE (the fraction of requests measured, 1 by
+	default), REQUEST_TIMING_THRESHOLDS (e.g. {'queries': 20, 'db_ms': 500,
+	'total_ms': 1000}) and REQUEST_TIMING_HEADER (whether to send the
+	Server-Timing header, True by default).
+	"""
+	def __init__(self, get_response):
+		self.get_response = get_response
+		install_template_timer()
+
+	def __call__(self, request):
+		if random.random() >= getattr(settings, 'REQUEST_TIMING_SAMPLE_RATE', 1.0):
+			return self.get_response(request)
+
+		timings = _current.timings = RequestTimings()
+		started = time.perf_counter()
+		with ExitStack() as stack:
+			try:
+				for connection in connections.all():
+					stack.enter_context(connection.execute_wrapper(timings))
+				response = self.get_response(request)
+			finally:
+				_current.timings = None
+			if response.streaming:
+				# Keep the execute wrappers until the content has been sent
+				wrappers = stack.pop_all()
+				def finish():
+					wrappers.close()
+					timings.total_seconds = time.perf_counter() - started
+					self.log(request, response, timings.as_dict())
+				response.streaming_content = MeasuredStream(response.streaming_content, timings, finish)
+				return response
+		timings.total_seconds = time.perf_counter() - started
+
+		metrics = timings.as_dict()
+		if getattr(settings, 'REQUEST_TIMING_HEADER', True):
+			response['Server-Timing'] = server_timing(metrics)
+		self.log(request, response, metrics)
+		return response
+
+	def log(self, request, response, metrics):
+		"""
+		Logs one line of key=value pairs for the request, as a warning (naming
+		the limits it went over) if it went over any of the thresholds.
+		"""
+		thresholds = getattr(settings, 'REQUEST_TIMING_THRESHOLDS', DEFAULT_THRESHOLDS)
+		over = sorted(name for name, limit in thresholds.items() if metrics.get(name, 0) > limit)
+		fields = ['method=%s' % request.method, 'path=%s' % iri_to_uri(request.path), 'status=%d' % response.status_code]
+		fields += ['%s=%s' % (name, metrics[name]) for name in ('total_ms', 'view_ms', 'db_ms', 'template_ms', 'queries')]
+		if over:
+			fields.append('over=%s' % ','.join(over))
+			logger.warning(' '.join(fields), extra={'timings': metrics})
+		else:
+			logger.info(' '.join(fields), extra={'timings': metrics})
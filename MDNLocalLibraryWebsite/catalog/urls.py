@@ -1,6 +1,6 @@
-from django.conf.urls import url
+from django.conf.urls import include, url
 
-from . import views
+from . import views, api
 
 # NB: The generic view class expects paramters with certain names,
 # for example, pk for primary key.
@@ -8,11 +8,20 @@ urlpatterns = [
 	url(r'^$', views.index, name='index'),
 	url(r'^books/$', views.BookListView.as_view(), name='books'),
 	url(r'^book/(?P<pk>\d+)$', views.BookDetailView.as_view(), name='book-detail'),
+	url(r'^search/$', views.book_search, name='search'),
+	url(r'^autocomplete/$', views.catalog_autocomplete, name='autocomplete'),
+	url(r'^choices/(?P<kind>authors|genres)/$', views.picker_choices, name='picker-choices'),
+	url(r'^api/', include((api.urlpatterns, 'api'))),
 	url(r'^authors/$', views.AuthorListView.as_view(), name='authors'),
 	url(r'^author/(?P<pk>\d+)$', views.AuthorDetailView.as_view(), name='author-detail'),
 	url(r'^mybooks/$', views.LoanedBooksByUserListView.as_view(), name='my-borrowed'),
 	url(r'^borrowed/$', views.AllLoanedBooksByUserListView.as_view(), name='all-borrowed'),
 	url(r'^book/(?P<pk>[-\w]+)/renew/$', views.renew_book_librarian, name='renew-book-librarian'),
+	url(r'^book/(?P<pk>[-\w]+)/lend/$', views.checkout_book_librarian, name='checkout-book-librarian'),
+	url(r'^book/(?P<pk>[-\w]+)/return/$', views.return_book_librarian, name='return-book-librarian'),
+	url(r'^book/(?P<pk>[-\w]+)/reserve/$', views.reserve_book, name='reserve-book'),
+	url(r'^borrowed/bulk/$', views.bulk_loans_librarian, name='bulk-loans-librarian'),
+	url(r'^export/(?P<kind>books|authors|copies)\.(?P<format>csv|jsonl)$', views.export_catalog, name='catalog-export'),
 	
 	url(r'^author/create/$', views.AuthorCreate.as_view(), name='author_create'),
 	url(r'^author/(?P<pk>\d+)/update/$', views.AuthorUpdate.as_view(), name='author_update'),
@@ -1,7 +1,7 @@
 import datetime
 from django.views.generic.edit import CreateView, UpdateView, DeleteView # Django Generic Editing Views
 from django.shortcuts import render, get_object_or_404
-from django.http import HttpResponseRedirect
+from django.http import HttpResponseRedirect, JsonResponse, StreamingHttpResponse
 from django.views import generic
 from django.forms import ModelForm
 from django.utils.translation import ugettext_lazy as _ # Django translation function
@@ -9,9 +9,18 @@ from django.utils.translation import ugettext_lazy as _ # Django translation fun
 from django.urls import reverse
 from django.urls import reverse_lazy
 from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin # Only an authenicated user can access the view
-from .models import Book, Author, BookInstance, Genre
-from .forms import RenewBookForm
-from django.core.exceptions import ValidationError
+from .models import Book, Author, BookInstance, Genre, CatalogStats
+from .forms import RenewBookForm, SearchForm, AutocompleteForm, BulkLoanForm, CheckoutForm, BookForm
+from .pagination import CursorPaginationMixin, CursorPaginator, InvalidCursor
+from .search import search_books
+from .text import normalize, prefix_filter
+from . import visits, export, loans, autocomplete
+from .fragments import CachedFragmentMixin
+from .conditional import (catalog_condition, index_last_modified, book_last_modified, author_last_modified,
+	book_list_last_modified, author_list_last_modified, loan_list_last_modified)
+from django.utils.decorators import method_decorator
+from django.utils.http import urlencode
+from django.core.exceptions import ValidationError, PermissionDenied
 
 # Views proccess HTTP requests, request data from the database,
 # generate HTML pages by rendering templates, and return HTML in
@@ -21,38 +30,52 @@ def index(request):
 	"""
 	View function for home page of site.
 	"""
-	# Generate counts of some of the main objects
-	num_books = Book.objects.all().count()
-	num_instances = BookInstance.objects.all().count()
-	# Available books (status = 'a')
-	num_instances_available = BookInstance.objects.filter(status__exact='a').count()
-	num_authors = Author.objects.count()  # The 'all()' is implied by default.
-	num_genres = Genre.objects.distinct().count()
-	filter_word = "Nac"
-	num_books_word = Book.objects.filter(title__icontains=filter_word).count()
-
-	# Number of visits to this view, as counted in the session variable.
-	num_visits = request.session.get('num_visits', 0)
-	request.session['num_visits'] = num_visits + 1
+	# Number of previous visits to this view. Visits are counted in the cache and
+	# written to the database in batches, so this doesn't save the session.
+	# The visit is counted even if the browser's copy of the page is up to date
+	# (although that copy shows the count from when it was rendered).
+	visitor, new_visitor = visits.get_visitor(request)
+	num_visits = visits.counter.record(visitor) - 1
+
+	response = index_page(request, num_visits)
+	if new_visitor:
+		visits.set_visitor_cookie(response, visitor)
+	return response
+
+@catalog_condition(index_last_modified)
+def index_page(request, num_visits):
+	"""
+	Renders the home page, unless the client's copy is up to date (the record
+	counts haven't changed since).
+	"""
+	# The counts of the main objects are kept up to date by signals in a
+	# single row, so this is one primary key lookup rather than six table scans
+	# (already done by index_last_modified).
+	stats = getattr(request, 'catalog_stats', None) or CatalogStats.load()
 	
 	# Render the HTML template index.html with the data in the context variable
 	return render(request, 'catalog/index.html',
-		context={'num_books':num_books,
-				 'num_instances':num_instances,
-				 'num_instances_available':num_instances_available,
-				 'num_authors':num_authors,
-				 'num_genres':num_genres,
-				 'filter_word':filter_word,
-				 'num_books_word':num_books_word,
+		context={'num_books':stats.num_books,
+				 'num_instances':stats.num_instances,
+				 'num_instances_available':stats.num_instances_available,
+				 'num_authors':stats.num_authors,
+				 'num_genres':stats.num_genres,
+				 'filter_word':CatalogStats.FILTER_WORD,
+				 'num_books_word':stats.num_books_word,
 				 'num_visits':num_visits},
 	)
 
-class BookListView(generic.ListView):
+@method_decorator(catalog_condition(book_list_last_modified), name='dispatch')
+class BookListView(CursorPaginationMixin, generic.ListView):
 	"""
-	Class view for all the books in the library.
+	Class view for all the books in the library. Paged by title with cursors,
+	or by the number of copies available (?sort=available). ?available=1
+	lists only the books with a copy available.
 	"""
 	model = Book
 	paginate_by = 10
+	# The ?sort= choices (each served by an index, see Book.Meta)
+	sort_orderings = {'title': 'title', 'available': '-num_available'}
 	# To reference the model objects in the template view as: 'book_list' or 'object_list'
 	#context_object_name = 'my_book_list'   # your own name for the list as a template variable
 	#queryset = Book.objects.filter(title__icontains='war')[:5] # Get 5 books containing the title war
@@ -60,10 +83,23 @@ class BookListView(generic.ListView):
 	
 	def get_queryset(self):
 		"""
-		Overwrites the generic.ListView method. Gets the first 5 books with 'war' in
-		their title.
+		Overwrites the generic.ListView method. Gets all the books (a sliced
+		queryset, e.g. [:5], can't be cursor paginated).
 		"""
-		return Book.objects.filter(title__icontains='')[:5] # Get 5 books containing the title war
+		books = Book.objects.all()
+		if self.available_only():
+			books = books.filter(num_available__gt=0)
+		return books
+
+	def available_only(self):
+		return self.request.GET.get('available') == '1'
+
+	def get_sort(self):
+		sort = self.request.GET.get('sort')
+		return sort if sort in self.sort_orderings else 'title'
+
+	def get_cursor_ordering(self):
+		return self.sort_orderings[self.get_sort()]
 
 	def get_context_data(self, **kwargs):
 		"""
@@ -74,13 +110,22 @@ class BookListView(generic.ListView):
 		context = super(BookListView, self).get_context_data(**kwargs)
 		# Get the blog from id and add it to the context
 		context['some_data'] = 'This is just some data'
+		context['available_only'] = self.available_only()
+		context['sort'] = self.get_sort()
 		return context
 	
-class BookDetailView(generic.DetailView):
+@method_decorator(catalog_condition(book_last_modified), name='dispatch')
+class BookDetailView(CachedFragmentMixin, generic.DetailView):
 	"""
 	Class view for an particular (title) book. Displays all book instances.
+	The author is joined and the genres and copies are prefetched, so the page
+	costs the same (three) queries however many copies the book has, and none
+	at all once the page fragment is cached.
 	"""
 	model = Book
+	fragment_name = 'book_detail'
+	fragment_kind = 'book'
+	queryset = Book.objects.select_related('author').prefetch_related('genre', 'bookinstance_set')
 
 def book_detail_view(request,pk):
 	try:
@@ -97,14 +142,118 @@ def book_detail_view(request,pk):
 	)
 
 
-class AuthorListView(generic.ListView):
+def book_search(request):
+	"""
+	View function for full-text search over book titles, summaries and author
+	names, with the best matches first.
+	"""
+	page_size = 10
+	form = SearchForm(request.GET or None)
+	query = ''
+	page = 1
+	books = []
+	if form.is_valid():
+		query = form.cleaned_data['q']
+		page = form.cleaned_data['page'] or 1
+		# Get one extra result to find out whether there is a next page
+		books = search_books(query, offset=(page - 1) * page_size, limit=page_size + 1)
+
+	return render(request, 'catalog/book_search.html',
+		context={'form':form,
+				 'query':query,
+				 'book_list':books[:page_size],
+				 'page':page,
+				 'has_previous':page > 1,
+				 'has_next':len(books) > page_size and page < SearchForm.MAX_PAGE},
+	)
+
+
+def catalog_autocomplete(request):
+	"""
+	Returns the books and authors whose title or name starts with ?q=, as JSON
+	for type-ahead boxes. ?kind=book or ?kind=author returns only those, and
+	?limit= sets the number of results (10 by default). Answered from the
+	in-memory index in catalog/autocomplete.py, without a query per keystroke.
+	"""
+	form = AutocompleteForm(request.GET)
+	if not form.is_valid():
+		return JsonResponse({'errors': form.errors}, status=400)
+	query = form.cleaned_data['q']
+	results = autocomplete.index.lookup(query, limit=form.cleaned_data['limit'] or 10,
+		kind=form.cleaned_data['kind'] or None)
+	return JsonResponse({
+		'query': query,
+		'results': [{'kind': kind, 'id': pk, 'label': label, 'url': reverse('%s-detail' % kind, args=[str(pk)])}
+			for kind, pk, label in results],
+	})
+
+
+PICKER_PAGE_SIZE = 20
+# Search results a picker can page through (it is for picking, not browsing)
+PICKER_MAX_OFFSET = 1000
+
+def picker_choices(request, kind):
+	"""
+	Returns a page of authors or genres (kind) as JSON, for the lazy pickers
+	in the book form (see catalog/widgets.py): {"results": [{"id", "label"}],
+	"next": the URL of the next page, or null}. Without ?q= the choices are
+	listed in name order, paged with a cursor over the (name, id) index. Authors
+	searched with ?q= come from the autocomplete index (first or last name
+	prefix), and genres from a prefix filter on their normalized name_key.
+	"""
+	query = request.GET.get('q', '').strip()
+	if kind == 'authors' and query:
+		try:
+			offset = min(max(int(request.GET.get('offset', 0)), 0), PICKER_MAX_OFFSET)
+		except ValueError:
+			return JsonResponse({'error': 'Invalid offset'}, status=400)
+		matches = autocomplete.index.lookup(query, limit=offset + PICKER_PAGE_SIZE + 1, kind='author')
+		results = [{'id': pk, 'label': label} for match_kind, pk, label in matches[offset:offset + PICKER_PAGE_SIZE]]
+		next_params = {'q': query, 'offset': offset + PICKER_PAGE_SIZE} if len(matches) > offset + PICKER_PAGE_SIZE else None
+	else:
+		if kind == 'authors':
+			paginator = CursorPaginator(Author.objects.values('id', 'last_name', 'first_name'), PICKER_PAGE_SIZE, 'last_name')
+		else:
+			if query:
+				# Read from the (name_key, id) index, in that order
+				genres = Genre.objects.filter(prefix_filter('name_key', normalize(query))).values('id', 'name', 'name_key')
+				paginator = CursorPaginator(genres, PICKER_PAGE_SIZE, 'name_key')
+			else:
+				paginator = CursorPaginator(Genre.objects.values('id', 'name'), PICKER_PAGE_SIZE, 'name')
+		try:
+			page = paginator.page(request.GET.get('cursor'))
+		except InvalidCursor:
+			return JsonResponse({'error': 'Invalid cursor'}, status=400)
+		results = [{'id': row['id'], 'label': row['name'] if kind == 'genres' else '%s, %s' % (row['last_name'], row['first_name'])}
+			for row in page]
+		next_params = dict({'q': query} if query else {}, cursor=page.next_cursor) if page.has_next() else None
+	return JsonResponse({
+		'results': results,
+		'next': '%s?%s' % (request.path, urlencode(next_params)) if next_params else None,
+	})
+
+
+@method_decorator(catalog_condition(author_list_last_modified), name='dispatch')
+class AuthorListView(CursorPaginationMixin, generic.ListView):
 	paginate_by = 10
 	model = Author
 
-class AuthorDetailView(generic.DetailView):
+@method_decorator(catalog_condition(author_last_modified), name='dispatch')
+class AuthorDetailView(CachedFragmentMixin, generic.DetailView):
+	"""
+	Class view for a particular author. Displays their books with the number of
+	copies of each (stored on the book, see Book.num_copies), so the books are
+	loaded with one prefetch query. Once the page fragment is cached it costs
+	no queries.
+	"""
 	model = Author
+	fragment_name = 'author_detail'
+	fragment_kind = 'author'
+	queryset = Author.objects.prefetch_related('book_set')
 
-class LoanedBooksByUserListView(LoginRequiredMixin, generic.ListView):
+# On get() rather than dispatch(), so only after the login and permission checks
+@method_decorator(catalog_condition(loan_list_last_modified), name='get')
+class LoanedBooksByUserListView(LoginRequiredMixin, CursorPaginationMixin, generic.ListView):
 	"""
 	Generic class-based view listing books on loan to current user. 
 	"""
@@ -113,9 +262,12 @@ class LoanedBooksByUserListView(LoginRequiredMixin, generic.ListView):
 	paginate_by = 10
 	
 	def get_queryset(self):
-		return BookInstance.objects.filter(borrower=self.request.user).filter(status__exact='o').order_by('due_back')
+		return (BookInstance.objects.filter(borrower=self.request.user).filter(status__exact='o')
+			.with_overdue().select_related('book').order_by('due_back'))
 
-class AllLoanedBooksByUserListView(PermissionRequiredMixin, generic.ListView):
+# On get() rather than dispatch(), so only after the login and permission checks
+@method_decorator(catalog_condition(loan_list_last_modified), name='get')
+class AllLoanedBooksByUserListView(PermissionRequiredMixin, CursorPaginationMixin, generic.ListView):
 	"""
 	Generic class-based view listing books on loan in the library.
 	Only visible to librarians. 
@@ -125,11 +277,27 @@ class AllLoanedBooksByUserListView(PermissionRequiredMixin, generic.ListView):
 	template_name ='catalog/bookinstance_list_borrowed_all.html'
 	paginate_by = 10
 
+	def overdue_only(self):
+		"""
+		Whether to only list the overdue loans (?overdue=1).
+		"""
+		return self.request.GET.get('overdue') == '1'
+
 	def get_queryset(self):
 		"""
-		Only return books that are on loan.
+		Only return books that are on loan (and overdue, if asked).
 		"""
-		return BookInstance.objects.filter(status__exact='o').order_by('due_back')
+		loans = BookInstance.objects.filter(status__exact='o')
+		if self.overdue_only():
+			loans = loans.overdue()
+		return loans.with_overdue().select_related('book').order_by('due_back')
+
+	def get_context_data(self, **kwargs):
+		context = super(AllLoanedBooksByUserListView, self).get_context_data(**kwargs)
+		context['overdue_only'] = self.overdue_only()
+		# Counted from the (status, due_back) index
+		context['num_overdue'] = BookInstance.objects.filter(status__exact='o').overdue().count()
+		return context
 
 # An alternative to the class RenewBookForm defined forms.py 
 # Class based forms are good for complex forms, or forms using fields from different models.
@@ -208,14 +376,14 @@ class AuthorDelete(PermissionRequiredMixin, DeleteView):
 class BookCreate(PermissionRequiredMixin, CreateView):
 	permission_required = 'catalog.can_modify_book'
 	model = Book
-	fields = '__all__'
+	form_class = BookForm
 	initial={'summary':'Please write a blurb here...',}
 	#template_name_suffix = '_form' # Default template name. The smae for Update and Create.
 
 class BookUpdate(PermissionRequiredMixin, UpdateView):
 	permission_required = 'catalog.can_modify_book'
 	model = Book
-	fields = ['title','author','summary','isbn', 'genre']
+	form_class = BookForm
 
 class BookDelete(PermissionRequiredMixin, DeleteView):
 	permission_required = 'catalog.can_modify_book'
@@ -224,7 +392,7 @@ class BookDelete(PermissionRequiredMixin, DeleteView):
 	#template_name_suffix = '_confirm_delete' # Default template name.
 
 
-from django.contrib.auth.decorators import permission_required
+from django.contrib.auth.decorators import login_required, permission_required
 @permission_required('catalog.can_renew')
 def renew_book_librarian(request, pk):
 	"""
@@ -253,4 +421,99 @@ def renew_book_librarian(request, pk):
 		proposed_renewal_date = datetime.date.today() + datetime.timedelta(weeks=3)
 		form = RenewBookForm(initial={'renewal_date': proposed_renewal_date,})
 
-	return render(request, 'catalog/book_renew_librarian.html', {'form': form, 'bookinst':book_inst})
\ No newline at end of file
+	return render(request, 'catalog/book_renew_librarian.html', {'form': form, 'bookinst':book_inst})
+
+@permission_required('catalog.can_mark_returned')
+def bulk_loans_librarian(request):
+	"""
+	Allow librarians to renew or return many copies (identified by their
+	ids) at once, showing the result for each copy.
+	"""
+	results = None
+	if request.method == 'POST':
+		form = BulkLoanForm(request.POST)
+		if form.is_valid():
+			ids = form.cleaned_data['instances']
+			if form.cleaned_data['action'] == BulkLoanForm.RENEW:
+				if not request.user.has_perm('catalog.can_renew'):
+					raise PermissionDenied
+				results = loans.bulk_renew(ids, form.cleaned_data['renewal_date'])
+			else:
+				results = loans.bulk_return(ids)
+			# Start again with an empty list of copies
+			form = BulkLoanForm(initial={'action': form.cleaned_data['action'],
+				'renewal_date': form.cleaned_data['renewal_date']})
+	else:
+		proposed_renewal_date = datetime.date.today() + datetime.timedelta(weeks=3)
+		form = BulkLoanForm(initial={'renewal_date': proposed_renewal_date,})
+
+	return render(request, 'catalog/bookinstance_bulk_librarian.html', {'form': form, 'results': results})
+
+
+def _change_loan(request, book_inst, title, change, success_url, form=None):
+	"""
+	Shows the confirmation page for a change to a copy (and the form, if
+	any), or on a valid POST, makes the change with change(form). If the copy
+	was changed by someone else in the meantime, the page is shown again with
+	the reason and a 409 (Conflict) status.
+	"""
+	error = None
+	if request.method == 'POST' and (form is None or form.is_valid()):
+		try:
+			change(form)
+		except loans.LoanConflict as e:
+			error = str(e)
+		else:
+			return HttpResponseRedirect(success_url)
+	return render(request, 'catalog/bookinstance_loan_form.html',
+		{'form': form, 'bookinst': book_inst, 'title': title, 'error': error}, status=409 if error else 200)
+
+
+def _get_copy(pk):
+	return get_object_or_404(BookInstance.objects.select_related('book', 'borrower'), pk=pk)
+
+@permission_required('catalog.can_mark_returned')
+def checkout_book_librarian(request, pk):
+	"""
+	Allow librarians to lend a copy that is available (or reserved for the
+	borrower).
+	"""
+	book_inst = _get_copy(pk)
+	if request.method == 'POST':
+		form = CheckoutForm(request.POST)
+	else:
+		initial = {'due_back': datetime.date.today() + loans.LOAN_PERIOD}
+		if book_inst.status == 'r' and book_inst.borrower:
+			initial['borrower'] = book_inst.borrower.username
+		form = CheckoutForm(initial=initial)
+	return _change_loan(request, book_inst, 'Lend',
+		lambda form: loans.checkout(pk, form.cleaned_data['borrower'], form.cleaned_data['due_back']),
+		reverse('all-borrowed'), form)
+
+@permission_required('catalog.can_mark_returned')
+def return_book_librarian(request, pk):
+	"""
+	Allow librarians to mark a copy that is on loan as returned.
+	"""
+	return _change_loan(request, _get_copy(pk), 'Return', lambda form: loans.return_copy(pk), reverse('all-borrowed'))
+
+@login_required
+def reserve_book(request, pk):
+	"""
+	Allow a user to reserve an available copy for themselves.
+	"""
+	book_inst = _get_copy(pk)
+	return _change_loan(request, book_inst, 'Reserve', lambda form: loans.reserve(pk, request.user),
+		reverse('book-detail', args=[book_inst.book_id]))
+
+
+@permission_required('catalog.can_mark_returned')
+def export_catalog(request, kind, format):
+	"""
+	Streams the whole of one table of the catalog (books, authors or copies,
+	the latter with their status and borrower) as a CSV or JSON lines download.
+	Only for librarians.
+	"""
+	response = StreamingHttpResponse(export.export_lines(kind, format), content_type=export.CONTENT_TYPES[format])
+	response['Content-Disposition'] = 'attachment; filename="%s.%s"' % (kind, format)
+	return response
@@ -0,0 +1,127 @@
+import logging
+import threading
+import time
+import uuid
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, transaction
+from django.db.models import F
+from .models import VisitCount
+
+# Home page visit counting without a database (or session) write per visit.
+# Each visit increments the visitor's running total in the cache, and is added
+# to an in-process buffer. The buffer is written to the VisitCount table as one
+# batch once it holds VISIT_COUNTER_FLUSH_THRESHOLD visits, or when a visit
+# arrives more than VISIT_COUNTER_FLUSH_INTERVAL seconds after the last flush.
+# Visits still in the buffer when a process stops are lost, so the stored
+# counts are approximate.
+
+logger = logging.getLogger('catalog.visits')
+
+VISITOR_COOKIE = 'visitor'
+VISITOR_COOKIE_AGE = 365 * 24 * 60 * 60 # One year, in seconds
+
+
+def get_visitor(request):
+	"""
+	Returns (visitor, is_new) for the request. Users are counted across all
+	their sessions, anonymous browsers by a random id in the visitor cookie
+	(is_new is True if that cookie still needs to be set).
+	"""
+	if request.user.is_authenticated:
+		return 'user:%d' % request.user.pk, False
+	visitor = request.COOKIES.get(VISITOR_COOKIE, '')
+	if len(visitor) == 32 and visitor.isalnum():
+		return 'anon:%s' % visitor, False
+	return 'anon:%s' % uuid.uuid4().hex, True
+
+
+def set_visitor_cookie(response, visitor):
+	"""
+	Stores an anonymous visitor's id in the visitor cookie.
+	"""
+	response.set_cookie(VISITOR_COOKIE, visitor.split(':', 1)[1], max_age=VISITOR_COOKIE_AGE,
+		secure=settings.SESSION_COOKIE_SECURE, httponly=True)
+
+
+class VisitCounter(object):
+	"""
+	Counts visits in the cache and writes them to the database in batches.
+	"""
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.pending = {} # Visits per visitor not yet written to the database
+		self.num_pending = 0
+		self.last_flush = time.time()
+
+	@property
+	def flush_threshold(self):
+		return getattr(settings, 'VISIT_COUNTER_FLUSH_THRESHOLD', 100)
+
+	@property
+	def flush_interval(self):
+		return getattr(settings, 'VISIT_COUNTER_FLUSH_INTERVAL', 30)
+
+	def cache_key(self, visitor):
+		return 'catalog:visits:%s' % visitor
+
+	def record(self, visitor):
+		"""
+		Counts a visit and returns the visitor's total number of visits
+		(including this one).
+		"""
+		with self.lock:
+			self.pending[visitor] = self.pending.get(visitor, 0) + 1
+			self.num_pending += 1
+			flush_due = (self.num_pending >= self.flush_threshold
+				or time.time() - self.last_flush >= self.flush_interval)
+
+		key = self.cache_key(visitor)
+		try:
+			total = cache.incr(key)
+		except ValueError:
+			# Not cached yet (or evicted): start from the stored count plus
+			# the visits buffered here, which include this one.
+			stored = VisitCount.objects.filter(visitor=visitor).values_list('count', flat=True).first() or 0
+			total = stored + self.pending.get(visitor, 0)
+			cache.set(key, total)
+
+		if flush_due:
+			try:
+				self.flush()
+			except DatabaseError:
+				# The visits are kept for the next flush; the page doesn't fail
+				logger.exception('Could not write the buffered visits')
+		return total
+
+	def flush(self):
+		"""
+		Writes the buffered visits to the database in one transaction, and
+		returns the number of visitors updated.
+		"""
+		with self.lock:
+			pending, self.pending = self.pending, {}
+			self.num_pending = 0
+			self.last_flush = time.time()
+		if not pending:
+			return 0
+
+		try:
+			with transaction.atomic():
+				# Make sure every visitor has a row (another process may be adding
+				# the same ones), then add the deltas to the stored counts.
+				VisitCount.objects.bulk_create([VisitCount(visitor=visitor) for visitor in pending], ignore_conflicts=True)
+				for visitor, delta in pending.items():
+					VisitCount.objects.filter(visitor=visitor).update(count=F('count') + delta)
+		except Exception:
+			# Put the visits back, to be written by the next flush
+			with self.lock:
+				for visitor, delta in pending.items():
+					self.pending[visitor] = self.pending.get(visitor, 0) + delta
+					self.num_pending += delta
+			raise
+		return len(pending)
+
+
+# The counter shared by the views in this process
+counter = VisitCounter()
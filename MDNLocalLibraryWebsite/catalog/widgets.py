@@ -0,0 +1,60 @@
+from django import forms
+from django.core.exceptions import ValidationError
+
+# Select widgets for model choice fields over big tables (e.g. a book's author
+# and genres). Django's Select renders every row of the field's queryset as an
+# <option>; these render only the selected ones, and static/catalog/js/picker.js
+# loads the rest as the user searches or scrolls, a page at a time, from a
+# lookup URL (see views.picker_choices). On POST the form field still only
+# looks up the submitted ids.
+
+
+class LazyChoicesMixin(object):
+	"""
+	Renders only the selected options of a ModelChoiceField or
+	ModelMultipleChoiceField. The lookup URL returns the other choices as JSON.
+	"""
+	def __init__(self, lookup_url, attrs=None):
+		super().__init__(attrs)
+		self.lookup_url = lookup_url
+
+	class Media:
+		js = ('catalog/js/picker.js',)
+
+	def selected_choices(self, value):
+		"""
+		Returns the (value, label) choices of the selected objects only.
+		"""
+		iterator = self.choices
+		selected = [v for v in value if v not in (None, '')]
+		choices = []
+		if not self.allow_multiple_selected and iterator.field.empty_label is not None:
+			choices.append(('', iterator.field.empty_label))
+		if selected:
+			try:
+				choices += [iterator.choice(obj) for obj in iterator.queryset.filter(pk__in=selected)]
+			except (ValueError, ValidationError):
+				# Invalid ids submitted with the form, which reports them as errors
+				pass
+		return choices
+
+	def optgroups(self, name, value, attrs=None):
+		choices = self.choices
+		self.choices = self.selected_choices(value)
+		try:
+			return super().optgroups(name, value, attrs)
+		finally:
+			self.choices = choices
+
+	def build_attrs(self, base_attrs, extra_attrs=None):
+		attrs = super().build_attrs(base_attrs, extra_attrs)
+		attrs['data-lookup-url'] = str(self.lookup_url)
+		return attrs
+
+
+class LazySelect(LazyChoicesMixin, forms.Select):
+	pass
+
+
+class LazySelectMultiple(LazyChoicesMixin, forms.SelectMultiple):
+	pass